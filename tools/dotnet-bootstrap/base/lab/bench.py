@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+# A benchmark of the bootstrap's own overhead. dotnet.bootstrap.py runs end to end against synthetic stand-ins - a generated payload,
+# local bare repositories and stub build scripts that sleep and then emit their outputs - so nothing is downloaded or compiled, and
+# its trace (see -trace) is broken down in to extraction throughput, fetch, build and patch times, and the orchestration overhead of
+# each phase (the time that it spends outside of the commands that it runs). Runs offline, so pipeline changes can be compared in CI.
+
+import os
+import sys
+import imp
+import json
+import time
+import random
+import shutil
+import tarfile
+import tempfile
+import argparse
+import threading
+import multiprocessing
+
+from subprocess import call
+from subprocess import check_call
+from subprocess import check_output
+from subprocess import STDOUT
+
+from os.path   import join, exists, dirname, realpath, relpath
+
+class Bench:
+    _labPath = dirname(realpath(__file__))
+    _bootstrap = realpath(join(_labPath, '../../dotnet.bootstrap.py'))
+
+    # the stand-in for each repository: {component: {script: [outputs]}}, relative to the root of the repository.
+    # the scripts are the ones that the bootstrap runs (libuv's make runs build.sh); each sleeps for as long as a build takes, then emits its outputs.
+    _stubs = {
+        'coreclr'       : { 'build.sh'                      : ['bin/Product/Linux.x64.Release/%s'%(name) for name in ['libcoreclr.so', 'libclrjit.so', 'libmscordaccore.so', 'libsos.so', 'System.Globalization.Native.so', 'corerun', 'crossgen']] },
+        'corefx'        : { 'src/Native/build-native.sh'    : ['bin/Linux.x64.Release/Native/%s'%(name) for name in ['System.Native.so', 'System.Net.Http.Native.so', 'System.Security.Cryptography.Native.so', 'System.Globalization.Native.so']] },
+        'core-setup'    : { 'src/corehost/build.sh'         : ['src/corehost/cli/exe/dotnet', 'src/corehost/cli/dll/libhostpolicy.so', 'src/corehost/cli/fxr/libhostfxr.so'] },
+        'libuv'         : { 'autogen.sh' : [], 'configure' : [], 'build.sh' : ['.libs/libuv.so'] }
+    }
+
+    # the metrics where more is better; the rest are seconds.
+    _throughputs = ['extraction MB/s', 'extraction files/s']
+
+    def _stubScript(self, script, outputs):
+        lines = ['#!/bin/sh',
+                 '# a stand-in for the real build: takes as long as one, and leaves its outputs where the real one would.',
+                 'cd "$(dirname "$0")/%s"'%(relpath('.', dirname(script) or '.'))]
+
+        if outputs:
+            lines.append('sleep %s'%(self._buildSeconds))
+
+        for output in outputs:
+            lines.append('mkdir -p %s && head -c %d /dev/urandom > %s'%(dirname(output) or '.', self._outputSize, output))
+
+        return '\n'.join(lines) + '\n'
+
+    # creates a bare repository of each component in <work>/remotes; returns {component: commit hash}
+    def _repositories(self):
+        remotes = join(self._work, 'remotes')
+        commits = {}
+
+        # fixed dates and authors, so that the same stubs are the same commits.
+        env = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@localhost', GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@localhost',
+                               GIT_AUTHOR_DATE='2017-01-01T00:00:00', GIT_COMMITTER_DATE='2017-01-01T00:00:00')
+
+        with open(os.devnull, 'w') as devnull:
+            for component, scripts in sorted(self._stubs.items()):
+                source = join(self._work, 'sources', component)
+                shutil.rmtree(source, ignore_errors=True)
+                os.makedirs(source)
+
+                for script, outputs in scripts.items():
+                    if not exists(dirname(join(source, script))):
+                        os.makedirs(dirname(join(source, script)))
+
+                    with open(join(source, script), 'w') as script_file:
+                        script_file.write(self._stubScript(script, outputs))
+                    os.chmod(join(source, script), 0o755)
+
+                if component == 'libuv':
+                    with open(join(source, 'Makefile'), 'w') as makefile:
+                        makefile.write('all:\n\t./build.sh\n')
+
+                check_call('git init -q . && git add -A && git commit -q -m stub', shell=True, cwd=source, env=env, stdout=devnull)
+                commits[component] = check_output(['git', 'rev-parse', 'HEAD'], cwd=source).strip()
+
+                shutil.rmtree(join(remotes, component), ignore_errors=True)
+                check_call(['git', 'clone', '-q', '--bare', source, join(remotes, component)], stdout=devnull)
+
+        return commits
+
+    # generates the payload: a dotnet install tree of about payload_size bytes in file_count files, whose native binaries are
+    # stamped with the commits of the stand-in repositories. returns (tarball path, bytes, files)
+    def _payload(self, commits):
+        tree = join(self._work, 'payload')
+        tarball = join(self._work, 'payload-%d-%d.tar.gz'%(self._fileCount, self._payloadSize))
+
+        shared = 'shared/Microsoft.NETCore.App/1.0.0'
+        directories = [shared, 'sdk/1.0.0-preview', 'host/fxr/1.0.0']
+
+        stamped = {
+            join(shared, 'libcoreclr.so')       : '@(#)Version 1.0.0 Commit Hash: %s\0'%(commits['coreclr']),
+            join(shared, 'System.Native.so')    : '@(#)Version 1.0.0 Commit Hash: %s\0'%(commits['corefx']),
+            join(shared, 'dotnet')              : '%s\0'%(commits['core-setup']),
+            'dotnet'                            : '%s\0'%(commits['core-setup'])
+        }
+
+        shutil.rmtree(tree, ignore_errors=True)
+        for directory in directories:
+            os.makedirs(join(tree, directory))
+
+        # about half of a file is noise and the rest compresses away, which is roughly what the real payload is like.
+        generator = random.Random(0)
+        noise = os.urandom(1024 * 1024)
+        average = self._payloadSize / max(1, self._fileCount)
+
+        files = sorted(stamped.keys())
+        files.extend(join(directories[index % 2], 'Bench.Assembly%04d.dll'%(index)) for index in range(max(0, self._fileCount - len(stamped))))
+
+        total = 0
+        for name in files:
+            size = generator.randint(average / 2, average * 3 / 2)
+            offset = generator.randint(0, len(noise) - size / 2) if size / 2 < len(noise) else 0
+
+            with open(join(tree, name), 'wb') as payload_file:
+                payload_file.write(stamped.get(name, ''))
+                payload_file.write(noise[offset:offset + size / 2])
+                payload_file.write('\0' * (size - size / 2))
+
+            total += os.path.getsize(join(tree, name))
+
+        with tarfile.open(tarball, 'w:gz') as payload_tar:
+            for name in sorted(os.listdir(tree)):
+                payload_tar.add(join(tree, name), arcname=name)
+
+        shutil.rmtree(tree)
+        return (tarball, total, len(files))
+
+    # the time within [start, end] that is covered by at least one of the spans.
+    @staticmethod
+    def _covered(spans, start, end):
+        covered = 0
+        reached = start
+
+        for span_start, span_end in sorted(spans):
+            span_start, span_end = max(span_start, reached), min(span_end, end)
+
+            if span_end > span_start:
+                covered += span_end - span_start
+                reached = span_end
+
+        return covered
+
+    # breaks a trace of the bootstrap down in to metrics; {name: value}
+    def _measure(self, trace_path, wall_time, payload_bytes, payload_files):
+        with open(trace_path) as trace_file:
+            events = json.load(trace_file)['traceEvents']
+
+        run = [event for event in events if event['cat'] == 'run'][0]
+        commands = [(event['ts'], event['ts'] + event['dur']) for event in events if event['cat'] == 'shell']
+
+        metrics = {
+            'wall seconds'      : wall_time,
+            'startup seconds'   : wall_time - run['dur'] / 1000000.0 # the interpreter, the imports and writing out the trace
+        }
+
+        for event in events:
+            # the phases, or the steps of -pipeline
+            if event['cat'] in ['phase', 'pipeline'] and event['pid'] == run['pid']:
+                seconds = event['dur'] / 1000000.0
+                metrics['%s seconds'%(event['name'])] = seconds
+                metrics['%s overhead seconds'%(event['name'])] = seconds - self._covered(commands, event['ts'], event['ts'] + event['dur']) / 1000000.0
+
+            if event['cat'] == 'build':
+                metrics['build %s seconds'%(event['name'])] = event['dur'] / 1000000.0
+
+        extraction_seconds = metrics.get('SpawnPatchTarget seconds') or metrics.get('payload seconds')
+        if extraction_seconds:
+            metrics['extraction MB/s'] = payload_bytes / extraction_seconds / (1024 * 1024)
+            metrics['extraction files/s'] = payload_files / extraction_seconds
+
+        return metrics
+
+    # one end to end run of the bootstrap, in a directory of its own (so that none of them is in DevMode); returns its metrics.
+    def _run(self, index, payload, commits):
+        directory = join(self._work, 'run%d'%(index))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+        # a copy, since the bootstrap goes in to DevMode when there is a working directory next to it.
+        bootstrap = join(directory, 'dotnet.bootstrap.py')
+        shutil.copy(self._bootstrap, bootstrap)
+
+        tarball, payload_bytes, payload_files = payload
+        trace_path = join(directory, 'trace.json')
+
+        cmd = [sys.executable, bootstrap, '-to', join(directory, 'rover'), '-payload', tarball, '-git-remote-base', join(self._work, 'remotes'),
+               '-libuv-commit', commits['libuv'], '-jobs', str(self._jobs), '-cache-dir', join(directory, 'cache'), '-no-cache', '-trace', trace_path]
+
+        if self._pipeline:
+            cmd.append('-pipeline')
+
+        # the payload again, as more trees to patch.
+        if self._trees:
+            cmd.extend(['-patch-trees'] + [tarball] * self._trees)
+
+        with open(join(directory, 'rover.log'), 'w') as log_file:
+            start = time.time()
+            exit_code = call(cmd, cwd=directory, stdout=log_file, stderr=STDOUT)
+            wall_time = time.time() - start
+
+        if exit_code != 0 or not exists(trace_path):
+            with open(join(directory, 'rover.log')) as log_file:
+                sys.stdout.write(''.join(log_file.readlines()[-20:]))
+
+            print('the bootstrap failed in run %d (exit code %d); its log is %s'%(index, exit_code, join(directory, 'rover.log')))
+            sys.exit(1)
+
+        return self._measure(trace_path, wall_time, payload_bytes, payload_files)
+
+    @staticmethod
+    def _median(values):
+        values = sorted(values)
+        middle = len(values) / 2
+
+        if len(values) % 2:
+            return values[middle]
+
+        return (values[middle - 1] + values[middle]) / 2.0
+
+    # a metric is worse than its baseline when it moved the wrong way by more than threshold (and, for times, by more than 50ms)
+    def _regressed(self, name, value, baseline, threshold):
+        if name in self._throughputs:
+            return value < baseline * (1 - threshold)
+
+        return value > baseline * (1 + threshold) and value - baseline > 0.05
+
+    # runs the benchmark; prints the median, min and max of every metric over the runs (and how the medians compare to those
+    # of the baseline, when there is one). Returns the number of metrics that got worse than the baseline.
+    def Run(self, runs = 3, out = None, baseline = None, threshold = 0.2):
+        print('generating the stand-ins in %s'%(self._work))
+        commits = self._repositories()
+        payload = self._payload(commits)
+        print('payload: %d files, %.1f MB; builds: %.1fs each, %d jobs'%(payload[2], payload[1] / (1024.0 * 1024), self._buildSeconds, self._jobs))
+
+        results = []
+        for index in range(runs):
+            results.append(self._run(index, payload, commits))
+            print('run %d: %.2fs'%(index, results[-1]['wall seconds']))
+
+        names = sorted(set(name for result in results for name in result))
+        medians = dict((name, self._median([result[name] for result in results if name in result])) for name in names)
+
+        baseline_medians = {}
+        if baseline:
+            with open(baseline) as baseline_file:
+                baseline_medians = json.load(baseline_file)['median']
+
+        regressions = 0
+        print("METRIC - MEDIAN - MIN - MAX%s"%(" - BASELINE - CHANGE" if baseline_medians else ""))
+        for name in names:
+            values = [result[name] for result in results if name in result]
+            line = "%s - %.3f - %.3f - %.3f"%(name, medians[name], min(values), max(values))
+
+            if name in baseline_medians:
+                change = (medians[name] - baseline_medians[name]) / baseline_medians[name] * 100 if baseline_medians[name] else 0
+                line += " - %.3f - %+.0f%%"%(baseline_medians[name], change)
+
+                if self._regressed(name, medians[name], baseline_medians[name], threshold):
+                    line += " - WORSE"
+                    regressions += 1
+
+            print(line)
+
+        if out:
+            with open(out, 'w') as out_file:
+                json.dump({'parameters': {'files': payload[2], 'payload bytes': payload[1], 'build seconds': self._buildSeconds, 'jobs': self._jobs, 'runs': runs, 'pipeline': self._pipeline, 'trees': self._trees},
+                           'runs': results, 'median': medians}, out_file, indent=4, sort_keys=True)
+
+            print('wrote the results to %s'%(out))
+
+        if baseline_medians:
+            print('%d metrics got worse than the baseline by more than %d%%'%(regressions, threshold * 100))
+
+        return regressions
+
+    # not a benchmark: checks that a build that raises in the middle of a series (rather than failing a command) still gives back
+    # what it was admitted with, so that the builds queued behind it get to run. The builds run in the bootstrap's own worker pool,
+    # against a budget that only lets one in at a time. Returns the number of problems (a hang is one).
+    def CheckFailedBuild(self, timeout = 120):
+        rover = imp.load_source('roverbootstrap', self._bootstrap) # (the pool's workers find its functions under this name)
+        components = ['coreclr', 'corefx', 'libuv']
+
+        rover.RoverSettings.SetWorkingDirectory(join(self._work, 'check'))
+        rover.RoverSettings.CacheDirectory = join(self._work, 'check', 'cache')
+        rover.RoverSettings.Jobs = len(components)
+        rover.RoverSettings.Admission = rover.RoverAdmission(1) # (KB) so the builds are let in one by one.
+        rover.ComponentBuildSteps = lambda component, git_directory, jobs: [('sleep %s'%(self._buildSeconds), self._work)]
+
+        # the first build raises while it sets up its environment, before any of its steps run.
+        def build_environment(component, env):
+            if component == components[0]:
+                raise IOError('a build that raises')
+
+            env['CCACHE_DIR'] = join(self._work, 'check', 'ccache')
+            return env
+
+        rover.RoverSettings.CompilerCacheLinks = join(self._work, 'check', 'ccache')
+        rover.CompilerCacheEnvironment = build_environment
+
+        results = []
+        builds = threading.Thread(target=lambda: results.extend(rover.RunBuildJobs(components, dict((component, self._work) for component in components))))
+        builds.daemon = True
+        builds.start()
+        builds.join(timeout)
+
+        if builds.is_alive():
+            print('FAILED: the builds after the one that raised are still waiting after %ds'%(timeout))
+            return 1
+
+        failed = sorted(component for component, elapsed, failed_cmd, failed_cwd, events, peak_memory in results if failed_cmd)
+        if failed != [components[0]]:
+            print('FAILED: expected only %s to fail, but %s did'%(components[0], ', '.join(failed) or 'none'))
+            return 1
+
+        print('ok: %s raised, and the %d builds after it ran'%(components[0], len(components) - 1))
+        return 0
+
+    def Close(self):
+        if not self._keep:
+            shutil.rmtree(self._work, ignore_errors=True)
+
+    def __init__(self, work = None, file_count = 2000, payload_size = 64 * 1024 * 1024, build_seconds = 1.0, output_size = 512 * 1024, jobs = None, pipeline = False, trees = 0):
+        self._keep = bool(work)
+        self._work = realpath(work) if work else tempfile.mkdtemp(prefix='dotnet-bootstrap-bench-')
+        self._fileCount = file_count
+        self._payloadSize = payload_size
+        self._buildSeconds = build_seconds
+        self._outputSize = output_size
+        self._jobs = jobs or multiprocessing.cpu_count()
+        self._pipeline = pipeline
+        self._trees = trees
+
+        if not exists(self._work):
+            os.makedirs(self._work)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks dotnet.bootstrap.py end to end against a generated payload, local repositories and stub builds.')
+    parser.add_argument('-runs', type=int, default=3, help='how many times to run the bootstrap (default is 3)')
+    parser.add_argument('-files', type=int, default=2000, help='how many files the payload has (default is 2000)')
+    parser.add_argument('-payload-mb', type=float, default=64, help='roughly how big the payload is, uncompressed (default is 64)')
+    parser.add_argument('-build-seconds', type=float, default=1.0, help='how long each stub build sleeps for (default is 1)')
+    parser.add_argument('-output-kb', type=int, default=512, help='how big each output of a stub build is (default is 512)')
+    parser.add_argument('-jobs', type=int, default=multiprocessing.cpu_count(), help='passed on to the bootstrap (default is %d)'%(multiprocessing.cpu_count()))
+    parser.add_argument('-pipeline', action='store_true', default=False, help='run the bootstrap with -pipeline')
+    parser.add_argument('-trees', type=int, default=0, help='have the bootstrap patch this many more copies of the payload (-patch-trees)')
+    parser.add_argument('-dir', type=str, default=None, help='where to generate the stand-ins and run the bootstrap; kept afterwards (default is a temporary directory, which is removed)')
+    parser.add_argument('-out', type=str, default=None, help='write every run and the medians to this JSON file')
+    parser.add_argument('-compare', type=str, default=None, help='compare the medians with those of an earlier -out, and exit with 1 if any got worse')
+    parser.add_argument('-threshold', type=float, default=0.2, help='how much worse than the baseline a metric may get before it is flagged (default is 0.2, 20%%)')
+    parser.add_argument('-check-failed-build', action='store_true', default=False, help='rather than benchmarking, check that a build that raises halfway through a series does not hold up the builds after it (exits with 1 if it does)')
+    args = parser.parse_args()
+
+    bench = Bench(args.dir, args.files, int(args.payload_mb * 1024 * 1024), args.build_seconds, args.output_kb * 1024, args.jobs, args.pipeline, args.trees)
+    try:
+        if args.check_failed_build:
+            regressions = bench.CheckFailedBuild()
+        else:
+            regressions = bench.Run(args.runs, args.out, args.compare, args.threshold)
+    finally:
+        bench.Close()
+
+    sys.exit(1 if regressions else 0)
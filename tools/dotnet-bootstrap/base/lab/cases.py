@@ -1,13 +1,25 @@
 #!/usr/bin/env python 
 import os
 import sys
+import time
+import json
+import hashlib
+import urllib2
+import argparse
+import threading
+import multiprocessing.pool
 
 from shellcall import ShellCall
 from shellcall import ContinueOnError
-from sys       import argv
+from shellcall import RoverBase
+from session   import ContainerSession
+from results   import Results
+from containers import Containers
 from os        import getcwd
 
-from os.path   import join, exists, dirname, realpath
+from os.path   import join, exists, dirname, realpath, basename
+from subprocess import check_output
+from subprocess import CalledProcessError
 
 from globals import g_override
 
@@ -16,100 +28,325 @@ class Cases:
     _labPath = dirname(realpath(__file__))
     _supported_containers = join(_labPath, 'containers/') # our 'list' of current supported platforms are the directories in this directory
     _testcases = join(_labPath, 'cases/')
+    _mirrors = join(_labPath, 'mirrors/') # bare mirrors of the repositories, shared by every container so that we only clone them once.
     _continueOnError = True
     _lenient = True
+    _jobs = 1 # how many (container, case) pairs run at the same time.
+    _docker = os.environ.get('DOCKER', 'docker') # a stand-in for the docker CLI can be swapped in here.
+    _bootstrap = realpath(join(_labPath, '../../dotnet.bootstrap.py'))
+    _payload = '' # passed to the bootstrap as -payload (a URL, or a tarball on the host); empty means the bootstrap's default.
+    _database = join(_labPath, 'results.db') # the history of every run (see results.py)
+    _costsPath = join(_labPath, 'costs.json') # the peak memory of the recent bootstraps of each container (see _toolchain)
+    _bootstrapMemory = 1024 * 1024 # KB per job of a bootstrap, until we have seen the container bootstrap.
+    _caseMemory = 1024 * 1024 # KB, for the container of a case.
+    _ccache = join(_labPath, 'ccache/') # the compiler caches of the bootstraps, one per distro family (see _ccacheVolume)
 
+    # every (container, case) pair gets a scratch directory of its own (mounted as /env/dotnet-bootstrap), so that 
+    # pairs can run side by side. It holds the bootstrap (src, obj, bin) and the case itself (in <scratch>/<case>)
+    def _scratch(self, container_name, casename):
+        return join(self._supported_containers, container_name, "testing", casename)
     
     # if current_working_directory = None, then we use the working dir dictated by the dockerfile
     # if none is specified in the dockerfile, then docker uses '/'
+    # the mirrors are mounted at the same path as on the host, since the checkouts refer to the mirror objects by absolute path.
+    # the compiler cache of a container is mounted as /env/ccache.
     def _docker_compose(self, identifier, local_volume, current_working_directory = None):
-        wdir_parameter = None
+        wdir_parameter = ''
         
         if current_working_directory:
             wdir_parameter = '-w "%s"'%(current_working_directory)
             
-        return 'docker run %s -v %s:/env/dotnet-bootstrap dotnet-bootstrap:%s'%(wdir_parameter, local_volume, identifier)
+        return '%s run %s -v %s:/env/dotnet-bootstrap -v %s:%s -v %s:/env/ccache dotnet-bootstrap:%s'%(self._docker, wdir_parameter, local_volume, self._mirrors, self._mirrors, self._ccacheVolume(identifier), identifier)
+
+    # the containers of a distro family (the ubuntus, the opensuses - see Containers.BakeGroups) share a compiler cache: ccache only
+    # hits where the compiler is the same, and that is where it is likely to be.
+    def _ccacheVolume(self, container_name):
+        family = Containers().Family(container_name) or container_name
+        volume = join(self._ccache, family)
+
+        if not exists(volume):
+            ShellCall('mkdir -p %s'%(volume), lenient=self._lenient)
+
+        return volume
+
+    # the bootstrapped toolchain of a container only depends on the image, the bootstrap script and the payload, so it is
+    # built once and shared by every case: containers/<container>/toolchain/<key>/
+    def _toolchainKey(self, container_name):
+        try:
+            with open(os.devnull, 'w') as devnull:
+                image_id = check_output([self._docker, 'image', 'inspect', '--format', '{{.Id}}', 'dotnet-bootstrap:%s'%(container_name)], stderr=devnull).strip()
+        except (CalledProcessError, OSError):
+            image_id = ''
+
+        key = hashlib.sha1()
+        with open(self._bootstrap, 'rb') as bootstrap_file:
+            key.update(bootstrap_file.read())
+        key.update('\0%s\0%s'%(self._payloadIdentity(), image_id))
+
+        return key.hexdigest()
+
+    # what the payload is: the sha256 of a tarball, or what the server says of a URL (its ETag, Last-Modified and size), so that
+    # a new build behind the 'latest' URL makes for a new toolchain. It is worked out once per run.
+    def _payloadIdentity(self):
+        with self._payloadLock:
+            if self._payloadId is None:
+                self._payloadId = self._resolvePayload()
+
+            return self._payloadId
+
+    def _resolvePayload(self):
+        payload = self._payload or RoverBase.RoverDefaultPayloadURL
+
+        if not payload.startswith('http://') and not payload.startswith('https://'):
+            digest = hashlib.sha256()
+            with open(payload, 'rb') as payload_file:
+                for chunk in iter(lambda: payload_file.read(1024 * 1024), ''):
+                    digest.update(chunk)
+
+            return 'sha256:%s'%(digest.hexdigest())
+
+        request = urllib2.Request(payload)
+        request.get_method = lambda: 'HEAD'
+
+        try:
+            response = urllib2.urlopen(request, timeout=60)
+        except IOError as error: # (URLError and socket errors are IOErrors)
+            print('could not reach %s (%s), so the toolchains are told apart by its URL alone'%(payload, error))
+            return payload
+
+        info = response.info()
+        response.close()
+
+        return '%s\0%s\0%s\0%s'%(payload, info.getheader('ETag'), info.getheader('Last-Modified'), info.getheader('Content-Length'))
+
+    # the bootstrap leaves a trace of its run in the toolchain (see -trace in dotnet.bootstrap.py); returns the phases of it as steps,
+    # [(step, exit code, seconds)], the commit hashes that it built and the most memory (KB) that it took at once.
+    def _toolchainTrace(self, toolchain):
+        try:
+            with open(join(toolchain, 'rover.trace.json')) as trace_file:
+                events = json.load(trace_file)['traceEvents']
+        except (IOError, ValueError, KeyError):
+            return ([], {}, 0)
+
+        steps = [('bootstrap %s'%(event['name']), 1 if 'error' in event['args'] else 0, event['dur'] / 1000000.0) for event in events if event.get('cat') == 'phase']
+        commits = dict((component, commit) for event in events if event.get('cat') == 'run' for component, commit in event['args'].get('commits', {}).items())
+        peak_memory = max([event['args'].get('peak_tree_rss_kb', 0) for event in events if event.get('cat') == 'run'] + [0])
+
+        return (steps, commits, peak_memory)
+
+    # waits for the memory and the CPUs of a bootstrap or a case to be free (see RoverAdmission in dotnet.bootstrap.py); returns the ticket to release.
+    def _admit(self, prefix, what, memory, cpus):
+        def waiting():
+            print('%s the %s is waiting for memory (it needs %.1f GB, %.1f GB are free)'%(prefix, what, memory / 1024.0 ** 2, self._admission.Free() / 1024.0 ** 2))
+
+        return self._admission.Admit(memory, cpus, on_wait=waiting)
+
+    # returns the directory of the container's toolchain, bootstrapping it the first time that a case asks for it; 
+    # and whether it was this call that bootstrapped it.
+    def _toolchain(self, container_name, prefix):
+        with self._toolchainLock:
+            container_lock = self._toolchainLocks.setdefault(container_name, threading.Lock())
+
+        # the cases of one container wait for the first of them to bootstrap; the other containers carry on.
+        with container_lock:
+            toolchains = join(self._supported_containers, container_name, "toolchain")
+            toolchain = join(toolchains, self._toolchainKey(container_name))
+
+            if exists(join(toolchain, '.complete')):
+                return (toolchain, False)
+
+            if container_name in self._failedToolchains: # no point in spending another few hours failing.
+                raise ContinueOnError(toolchain, 'shellcall_failure-repro.sh')
+
+            ShellCall('rm -R -f %s'%(toolchains), lenient=self._lenient) # toolchains of an older image or bootstrap.
+            ShellCall('mkdir -p %s'%(toolchain), lenient=self._lenient)
+            ShellCall('cp %s %s'%(self._bootstrap, toolchain), toolchain, lenient = self._lenient)
+
+            # a tarball on the host goes in with the bootstrap, where the container can see it.
+            payload_parameter = ''
+            if self._payload.startswith('http://') or self._payload.startswith('https://'):
+                payload_parameter = '-payload %s'%(self._payload)
+            elif self._payload:
+                ShellCall('cp %s %s'%(self._payload, toolchain), toolchain, lenient = self._lenient)
+                payload_parameter = '-payload /env/dotnet-bootstrap/%s'%(basename(self._payload))
+
+            # the pairs that run at the same time share the CPUs of the host.
+            rover_jobs = max(1, RoverBase.RoverCPUCount() / self._jobs)
+
+            # the bootstrap only starts once the host has the memory that it took the last time around.
+            memory = self._costs.Estimate('bootstrap %s'%(container_name), self._bootstrapMemory) * rover_jobs
+            ticket = self._admit(prefix, 'bootstrap', memory, rover_jobs)
+
+            # run the bootstrap
+            try:
+                ShellCall('%s python /env/dotnet-bootstrap/dotnet.bootstrap.py -to /env/dotnet-bootstrap/ -mirror-dir %s -jobs %d -ccache /env/ccache -trace /env/dotnet-bootstrap/rover.trace.json %s'%(self._docker_compose(container_name, toolchain), self._mirrors, rover_jobs, payload_parameter), toolchain, lenient = self._lenient, prefix = prefix) # this will generate the src, obj, and bin directory here.
+            except ContinueOnError:
+                self._failedToolchains.add(container_name)
+                raise
+            finally:
+                self._admission.Release(ticket)
+
+            # what it took is what we expect of it next time.
+            peak_memory = self._toolchainTrace(toolchain)[2]
+            if peak_memory:
+                self._costs.Learn('bootstrap %s'%(container_name), peak_memory / rover_jobs)
+                self._costs.Save()
+
+            ShellCall('touch %s'%(join(toolchain, '.complete')), lenient=self._lenient)
+            return (toolchain, True)
     
-    # Runs a select case
+    # Runs a select case; returns (container, case, status, seconds, [(step, exit code, seconds)], {component: commit hash})
     def RunIn(self, container_name, casename):
-        local_mount_location = join(self._supported_containers, container_name)
-        testing_destination = join(local_mount_location, "testing/")
+        start = time.time()
+        local_mount_location = self._scratch(container_name, casename)
+        testing_destination = join(local_mount_location, casename)
+        prefix = '[%s/%s]'%(container_name, casename)
         
-        ShellCall("echo \"running 'dotnet-bootstrap:%s - testcase: %s'\""%(container_name, casename), lenient = self._lenient)
+        ShellCall("echo \"running 'dotnet-bootstrap:%s - testcase: %s'\""%(container_name, casename), lenient = self._lenient, prefix = prefix)
         
-        # copy the bootstrap and test source in to the container working directory (next to the Dockerfile)
-        ShellCall('cp %s %s'%(join(self._labPath, '../../dotnet.bootstrap.py'), join(self._supported_containers, container_name)), lenient = self._lenient)
-        ShellCall('mkdir -p %s'%(join(testing_destination, casename)), lenient=self._lenient)
-        ShellCall('cp -R %s %s'%(join(self._testcases, casename), join(testing_destination, casename)), lenient = self._lenient)
+        # copy the test source in to the scratch directory of this pair
+        ShellCall('mkdir -p %s'%(testing_destination), lenient=self._lenient)
+        ShellCall('mkdir -p %s'%(self._mirrors), lenient=self._lenient)
+        ShellCall('rm -R -f %s'%(join(testing_destination, "result")), local_mount_location, lenient=self._lenient) # a stale result is not a result.
+        ShellCall('cp -R %s %s'%(join(self._testcases, casename), testing_destination), local_mount_location, lenient = self._lenient)
         
-        docker_run_cmd = 'docker run -v %s:/env/dotnet-bootstrap dotnet-bootstrap:%s'%(local_mount_location, str(container_name))
-        # ^ : This runs docker using the current container directory (with the Dockerfile) as the current working directory.
-        # so that anything placed in that directory becomes accessible. 
-        # eventually we will copy the tests in to this directory as well (see below)
-                        
-        # run the bootstrap
-        ShellCall('%s python /env/dotnet-bootstrap/dotnet.bootstrap.py -to /env/dotnet-bootstrap/'%(docker_run_cmd), lenient = self._lenient) # this will generate the src, obj, and bin directory here.
-                
-        # create whatever project file is the latest and greatest (was project.json, and is now named after the directory.csproj)
-        ShellCall('%s /env/dotnet-bootstrap/bin/dotnet new -t Console'%(self._docker_compose(container_name, local_mount_location, join("/env/dotnet-bootstrap/testing/", casename))), lenient= self._lenient)
-        #ShellCall('ls', cwd=join(testing_destination, casename, casename + '.csproj'))
-        
-        # confirm that it exists.
-        if exists(join(testing_destination, casename, casename + '.csproj')):
-            ShellCall('mkdir -p %s'%join(testing_destination, casename, "result"))
-            ShellCall('touch %s'%(join(testing_destination, casename, "result", "pass"))) # spawn a result; a failure is when this doesn't exist. If this exists, this is a passing testcase.
-            
-            ShellCall('cp -R %s/* %s'%(join(self._testcases, casename), join(testing_destination, casename)), lenient= self._lenient)
-            # ShellCall('%s /env/dotnet-bootstrap/bin/dotnet restore .'%(self._docker_compose(container_name, local_mount_location, join("/env/dotnet-bootstrap/testing/", casename))), lenient=self._lenient)
-            # ShellCall('%s /env/dotnet-bootstrap/bin/dotnet run'%(self._docker_compose(container_name, local_mount_location, join("/env/dotnet-bootstrap/testing/", casename))), lenient=self._lenient)
+        toolchain_start = time.time()
+        steps, commits, session = [], {}, None
 
-        self.Report()
-        
-    def _runOverride(self):
-        for container in g_override["containers"]:
-            for case in g_override["cases"]:
-                try:
-                    self.RunIn(container, case)
-                except ContinueOnError: # we threw this up with the intention of being OK with moving on.
-                    continue
+        try:
+            # the bootstrapped dotnet of this container (only the first case of a container pays for it)
+            toolchain, bootstrapped = self._toolchain(container_name, prefix)
+            bootstrap_steps, commits, peak_memory = self._toolchainTrace(toolchain)
+
+            # the phases of the bootstrap are only steps of the case that ran it.
+            steps = [('toolchain', 0, time.time() - toolchain_start)] + (bootstrap_steps if bootstrapped else [])
+
+            # every step of the case runs in one container session: a single container, started once.
+            volumes = [(local_mount_location, '/env/dotnet-bootstrap'),
+                       (join(toolchain, 'bin'), '/env/dotnet-bootstrap/bin:ro'),
+                       (self._mirrors, self._mirrors)]
+            case_directory = join("/env/dotnet-bootstrap/", casename)
+
+            ticket = self._admit(prefix, 'case', self._caseMemory, 1)
+
+            try:
+                session = ContainerSession('dotnet-bootstrap:%s'%(container_name), volumes, 'dotnet-bootstrap-%s-%s'%(container_name, casename), self._docker, prefix)
+                with session:
+                    # create whatever project file is the latest and greatest (was project.json, and is now named after the directory.csproj)
+                    session.Run('new', '/env/dotnet-bootstrap/bin/dotnet new -t Console', case_directory)
+
+                    # confirm that it exists.
+                    if exists(join(testing_destination, casename + '.csproj')):
+                        ShellCall('mkdir -p %s'%join(testing_destination, "result"))
+                        ShellCall('touch %s'%(join(testing_destination, "result", "pass"))) # spawn a result; a failure is when this doesn't exist. If this exists, this is a passing testcase.
+
+                        ShellCall('cp -R %s/* %s'%(join(self._testcases, casename), testing_destination), local_mount_location, lenient= self._lenient)
+                        # session.Run('restore', '/env/dotnet-bootstrap/bin/dotnet restore .', case_directory)
+                        # session.Run('run', '/env/dotnet-bootstrap/bin/dotnet run', case_directory)
+            finally:
+                self._admission.Release(ticket)
+        except ContinueOnError as error:
+            # the steps that ran up to the failure are the ones that say what went wrong, so they go along with it (see _runPair)
+            error.steps = (steps or [('toolchain', 1, time.time() - toolchain_start)]) + (session.Steps if session else [])
+            error.commits = commits
+            raise
+
+        return (container_name, casename, self._result(container_name, casename), time.time() - start, steps + session.Steps, commits)
+
+    # runs a single (container, case) pair of the matrix; on a thread of the pool in _runMatrix.
+    def _runPair(self, pair):
+        container, case = pair
+        start = time.time()
+
+        try:
+            return self.RunIn(container, case)
+        except ContinueOnError as error: # we threw this up with the intention of being OK with moving on.
+            return (container, case, 'fail', time.time() - start, getattr(error, 'steps', []), getattr(error, 'commits', {}))
+
+    def _runMatrix(self, pairs):
+        start = time.time()
+
+        pool = multiprocessing.pool.ThreadPool(max(1, min(self._jobs, len(pairs))))
+        try:
+            # a timeout on get() keeps us responsive to Ctrl+C (a bare get() swallows it in python 2)
+            results = pool.map_async(self._runPair, pairs, chunksize=1).get(60 * 60 * 24 * 7)
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        self._summary(results, time.time() - start)
+
+        run = Results(self._database).Record(start, time.time() - start, self._jobs, results)
+        print("recorded as run %d in %s"%(run, self._database))
+
+    def _summary(self, results, wall_time):
+        print("CONTAINER - CASE - STATUS - SECONDS")
+        for container, case, status, seconds, steps, commits in sorted(results):
+            print("%s - %s - %s - %.1f"%(container, case, status, seconds))
+
+            for step, exit_code, step_seconds in steps:
+                print("    %s - exit code %d - %.1f"%(step, exit_code, step_seconds))
+
+        print("%d passed, %d failed, %.1fs wall time (%.1fs total)"%(len([result for result in results if result[2] == 'pass']), 
+                                                                      len([result for result in results if result[2] != 'pass']), 
+                                                                      wall_time, sum(result[3] for result in results)))
+
+    def _result(self, container, case):
+        if exists(join(self._scratch(container, case), case, "result", "pass")):
+            return 'pass'
+
+        return 'fail'
                 
-    def _status(self, container, case):
-        print("CONTAINER - CASE - STATUS")
-        target = "%s - %s"%(container, case)
-        testing_destination = join(self._supported_containers, container, "testing/")
-        if exists(join(testing_destination, case, "result", "pass")):
-            print("%s - pass"%(target))
-        else:
-            print("%s - fail"%(target))
-            
-            
-    def Report(self):
-        for container in g_override["containers"]:
-            for case in g_override["cases"]:
-                    self._status(container, case)
-                    
-    # runs the full matrix of tests
-    def RunAll(self):
+    # the latest result of every step that was recorded, the trend of its durations, and whether it got slower than its baseline
+    # (the median of its last window passing runs) by more than threshold; returns the number of steps that did.
+    def Report(self, window = 5, threshold = 0.2):
+        if not exists(self._database):
+            print('nothing has been recorded yet (%s)'%(self._database))
+            return 0
+
+        return Results(self._database).Report(window, threshold)
+
+    # every (container, case) pair of the matrix.
+    def _pairs(self):
         if g_override:
-            self._runOverride()
-            return
-        
+            return [(container, case) for container in g_override["containers"] for case in g_override["cases"]]
+
+        pairs = []
         for root, containers, files in os.walk(self._supported_containers):
             for container in containers: # we keep it explicitly the case that there are no other directories in the cases or containers directories.
                 for root, cases, files in os.walk(self._testcases):
                     for case in cases:
-                        try:
-                                self.RunIn(container, case) # runs the full matrix of environments and cases
-                        except ContinueOnError:
-                            continue
+                        pairs.append((container, case))
                     break # just walk the top level
             break # just walk the top level.
 
+        return sorted(pairs)
+                    
+    # runs the full matrix of tests
+    def RunAll(self):
+        self._runMatrix(self._pairs())
+
     def List(self):
         ShellCall('ls -1 %s'%(self._testcases), lenient = self._lenient)
 
         
-    def __init__(self):
+    # memory is the budget (KB) that the bootstraps and cases are admitted against; by default, 90% of what the host has available.
+    def __init__(self, jobs = 1, memory = None, payload = ''):
+        self._jobs = max(1, jobs)
+        self._payload = payload
+        self._payloadId = None
+        self._payloadLock = threading.Lock()
+        self._costs = RoverBase.RoverCosts(self._costsPath)
+
+        available = RoverBase.RoverMemoryAvailable()
+        self._admission = RoverBase.RoverAdmission(memory or (available * 9 / 10 if available is not None else None), RoverBase.RoverCPUCount())
+        self._toolchainLock = threading.Lock()
+        self._toolchainLocks = {}
+        self._failedToolchains = set()
+
         if not exists(self._supported_containers):
             print('no such directory: %s\n'%(self._supported_containers))
             sys.exit()
@@ -117,21 +354,24 @@ class Cases:
         if not exists(self._testcases):
             print('no such directory: %s\n'%(self._testcases))
             sys.exit()
-            
-def PrintUsage():
-    print("TODO: Usage")
 
 if __name__ == '__main__':
-    testcases = Cases()
+    parser = argparse.ArgumentParser(description = 'Runs the dotnet-bootstrap test cases in the lab containers.')
+    parser.add_argument('command', choices=['run', 'list', 'report'])
+    parser.add_argument('-j', type=int, default=1, help='how many (container, case) pairs to run at the same time (default is 1)')
+    parser.add_argument('-window', type=int, default=5, help='report: how many of the previous passing runs make up the baseline of a step (default is 5)')
+    parser.add_argument('-threshold', type=float, default=0.2, help='report: how much slower than its baseline a step may get before it is flagged (default is 0.2, 20%%)')
+    parser.add_argument('-memory', type=float, default=None, metavar='GB', help='run: the memory that the pairs may take between them; a bootstrap or a case waits until what it is expected to take fits (default is 90%% of what the host has available)')
+    parser.add_argument('-payload', default='', metavar='TARBALL', help='run: the payload that the bootstraps patch, a URL or a tarball (default is the bootstrap\'s, the latest CLI)')
+    args = parser.parse_args()
 
-    if len(argv) <= 1:
-        PrintUsage()
-        exit()
+    payload = args.payload if not args.payload or args.payload.startswith('http://') or args.payload.startswith('https://') else realpath(args.payload)
+    testcases = Cases(args.j, int(args.memory * 1024 ** 2) if args.memory else None, payload)
 
     dictionary = { 
         "run": testcases.RunAll,
         "list": testcases.List,
-        "report": testcases.Report
+        "report": lambda: sys.exit(1 if testcases.Report(args.window, args.threshold) else 0)
     }
 
-    dictionary[argv[1]]()
+    dictionary[args.command]()
@@ -9,22 +9,103 @@ from shellcall import ShellCall
 from shellcall import ContinueOnError
 import sys
 import os
+import time
+import fnmatch
+import hashlib
+import argparse
+import multiprocessing.pool
 
-from sys import argv
 from os.path import join
 from os.path import dirname
 from os.path import realpath
 from os import getcwd
+from subprocess import check_output
+from subprocess import CalledProcessError
 
 from globals import g_override
 
 # interface + data binding for managing the containers.
 class Containers:
     _supported_platforms = join(dirname(realpath(__file__)), 'containers') + '/' # our 'list' of current supported platforms are the directories in this directory
+    _docker = os.environ.get('DOCKER', 'docker') # a stand-in for the docker CLI can be swapped in here (for testing the scheduling)
+    _contextLabel = 'dotnet-bootstrap.context'
+    _jobs = 1 # how many images bake at the same time.
 
-    def Bake(self, selected_platform):
-        ShellCall("echo baking 'dotnet-bootstrap:%s'"%(selected_platform), lenient=True)
-        ShellCall("docker build -t \"dotnet-bootstrap:%s\" ."%(selected_platform), join(self._supported_platforms, selected_platform), lenient=True)
+    # like docker, excluding a directory ('src/*' excludes 'src/a') excludes everything beneath it too.
+    def _isIgnored(self, relative_path, pattern):
+        path_parts = relative_path.split('/')
+
+        return any(fnmatch.fnmatch('/'.join(path_parts[:depth]), pattern) for depth in range(1, len(path_parts) + 1))
+
+    # the files docker would send as the build context: everything but what .dockerignore excludes.
+    def _contextFiles(self, selected_platform):
+        context_directory = join(self._supported_platforms, selected_platform)
+        ignore_patterns = []
+
+        if os.path.exists(join(context_directory, '.dockerignore')):
+            with open(join(context_directory, '.dockerignore')) as dockerignore:
+                ignore_patterns = [line.strip() for line in dockerignore if line.strip() and not line.startswith('#')]
+
+        context_files = []
+        for root, dirs, files in os.walk(context_directory):
+            # an ignored directory (the checkouts of a bootstrap, say) is not walked at all; its ancestors were not ignored, so it is
+            # enough to match the directory itself.
+            dirs[:] = [name for name in dirs if not any(fnmatch.fnmatch(os.path.relpath(join(root, name), context_directory), pattern) for pattern in ignore_patterns)]
+
+            for filename in files:
+                relative_path = os.path.relpath(join(root, filename), context_directory)
+
+                if not any(self._isIgnored(relative_path, pattern) for pattern in ignore_patterns):
+                    context_files.append(relative_path)
+
+        return sorted(context_files)
+
+    # a hash of the Dockerfile and everything else in its context; an image baked from the same hash needs no re-baking.
+    def ContextHash(self, selected_platform):
+        context_directory = join(self._supported_platforms, selected_platform)
+        context_hash = hashlib.sha1()
+
+        for relative_path in self._contextFiles(selected_platform):
+            with open(join(context_directory, relative_path), 'rb') as context_file:
+                context_hash.update('%s\0%s\0'%(relative_path, hashlib.sha1(context_file.read()).hexdigest()))
+
+        return context_hash.hexdigest()
+
+    # the context hash that the current image was baked from (None if there is no such image)
+    def _bakedHash(self, selected_platform):
+        try:
+            with open(os.devnull, 'w') as devnull:
+                return check_output([self._docker, 'image', 'inspect', '--format', '{{ index .Config.Labels "%s" }}'%(self._contextLabel), 'dotnet-bootstrap:%s'%(selected_platform)], stderr=devnull).strip()
+        except (CalledProcessError, OSError):
+            return None
+
+    # the base image of a platform (the first FROM of its Dockerfile)
+    def BaseImage(self, selected_platform):
+        with open(join(self._supported_platforms, selected_platform, 'Dockerfile')) as dockerfile:
+            for line in dockerfile:
+                if line.strip().upper().startswith('FROM '):
+                    return line.split()[1]
+
+        return ''
+
+    # the distro family of a platform, e.g. 'ubuntu' or 'opensuse': the name of its base image.
+    def Family(self, selected_platform):
+        return self.BaseImage(selected_platform).split(':')[0].split('/')[-1]
+
+    # returns (platform, status, seconds) - status is one of 'baked', 'unchanged' or 'failed'
+    def Bake(self, selected_platform, force = False):
+        start = time.time()
+        prefix = '[%s]'%(selected_platform)
+        context_hash = self.ContextHash(selected_platform)
+
+        if not force and self._bakedHash(selected_platform) == context_hash:
+            print('%s dotnet-bootstrap:%s is up to date'%(prefix, selected_platform))
+            return (selected_platform, 'unchanged', time.time() - start)
+
+        ShellCall("echo baking 'dotnet-bootstrap:%s'"%(selected_platform), lenient=True, prefix=prefix)
+        ShellCall("%s build --label %s=%s -t \"dotnet-bootstrap:%s\" ."%(self._docker, self._contextLabel, context_hash, selected_platform), join(self._supported_platforms, selected_platform), lenient=True, prefix=prefix)
+
+        return (selected_platform, 'baked', time.time() - start)
 
     def CleanContainerFolder(self, container, folderName):
         ShellCall("rm -R -f %s"%(join(self._supported_platforms, container, folderName)), lenient=True)
@@ -36,39 +117,80 @@ class Containers:
                 self.CleanContainerFolder(platform, "obj")
                 self.CleanContainerFolder(platform, "bin")
                 self.CleanContainerFolder(platform, "testing")
+                self.CleanContainerFolder(platform, "toolchain")
                 
             break
-        
-    def _bakeOverride(self):
-        for container in g_override["containers"]:
+
+    # Platforms with a similar base (the ubuntus, the opensuses) are baked one after the other on the same worker, so
+    # that they find the layers of their siblings warm in the docker cache. The groups themselves bake side by side.
+    def BakeGroups(self, platforms):
+        groups = {}
+
+        for platform in platforms:
+            family = self.Family(platform)
+            groups.setdefault(family, []).append(platform)
+
+        # the biggest groups take the longest, so they go first.
+        return sorted((sorted(group, key=lambda platform: (self.BaseImage(platform), platform)) for group in groups.values()), key=lambda group: (-len(group), group))
+
+    # bakes a group of platforms one after the other; on a thread of the pool in _bakeMatrix.
+    def _bakeGroup(self, group):
+        results = []
+
+        for platform in group:
             try:
-                self.Bake(container)
+                results.append(self.Bake(platform))
             except ContinueOnError:
-                continue
-                
+                results.append((platform, 'failed', 0.0))
+
+        return results
+
+    def _bakeMatrix(self, platforms):
+        start = time.time()
+        groups = self.BakeGroups(platforms)
+
+        pool = multiprocessing.pool.ThreadPool(max(1, min(self._jobs, len(groups))))
+        try:
+            # a timeout on get() keeps us responsive to Ctrl+C (a bare get() swallows it in python 2)
+            results = [result for group_results in pool.map_async(self._bakeGroup, groups, chunksize=1).get(60 * 60 * 24) for result in group_results]
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        print("CONTAINER - STATUS - SECONDS")
+        for platform, status, seconds in results:
+            print("%s - %s - %.1f"%(platform, status, seconds))
+
+        print("%.1fs wall time (%.1fs total)"%(time.time() - start, sum(result[2] for result in results)))
+
+        return results
                 
     def BakeAll(self):
         if g_override:
-            self._bakeOverride()
+            self._bakeMatrix(g_override["containers"])
             return
         
         for root, platforms, files in os.walk(self._supported_platforms):
-            for platform in platforms: # we keep it explicitly the case that there are no other directories in the cases or containers directories.
-                try:
-                    self.Bake(platform)
-                except ContinueOnError:
-                    continue
+            self._bakeMatrix(sorted(platforms)) # we keep it explicitly the case that there are no other directories in the cases or containers directories.
             break
 
     def List(self):
         ShellCall('ls -1 %s'%(self._supported_platforms))
 
+    def __init__(self, jobs = 1):
+        self._jobs = max(1, jobs)
 
-def PrintUsage():
-    print("TODO: Usage")
 
 if __name__ == '__main__':
-    containers = Containers()
+    parser = argparse.ArgumentParser(description = 'Bakes the docker images of the lab containers.')
+    parser.add_argument('command', choices=['bake', 'list', 'clean'])
+    parser.add_argument('-j', type=int, default=1, help='how many images to bake at the same time (default is 1)')
+    args = parser.parse_args()
+
+    containers = Containers(args.j)
 
     dictionary = { 
         "bake": containers.BakeAll,
@@ -76,9 +198,4 @@ if __name__ == '__main__':
         "clean": containers.CleanAll
     }
 
-    if len(argv) <= 1:
-        PrintUsage()
-        exit()
-
-    dictionary[argv[1]]()
-    
+    dictionary[args.command]()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# The history of the lab: every run of the matrix appends a record per (container, case, step) - its status, how long it took and
+# the commit hashes that the bootstrap built - to a local SQLite database, so that we can see how the durations trend and catch a
+# run that got slower than the ones before it.
+
+import sqlite3
+
+class Results:
+    _schema = [
+        '''CREATE TABLE IF NOT EXISTS runs (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            started     REAL,
+            seconds     REAL,
+            jobs        INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS results (
+            run         INTEGER REFERENCES runs(id),
+            container   TEXT,
+            casename    TEXT,
+            step        TEXT,
+            status      TEXT,
+            seconds     REAL,
+            coreclr     TEXT,
+            corefx      TEXT,
+            core_setup  TEXT,
+            libuv       TEXT)''',
+        'CREATE INDEX IF NOT EXISTS results_by_step ON results (container, casename, step, run)'
+    ]
+
+    # records a run of the matrix; results are what Cases.RunIn returns: (container, case, status, seconds, steps, commits)
+    # the whole of a pair is recorded as its 'case' step, next to the steps that it ran. Returns the id of the run.
+    def Record(self, started, seconds, jobs, results):
+        with self._connection:
+            run = self._connection.execute('INSERT INTO runs (started, seconds, jobs) VALUES (?, ?, ?)', (started, seconds, jobs)).lastrowid
+
+            for container, case, status, case_seconds, steps, commits in results:
+                hashes = (commits.get('coreclr'), commits.get('corefx'), commits.get('core-setup'), commits.get('libuv'))
+                rows = [('case', status, case_seconds)] + [(step, 'pass' if exit_code == 0 else 'fail', step_seconds) for step, exit_code, step_seconds in steps]
+
+                self._connection.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                             [(run, container, case, step, step_status, step_seconds) + hashes for step, step_status, step_seconds in rows])
+
+        return run
+
+    # the durations of a (container, case, step), oldest first: [(run, status, seconds)]
+    def History(self, container, case, step):
+        return self._connection.execute('SELECT run, status, seconds FROM results WHERE container = ? AND casename = ? AND step = ? ORDER BY run',
+                                        (container, case, step)).fetchall()
+
+    # every (container, case, step) that has been recorded.
+    def Keys(self):
+        return self._connection.execute('SELECT DISTINCT container, casename, step FROM results ORDER BY container, casename, step').fetchall()
+
+    # the baseline of a step is the median of its last few passing runs; a failure took as long as it took to fail, which says little.
+    @staticmethod
+    def Baseline(history, window):
+        passing = [seconds for run, status, seconds in history if status == 'pass']
+        durations = sorted(passing[-window:])
+
+        if not durations:
+            return None
+
+        middle = len(durations) / 2
+        if len(durations) % 2:
+            return durations[middle]
+
+        return (durations[middle - 1] + durations[middle]) / 2.0
+
+    # prints the trend of every step's duration and flags the latest runs that are slower than their baseline (by more than threshold,
+    # and by more than a second, so that the quick steps don't cry wolf); returns the number of them.
+    def Report(self, window = 5, threshold = 0.2):
+        regressions = 0
+
+        print("CONTAINER - CASE - STEP - STATUS - SECONDS - BASELINE - TREND")
+        for container, case, step in self.Keys():
+            history = self.History(container, case, step)
+            latest_run, latest_status, latest_seconds = history[-1]
+            baseline = self.Baseline(history[:-1], window)
+
+            trend = ' '.join('%.1f'%(seconds) for run, status, seconds in history[-(window + 1):])
+            line = "%s - %s - %s - %s - %.1f - %s - %s"%(container, case, step, latest_status, latest_seconds, '%.1f'%(baseline) if baseline is not None else '-', trend)
+
+            if latest_status == 'pass' and baseline is not None and latest_seconds > baseline * (1 + threshold) and latest_seconds - baseline > 1.0:
+                line += " - SLOWER (+%d%%)"%(round(100 * (latest_seconds - baseline) / baseline) if baseline else 100)
+                regressions += 1
+
+            print(line)
+
+        print("%d steps got slower than the median of their last %d passing runs"%(regressions, window))
+        return regressions
+
+    def __init__(self, database):
+        self._connection = sqlite3.connect(database)
+
+        for statement in self._schema:
+            self._connection.execute(statement)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python 
+
+# A 'Container Session' is one long-lived container that a sequence of steps runs in (through docker exec), rather than
+# paying for container start up and volume mounting with a fresh 'docker run' for every step.
+
+import os
+import re
+import time
+
+from shellcall import ShellCall
+from shellcall import PrefixedCall
+from subprocess import CalledProcessError
+
+class ContainerSession:
+    # starts the container; it idles until the steps are done with it.
+    def Start(self):
+        volume_parameters = ' '.join('-v %s:%s'%(volume) for volume in self.Volumes)
+
+        ShellCall('%s run -d --name %s %s %s tail -f /dev/null'%(self.Docker, self.Name, volume_parameters, self.Image), lenient=True, prefix=self.Prefix)
+        self.Started = True
+
+    # runs a step in the container; returns its exit code. Every step is recorded in Steps as (name, exit code, seconds)
+    def Run(self, step_name, cmd, cwd = None):
+        # as an argv, so that the step reaches the container's shell untouched by the host's.
+        wdir_parameters = ['-w', cwd] if cwd else []
+
+        start = time.time()
+        try:
+            PrefixedCall([self.Docker, 'exec'] + wdir_parameters + [self.Name, 'sh', '-c', cmd], os.getcwd(), self.Prefix)
+            exit_code = 0
+        except CalledProcessError as step_error:
+            exit_code = step_error.returncode
+
+        self.Steps.append((step_name, exit_code, time.time() - start))
+        return exit_code
+
+    # tears the container down (along with anything it left behind outside of its volumes)
+    def Stop(self):
+        if self.Started:
+            try:
+                PrefixedCall('%s rm -f %s'%(self.Docker, self.Name), os.getcwd(), self.Prefix)
+            except CalledProcessError:
+                pass
+
+            self.Started = False
+
+    def __enter__(self):
+        self.Start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Stop()
+
+    # volumes is a list of (host path, container path[:options])
+    def __init__(self, image, volumes, name, docker = 'docker', prefix = None):
+        self.Image = image
+        self.Volumes = volumes
+        self.Name = re.sub('[^a-zA-Z0-9_.-]', '-', '%s-%d'%(name, os.getpid())) # what docker allows in a name
+        self.Docker = docker
+        self.Prefix = prefix or '[%s]'%(self.Name)
+        self.Started = False
+        self.Steps = []
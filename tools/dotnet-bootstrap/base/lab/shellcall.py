@@ -1,41 +1,56 @@
-#!/usr/bin/env python 
+#!/usr/bin/env python
 
-# A 'Shell Call' is a shell call (duh) that we want to be reproduceable in the event of a failure. 
-# namely, something that a developer can go in and 'drill in' on without running the entirety of the 
+# A 'Shell Call' is a shell call (duh) that we want to be reproduceable in the event of a failure.
+# namely, something that a developer can go in and 'drill in' on without running the entirety of the
 # build again.
 
 import os
-from subprocess import call
-from subprocess import check_call
+import imp
 from subprocess import CalledProcessError
 from os import path
 
+# the calls are run by the bootstrap's command runner (RoverRunCommand): the trivial file operations in-process, the rest from
+# their argv. The bootstrap has to stay a single file (it is copied in to the containers), so rather than importing it - which
+# would run it - we load its 'ROVER BASE' section, which only defines things.
+def LoadRoverBase():
+    bootstrap = path.realpath(path.join(path.dirname(path.realpath(__file__)), '../../dotnet.bootstrap.py'))
+
+    with open(bootstrap) as bootstrap_file:
+        source = bootstrap_file.read()
+
+    rover_base = imp.new_module('roverbase')
+    rover_base.__file__ = bootstrap
+
+    # the imports at the top, and the base.
+    exec(compile(source[:source.index('# END ROVER BASE #')], bootstrap, 'exec'), rover_base.__dict__)
+    return rover_base
+
+RoverBase = LoadRoverBase()
+
 class ContinueOnError(Exception):
     def __init__(self, working_directory, reprofile):
         self.working_directory = working_directory
         self.reprofile = reprofile
-        
+
     def __str__(self):
-        return '%s - %s'%(working_directory, reprofile)
+        return '%s - %s'%(self.working_directory, self.reprofile)
 
-def ShellCall(cmd, cwd = None, lenient=False):
+# like check_call, but every line of output is tagged with a prefix, so that calls running side by side stay readable.
+def PrefixedCall(cmd, cwd, prefix):
+    exit_code = RoverBase.RoverRunCommand(cmd, cwd, prefix)
+
+    if exit_code != 0:
+        raise CalledProcessError(exit_code, cmd)
+
+def ShellCall(cmd, cwd = None, lenient=False, prefix=None):
     if not cwd:
         cwd = os.getcwd()
 
-    try:
-        check_call(cmd, shell=True, cwd=cwd)
-
-    except CalledProcessError as repro_data:
+    if RoverBase.RoverRunCommand(cmd, cwd, prefix) != 0:
         repro_filename = 'shellcall_failure-repro.sh'
-        repro_destination = path.join(cwd, repro_filename)
 
         # when the call fails, print a repro to the working directory.
-        with open(repro_destination, 'w') as repro_file:
-            repro_file.writelines(['#!/usr/bin/env bash\n', repro_data.cmd + '\n'])
-
-        # if we're rooted    
-        if os.getuid() == 0:
-            call('chmod +x %s'%(repro_filename), shell=True, cwd=cwd)
+        repro_destination = RoverBase.RoverWriteRepro(cmd, cwd, repro_filename)
 
         # prints "Rover has detected a failure"
         print("a reproduction script was placed at : %s"%(repro_destination))
@@ -44,5 +59,5 @@ def ShellCall(cmd, cwd = None, lenient=False):
         # meh, lets just try to keep building everything.
         if lenient:
             raise ContinueOnError(cwd, repro_filename) # if we're feeling lenient, then we will raise up this opportunity to continue.
-        
-        os._exit(1) # if we fail a check_call then we want to bail out asap so the dev can investigate.
\ No newline at end of file
+
+        os._exit(1) # if we fail a check_call then we want to bail out asap so the dev can investigate.
@@ -1,24 +1,46 @@
 #!/usr/bin/env python 
 
 import os
+import re
+import bisect
 import json
-import platform
+import mmap
+import glob
+import shutil
+import hashlib
+import tempfile
+import fcntl
+import tarfile
+import zlib
+import copy
+import shlex
+import pipes
+import urlparse
 import argparse
 import sys
+import time
+import signal
+import resource
+import threading
 import traceback
+import multiprocessing
+import multiprocessing.pool
 
 # for readability
 from subprocess import call
-from subprocess import check_output
 from subprocess import check_call
+from subprocess import check_output
 from subprocess import CalledProcessError
+from subprocess import Popen
+from subprocess import PIPE
+from subprocess import STDOUT
 
 from os import path
 from os import makedirs
 from os.path import normpath
 
-from string import find
-from urllib import urlretrieve
+from distutils.spawn import find_executable
+
 
 
 # ROVER BASE #
@@ -97,65 +119,894 @@ def RoverPrint(line):
 def UnexpectedRoverException(exc_info):
     RoverPrint(RoverMods.Red('CAUGHT AN UNEXPECTED EXCEPTION: \"' + RoverMods.White('%s'%(str(exc_info[1]))) + '\" of type: %s'%(str(exc_info[0]))))
     RoverPrint(RoverMods.White('%s'%(str(traceback.print_tb(exc_info[2])))))
+    RoverTrace.Save() # whatever we got through is still worth looking at.
     os._exit(1) # bail out immediately to avoid possibly futzing up the state, or printing unhelpful messages. 
 
 
-# probably a pretty shaky interpretation of the semantic versioning 2.0.0 standard (http://semver.org/)
-# I really focused on clauses 9, 10 and 11
+# A trace of a Rover run: a span for every phase and every shell call, with what it cost. It is written out (see -trace)
+# in the Chrome trace event format, so that runs can be looked at (and laid side by side) in chrome://tracing or Perfetto,
+# or as one JSON event per line when the file name ends in .jsonl.
+class RoverTrace:
+    Path = ''
+    Events = []
+    _Lock = threading.Lock()
+
+    @staticmethod
+    def Record(event):
+        with RoverTrace._Lock:
+            RoverTrace.Events.append(event)
+
+    @staticmethod
+    def Save():
+        if not RoverTrace.Path:
+            return
+
+        with RoverTrace._Lock:
+            events = sorted(RoverTrace.Events, key=lambda event: event.get('ts', 0))
+
+        with open(RoverTrace.Path, 'w') as trace_file:
+            if RoverTrace.Path.endswith('.jsonl'):
+                trace_file.writelines(json.dumps(event, sort_keys=True) + '\n' for event in events)
+            else:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+# the bytes written by this process and the children it has waited for (the kernel folds their I/O in to ours when 
+# they are reaped). /proc/self/io is linux only, elsewhere we fall back on the count of blocks written.
+def RoverBytesWritten():
+    try:
+        with open('/proc/self/io') as io_file:
+            for line in io_file:
+                if line.startswith('write_bytes:'):
+                    return int(line.split(':')[1])
+    except (IOError, ValueError):
+        pass
+
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_oublock + resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock) * 512
+
+# times a step of the run in to the trace: 
+#   with RoverSpan('CloneRepositories'):
+#       ...
+# the wall time is the step's own, but the CPU time is that of every child process that was reaped while it ran - so the steps
+# that run concurrently (the fetches, say) share theirs. The peak RSS is the most that this process and its children took at once
+# while the step ran (sampled, see RoverMemorySampler), or that of a child that came and went between two samples; a span that
+# encloses others (on the same thread) takes in their peaks too. Does nothing unless we are tracing.
+class RoverSpan:
+    _Open = threading.local() # the spans open on each thread, innermost last.
+
+    def __init__(self, name, category = 'phase', **args):
+        self.Name = name
+        self.Category = category
+        self.Args = args
+
+    def __enter__(self):
+        if RoverTrace.Path:
+            self._start = time.time()
+            self._children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self._self = resource.getrusage(resource.RUSAGE_SELF)
+            self._written = RoverBytesWritten()
+            self._memory = RoverMemorySampler().__enter__()
+            self._peak = 0
+
+            if not hasattr(RoverSpan._Open, 'spans'):
+                RoverSpan._Open.spans = []
+            RoverSpan._Open.spans.append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if not RoverTrace.Path:
+            return False
+
+        end = time.time()
+        self._memory.__exit__(None, None, None)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        own = resource.getrusage(resource.RUSAGE_SELF)
+
+        # ru_maxrss is a high-water mark for the life of the process; it only tells us about this span if it went up during it.
+        peak_rss = max(self._peak, self._memory.Peak)
+        if children.ru_maxrss > self._children.ru_maxrss:
+            peak_rss = max(peak_rss, children.ru_maxrss)
+
+        spans = RoverSpan._Open.spans
+        if self in spans:
+            spans.remove(self)
+        if spans:
+            spans[-1]._peak = max(spans[-1]._peak, peak_rss)
+
+        args = dict(self.Args)
+        args.update({
+            'cpu_user_seconds'  : round(children.ru_utime - self._children.ru_utime + own.ru_utime - self._self.ru_utime, 3),
+            'cpu_system_seconds': round(children.ru_stime - self._children.ru_stime + own.ru_stime - self._self.ru_stime, 3),
+            'peak_rss_kb'       : peak_rss,
+            'bytes_written'     : RoverBytesWritten() - self._written
+        })
+
+        if exc_type:
+            args['error'] = str(exc_value) or exc_type.__name__
+
+        RoverTrace.Record({
+            'name'  : self.Name,
+            'cat'   : self.Category,
+            'ph'    : 'X',
+            'ts'    : int(self._start * 1000000),
+            'dur'   : int((end - self._start) * 1000000),
+            'pid'   : os.getpid(),
+            'tid'   : threading.current_thread().ident,
+            'args'  : args
+        })
+
+        return False
+
+
+# A version as semantic versioning 2.0.0 orders them (http://semver.org/, clauses 9, 10 and 11): '1.1.0-preview1-001100-00+build'.
+# The version is parsed once in to a key - a tuple that sorts in order of precedence, and can be hashed - which is cached for the
+# next time that we meet the same string (an install tree has the same few versions everywhere).
+#   major, minor and patch are compared numerically:                           1.9.0 < 1.10.0
+#   a pre-release has a lower precedence than its release:                     1.0.0-alpha < 1.0.0
+#   pre-release identifiers are compared one by one, numbers numerically,
+#   numbers before words, and a longer list of them wins if the rest is equal: 1.0.0-alpha < 1.0.0-alpha.1 < 1.0.0-alpha.beta < 1.0.0-beta.2 < 1.0.0-beta.11
+#   build metadata is ignored:                                                 1.0.0+a == 1.0.0+b
+# we are lenient about the core, which may have fewer or more than three numbers (1.0, 1.0.0.1); anything else is not a version (ValueError).
 class SemanticVersion:
-    # this is python overloading the '>' operator
+    Pattern = re.compile(r'^v?(\d+(?:\.\d+)*)(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$')
+    _Keys = {}
+
+    # the key of a version string: ((major, minor, patch), 1, ()) for a release, ((major, minor, patch), 0, (identifiers, ...)) for a
+    # pre-release; a numeric identifier is (0, number) and any other (1, word).
+    @staticmethod
+    def Key(versionStr):
+        key = SemanticVersion._Keys.get(versionStr)
+
+        if key is None:
+            match = SemanticVersion.Pattern.match(versionStr)
+            if not match:
+                raise ValueError('not a semantic version: \'%s\''%(versionStr))
+
+            core = tuple(int(number) for number in match.group(1).split('.'))
+            core = core + (0,) * (3 - len(core))
+
+            if match.group(2):
+                prerelease = tuple((0, int(identifier)) if identifier.isdigit() else (1, identifier) for identifier in match.group(2).split('.'))
+                key = (core, 0, prerelease)
+            else:
+                key = (core, 1, ())
+
+            SemanticVersion._Keys[versionStr] = key
+
+        return key
+
+    # the key of the least version (a pre-release of any kind included) with this core; every version of 1.1.x is at least
+    # LowestKey((1, 1)) and less than LowestKey((1, 2)).
+    @staticmethod
+    def LowestKey(core):
+        return (tuple(core) + (0,) * (3 - len(core)), 0, ())
+
+    def IsPrerelease(self):
+        return self.Key[1] == 0
+
+    def __lt__(self, other):
+        return self.Key < other.Key
+
+    def __le__(self, other):
+        return self.Key <= other.Key
+
     def __gt__(self, other):
-        # Major, minor, and patch versions are always compared numerically. 
-        # Example: 1.0.0 < 2.0.0 < 2.1.0 < 2.1.1. 
-        for index, val in enumerate(self.VersionTuple[0]):
-            if self.VersionTuple[0][index] > other.VersionTuple[0][index]:
-                return True
-        
-        # When major, minor, and patch are equal, a pre-release version has lower precedence than a normal version.         
-        # Example: 1.0.0-alpha < 1.0.0
-        if(len(self.VersionTuple) < len(other.VersionTuple)):
-            return True
+        return self.Key > other.Key
 
-        # Precedence for two pre-release versions with the same major, minor, and patch version MUST be determined 
-        # by comparing each dot separated identifier from left to right until a difference is found as follows: 
-        # identifiers consisting of only digits are compared numerically and identifiers with letters or hyphens are compared 
-        # lexically in ASCII sort order.
+    def __ge__(self, other):
+        return self.Key >= other.Key
 
-        # Numeric identifiers always have lower precedence than non-numeric identifiers. 
-        # A larger set of pre-release fields has a higher precedence than a smaller set, if all of the preceding identifiers are equal. 
-        # Example: 1.0.0-alpha < 1.0.0-alpha.1 < 1.0.0-alpha.beta < 1.0.0-beta < 1.0.0-beta.2 < 1.0.0-beta.11 < 1.0.0-rc.1 < 1.0.0.
-        
-        # Maybe a tad hacky - but I treat the remainder of the version (the non numerical piece) as being lex-sorted.
-        # assuming, of course, that we have two to compare.
-        if(len(self.VersionTuple) >= 2 and len(self.VersionTuple) >= 2):
-            if(self.VersionTuple[1] > other.VersionTuple[1]):
-                return True
+    def __eq__(self, other):
+        return isinstance(other, SemanticVersion) and self.Key == other.Key
 
-        return False
+    def __ne__(self, other):
+        return not self == other
 
-    def GetVersionTuple(self, versionStr):       
-        # a version string potentially looks like this:
-        # 0.0.0-alpha-00000
-        # the first part is canonical: 0.0.0 - it is ordered by the 'ol intuitive manner
-        # the second part is 'build metadata' - it is ordered lexically
-        middleIndex = versionStr.find('-')
-        # if we do not have a middle
-        if middleIndex == -1:
-            array = versionStr.split('.')
-            versionTuple = ([array]) 
-        else:
-            # otherwise, we'll slice in two
-            versionTuple = (versionStr[0:middleIndex].split('.'), versionStr[middleIndex:len(versionStr)])
+    def __hash__(self):
+        return hash(self.Key)
 
-        return versionTuple
-    
     def __str__(self):
         return self.VersionString
 
     def __init__(self, versionStr):
-        self.VersionTuple = self.GetVersionTuple(versionStr)
+        self.Key = SemanticVersion.Key(versionStr)
         self.VersionString = versionStr
 
+# The versions that an install tree has of the shared framework, the sdk and the host: each of shared/Microsoft.NETCore.App, sdk and
+# host/fxr is listed once, its versions sorted by precedence (the directories that aren't versions are left out), so that queries are
+# a binary search rather than a walk.
+#   index = RoverVersionIndex(tree)
+#   index.Latest('shared')                          the greatest version, release or pre-release
+#   index.Latest('sdk', prerelease=True)            the greatest pre-release
+#   index.Versions('shared', '1.1.x')               every 1.1 (1.1.0-preview1 ... 1.1.5), least first; '1.x' and '*' work too
+#   index.Range('host', '1.0.0', '2.0.0')           every version v with 1.0.0 <= v < 2.0.0
+#   index.Folder('shared', '1.0.1')                 the directory of a version
+class RoverVersionIndex:
+    Kinds = {
+        'shared'    : path.join('shared', 'Microsoft.NETCore.App'),
+        'sdk'       : 'sdk',
+        'host'      : path.join('host', 'fxr')
+    }
+
+    # the versions in a directory, as a list of (key, version) sorted by precedence.
+    @staticmethod
+    def Scan(container_folder):
+        versions = []
+
+        try:
+            names = os.listdir(container_folder)
+        except OSError: # there is no such directory.
+            return versions
+
+        for name in names:
+            try:
+                key = SemanticVersion.Key(name)
+            except ValueError:
+                continue
+
+            if path.isdir(path.join(container_folder, name)):
+                versions.append((key, name))
+
+        versions.sort()
+        return versions
+
+    # prerelease is None for every version, True for the pre-releases only and False for the releases only.
+    def Range(self, kind, minimum = None, maximum = None, prerelease = None):
+        versions, keys = self._versions[kind], self._keys[kind]
+
+        low = bisect.bisect_left(keys, SemanticVersion.Key(minimum) if isinstance(minimum, str) else minimum) if minimum else 0
+        high = bisect.bisect_left(keys, SemanticVersion.Key(maximum) if isinstance(maximum, str) else maximum) if maximum else len(keys)
+
+        return [version for key, version in versions[low:high] if prerelease is None or (key[1] == 0) == prerelease]
+
+    # the versions that match a pattern such as '1.1.x', '1.x', '1.1.*' or '*' (or a whole version, '1.1.0'), least first.
+    def Versions(self, kind, pattern = '*', prerelease = None):
+        fixed = []
+        for part in pattern.split('.'):
+            if part in ['x', 'X', '*']:
+                break
+
+            fixed.append(part)
+        else:
+            # not a wildcard, but a version.
+            return [version for key, version in self._versions[kind] if key == SemanticVersion.Key(pattern) and (prerelease is None or (key[1] == 0) == prerelease)]
+
+        if not fixed:
+            return self.Range(kind, prerelease=prerelease)
+
+        core = [int(part) for part in fixed]
+        upper = core[:-1] + [core[-1] + 1]
+
+        return self.Range(kind, SemanticVersion.LowestKey(core), SemanticVersion.LowestKey(upper), prerelease)
+
+    # the greatest version that matches the pattern; None if there are none.
+    def Latest(self, kind, pattern = '*', prerelease = None):
+        versions = self.Versions(kind, pattern, prerelease)
+
+        return versions[-1] if versions else None
+
+    def Folder(self, kind, version):
+        return path.join(self.Tree, self.Kinds[kind], version)
+
+    # the directories of every version of a kind, least first.
+    def Folders(self, kind):
+        return [self.Folder(kind, version) for key, version in self._versions[kind]]
+
+    def __init__(self, tree):
+        self.Tree = tree
+        self._versions = dict((kind, RoverVersionIndex.Scan(path.join(tree, container))) for kind, container in self.Kinds.items())
+        self._keys = dict((kind, [key for key, version in versions]) for kind, versions in self._versions.items())
+
+# counts the CPUs in a cpu list such as '0-3,8,10-11' (the format of cpuset.cpus and Cpus_allowed_list)
+def CountCPUList(cpu_list):
+    count = 0
+    for cpu_range in cpu_list.strip().split(','):
+        if not cpu_range:
+            continue
+
+        bounds = cpu_range.split('-')
+        count += int(bounds[-1]) - int(bounds[0]) + 1
+
+    return count
+
+def ReadFirstLine(file_path):
+    try:
+        with open(file_path) as f:
+            return f.readline().strip()
+    except IOError:
+        return None
+
+# the number of CPUs that we are actually allowed to use. multiprocessing.cpu_count() reports the whole host, 
+# which overcommits badly when we run inside of a docker container (see cases.py) with a --cpus or --cpuset-cpus limit.
+def RoverCPUCount():
+    cpu_counts = [multiprocessing.cpu_count()]
+
+    # the affinity mask of this process (taskset, cpusets)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Cpus_allowed_list:'):
+                    cpu_counts.append(CountCPUList(line.split(':', 1)[1]))
+    except (IOError, ValueError):
+        pass
+
+    # the CFS quota of our cgroup, first for cgroup v2 ('max 100000' or '200000 100000') then cgroup v1.
+    quota, period = None, None
+
+    cpu_max = ReadFirstLine('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        fields = cpu_max.split()
+        if len(fields) == 2 and fields[0] != 'max':
+            quota, period = fields
+    else:
+        quota   = ReadFirstLine('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+        period  = ReadFirstLine('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+
+    try:
+        if quota and period and int(quota) > 0 and int(period) > 0:
+            # round up, a quota of 1.5 CPUs can keep two of them busy.
+            cpu_counts.append((int(quota) + int(period) - 1) / int(period))
+    except ValueError:
+        pass
+
+    return max(1, min(cpu_counts))
+
+# the memory (in KB) that we can still use: what the kernel thinks is available, or what is left below the limit of our cgroup
+# (a docker --memory limit) if that is less. None when we can't tell (not linux).
+def RoverMemoryAvailable():
+    available = []
+
+    meminfo = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                meminfo[name] = int(value.split()[0])
+    except (IOError, ValueError):
+        pass
+
+    if 'MemAvailable' in meminfo:
+        available.append(meminfo['MemAvailable'])
+    elif 'MemFree' in meminfo: # kernels older than 3.14
+        available.append(meminfo['MemFree'] + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0))
+
+    # the limit of our cgroup, first for cgroup v2 ('max' when there is none) then cgroup v1 (a huge number when there is none).
+    limit, usage = ReadFirstLine('/sys/fs/cgroup/memory.max'), ReadFirstLine('/sys/fs/cgroup/memory.current')
+    if limit is None:
+        limit, usage = ReadFirstLine('/sys/fs/cgroup/memory/memory.limit_in_bytes'), ReadFirstLine('/sys/fs/cgroup/memory/memory.usage_in_bytes')
+
+    try:
+        if limit and usage and limit != 'max' and int(limit) < 2 ** 60:
+            available.append(max(0, int(limit) - int(usage)) / 1024)
+    except ValueError:
+        pass
+
+    return min(available) if available else None
+
+# the resident memory (in KB) of a process and all of its descendants; 0 when we can't tell (not linux).
+# the peak RSS that getrusage reports is that of the single biggest child, where a 'make -j8' runs eight compilers at once.
+def RoverProcessTreeRSS(root_pid):
+    children, rss = {}, {}
+    page_kb = os.sysconf('SC_PAGE_SIZE') / 1024
+
+    try:
+        pids = [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+    except OSError:
+        return 0
+
+    for pid in pids:
+        try:
+            with open('/proc/%d/stat'%(pid)) as stat_file:
+                stat = stat_file.read()
+        except IOError: # it has exited since we listed it.
+            continue
+
+        # the fields after '(comm)', which may itself hold spaces and parentheses: state, ppid, ... rss is the 22nd of them.
+        fields = stat[stat.rindex(')') + 2:].split()
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * page_kb
+
+    total, pending = 0, [root_pid]
+    while pending:
+        pid = pending.pop()
+        total += rss.get(pid, 0)
+        pending.extend(children.get(pid, []))
+
+    return total
+
+# samples the memory of this process and its descendants on a thread, while a step runs; Peak is the most that they used at once (KB)
+#   with RoverMemorySampler() as sampler:
+#       ...
+class RoverMemorySampler:
+    Interval = 0.5 # seconds
+
+    def _sample(self):
+        self.Peak = max(self.Peak, RoverProcessTreeRSS(self.Pid))
+
+        while not self._done.wait(self.Interval):
+            self.Peak = max(self.Peak, RoverProcessTreeRSS(self.Pid))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._done.set()
+        self._thread.join()
+        return False
+
+    def __init__(self, pid = None):
+        self.Pid = pid or os.getpid()
+        self.Peak = 0
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+
+# What builds cost the last few times that they ran - the peak memory of each (KB), keyed by whatever the caller runs (a component
+# build in Rover, the bootstrap of a container in the lab) - kept in a JSON file. The estimate is the biggest of the recent ones, so
+# that one lean run doesn't talk us in to overcommitting.
+class RoverCosts:
+    Window = 5
+
+    def Estimate(self, key, default):
+        with self._lock:
+            observed = self.Observed.get(key)
+
+        return max(observed) if observed else default
+
+    def Learn(self, key, value):
+        with self._lock:
+            self.Observed[key] = (self.Observed.get(key, []) + [int(value)])[-self.Window:]
+
+    def Save(self):
+        try:
+            makedirs(path.dirname(self.Path))
+        except OSError: # it exists
+            pass
+
+        # written aside and renamed over, so that a reader never finds half of it.
+        with self._lock:
+            temporary_path = '%s.%d.tmp'%(self.Path, os.getpid())
+            with open(temporary_path, 'w') as costs_file:
+                json.dump(self.Observed, costs_file, sort_keys=True)
+
+            os.rename(temporary_path, self.Path)
+
+    def __init__(self, costs_path):
+        self.Path = costs_path
+        self._lock = threading.Lock()
+
+        try:
+            with open(costs_path) as costs_file:
+                self.Observed = json.load(costs_file)
+        except (IOError, ValueError):
+            self.Observed = {}
+
+# Admission control for the builds that run side by side (the component builds in Rover, the bootstraps and cases in the lab): each
+# says what it is expected to cost - its peak memory (KB) and its CPUs - and is let in once that fits in what is left of the budget;
+# until then it waits. The first one in is never kept waiting, so that a build that is bigger than the whole budget runs on its own
+# rather than not at all; a smaller build that fits may go ahead of a bigger one that is waiting. A budget of None is no limit.
+#   ticket = admission.Admit(memory_kb, cpus)
+#   ...
+#   admission.Release(ticket)
+class RoverAdmission:
+    def _fits(self, memory_kb, cpus):
+        if not self._admitted:
+            return True
+
+        memory_in_use = sum(memory for memory, cpu_count in self._admitted.values())
+        cpus_in_use = sum(cpu_count for memory, cpu_count in self._admitted.values())
+
+        return (self.Memory is None or memory_in_use + memory_kb <= self.Memory) and (self.CPUs is None or cpus_in_use + cpus <= self.CPUs)
+
+    # blocks until there is room; on_wait is called (once) if there isn't right away, and poll every second while we wait (it may
+    # release the tickets of builds that finished without saying so). Once there is room, claim (if given) may size the build to what
+    # the others leave it: it is called under the lock (see Free and CPUsInUse) and returns the (memory_kb, cpus) that it takes after all.
+    # Returns the ticket to release.
+    def Admit(self, memory_kb, cpus = 0, on_wait = None, poll = None, claim = None):
+        with self._condition:
+            if not self._fits(memory_kb, cpus) and on_wait:
+                on_wait()
+
+            while not self._fits(memory_kb, cpus):
+                self._condition.wait(1.0) # a timeout keeps the wait responsive to Ctrl+C (python 2)
+
+                if poll:
+                    poll()
+
+            if claim:
+                memory_kb, cpus = claim()
+
+            self._tickets += 1
+            self._admitted[self._tickets] = (memory_kb, cpus)
+            return self._tickets
+
+    # a ticket can be released more than once (only the first counts).
+    def Release(self, ticket):
+        with self._condition:
+            self._admitted.pop(ticket, None)
+            self._condition.notify_all()
+
+    # the CPUs that the admitted builds hold between them.
+    def CPUsInUse(self):
+        with self._condition:
+            return sum(cpu_count for memory, cpu_count in self._admitted.values())
+
+    # the memory (KB) of the budget that isn't spoken for.
+    def Free(self):
+        with self._condition:
+            return None if self.Memory is None else self.Memory - sum(memory for memory, cpu_count in self._admitted.values())
+
+    def __init__(self, memory_kb, cpus = None):
+        self.Memory = memory_kb
+        self.CPUs = cpus
+        self._condition = threading.Condition()
+        self._admitted = {}
+        self._tickets = 0
+
+# The version stamp of a native binary: the '@(#)' strings that the .NET builds embed (e.g. '@(#)Version 4.6.24628.01 Commit Hash: <sha>')
+# and the commit hash that goes with them. Binaries without a stamp (the dotnet host) only carry a bare 40 character SHA.
+class VersionStamp:
+    StampPattern        = re.compile(r'@\(#\)([\x20-\x7e]+)')
+    VersionPattern      = re.compile(r'Version:?\s+(\S+)')
+    CommitPattern       = re.compile(r'Commit Hash:\s+([0-9a-fA-F]{7,40}|\S+)')
+    SHAPattern          = re.compile(r'(?<![0-9a-f])[0-9a-f]{40}(?![0-9a-f])')
+
+    # {path: (stat key, stamp fields)} - remembered across runs, see LoadCache/SaveCache.
+    _Cache = {}
+
+    @staticmethod
+    def StatKey(file_path):
+        file_stat = os.stat(file_path)
+        return [file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime]
+
+    @staticmethod
+    def LoadCache(cache_path):
+        try:
+            with open(cache_path) as cache_file:
+                VersionStamp._Cache.update(json.load(cache_file))
+        except (IOError, ValueError):
+            pass
+
+    @staticmethod
+    def SaveCache(cache_path):
+        try:
+            if not path.exists(path.dirname(cache_path)):
+                makedirs(path.dirname(cache_path))
+
+            with open(cache_path, 'w') as cache_file:
+                json.dump(VersionStamp._Cache, cache_file)
+        except (IOError, OSError):
+            pass
+
+    # scans the file through a memory map, so that we only ever look at it once and never copy it.
+    def Scan(self):
+        with open(self.Path, 'rb') as binary_file:
+            if os.fstat(binary_file.fileno()).st_size == 0:
+                return
+
+            binary_map = mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.Stamps = [match.group(1).strip() for match in self.StampPattern.finditer(binary_map)]
+
+                for stamp in self.Stamps:
+                    version_match = self.VersionPattern.search(stamp)
+                    commit_match = self.CommitPattern.search(stamp)
+
+                    self.Version = self.Version or (version_match.group(1) if version_match else '')
+                    self.CommitHash = self.CommitHash or (commit_match.group(1) if commit_match else '')
+
+                if not self.CommitHash:
+                    sha_match = self.SHAPattern.search(binary_map)
+                    self.CommitHash = sha_match.group(0) if sha_match else ''
+            finally:
+                binary_map.close()
+
+    def __str__(self):
+        return '%s %s %s'%(self.Path, self.Version or '-', self.CommitHash or '-')
+
+    def __init__(self, file_path):
+        self.Path = path.abspath(file_path)
+        self.Stamps = []
+        self.Version = ''
+        self.CommitHash = ''
+
+        stat_key = VersionStamp.StatKey(self.Path)
+        cached = VersionStamp._Cache.get(self.Path)
+
+        if cached and cached[0] == stat_key:
+            self.Stamps, self.Version, self.CommitHash = cached[1]
+        else:
+            self.Scan()
+            VersionStamp._Cache[self.Path] = [stat_key, [self.Stamps, self.Version, self.CommitHash]]
+
+# reads the version stamps of many binaries at once; directories are searched (recursively) for native binaries.
+def ReadVersionStamps(paths):
+    file_paths = []
+
+    for stamp_path in paths:
+        if path.isdir(stamp_path):
+            for root, dirs, files in os.walk(stamp_path):
+                file_paths.extend(path.join(root, name) for name in sorted(files) if name.endswith('.so') or name in ['dotnet', 'corerun', 'crossgen'])
+        else:
+            file_paths.append(stamp_path)
+
+    return [VersionStamp(file_path) for file_path in file_paths]
+
+# A 'Rover Command' is how Rover (and the lab, which loads this section of the script - see base/lab/shellcall.py) runs things.
+# The trivial file operations (RoverBuiltins) run in-process, and everything else is spawned from its argv - through /bin/sh only
+# when the command needs one (pipes, redirections, $(...), globs) - so a 'mkdir -p' costs no more than a makedirs.
+
+# splits a command up in to its argv; returns (argv, whether it needs a shell, whether it has globs to expand)
+def RoverParseCommand(cmd):
+    if isinstance(cmd, list):
+        return (cmd, False, False)
+
+    needs_shell = False
+    has_glob = False
+    quote = None
+    word_start = True
+    escaped = False
+
+    for char in cmd:
+        if escaped:
+            escaped = False
+        elif char == '\\' and quote != '\'':
+            escaped = True
+        elif quote == '\'':
+            quote = None if char == '\'' else quote
+        elif quote == '"':
+            if char == '"':
+                quote = None
+            elif char in '$`':
+                needs_shell = True
+        elif char in '\'"':
+            quote = char
+        elif char in '|&;<>()$`\n' or (word_start and char in '~#'):
+            needs_shell = True
+        elif char in '*?[':
+            has_glob = True
+
+        word_start = not quote and char in ' \t'
+
+    try:
+        argv = shlex.split(cmd)
+    except ValueError: # unbalanced quotes; let the shell complain about them.
+        return ([], True, has_glob)
+
+    # FOO=bar command
+    if argv and '=' in argv[0].split('/')[0]:
+        needs_shell = True
+
+    return (argv, needs_shell or not argv, has_glob)
+
+def RoverQuoteCommand(cmd):
+    if isinstance(cmd, list):
+        return ' '.join(pipes.quote(arg) for arg in cmd)
+
+    return cmd
+
+# the file operations that we do ourselves rather than spawning a process for. Each takes (arguments, working directory, 
+# a function that prints a line of output) and returns the exit code - or None for options that it doesn't know, which 
+# leaves the command to the real thing.
+class RoverBuiltins:
+    @staticmethod
+    def SplitFlags(arguments):
+        flags = ''
+        while arguments and arguments[0].startswith('-') and len(arguments[0]) > 1:
+            if arguments[0] == '--':
+                return (flags, arguments[1:])
+
+            flags += arguments[0][1:]
+            arguments = arguments[1:]
+
+        return (flags, arguments)
+
+    @staticmethod
+    def Mkdir(arguments, cwd, output):
+        flags, operands = RoverBuiltins.SplitFlags(arguments)
+        if flags.strip('p') or not operands:
+            return None
+
+        exit_code = 0
+        for operand in operands:
+            try:
+                if 'p' not in flags:
+                    os.mkdir(path.join(cwd, operand))
+                elif not path.isdir(path.join(cwd, operand)):
+                    makedirs(path.join(cwd, operand))
+            except OSError as error:
+                output('mkdir: cannot create directory \'%s\': %s'%(operand, error.strerror))
+                exit_code = 1
+
+        return exit_code
+
+    @staticmethod
+    def Touch(arguments, cwd, output):
+        flags, operands = RoverBuiltins.SplitFlags(arguments)
+        if flags or not operands:
+            return None
+
+        exit_code = 0
+        for operand in operands:
+            try:
+                with open(path.join(cwd, operand), 'a'):
+                    os.utime(path.join(cwd, operand), None)
+            except (IOError, OSError) as error:
+                output('touch: cannot touch \'%s\': %s'%(operand, error.strerror))
+                exit_code = 1
+
+        return exit_code
+
+    @staticmethod
+    def Remove(arguments, cwd, output):
+        flags, operands = RoverBuiltins.SplitFlags(arguments)
+        if flags.strip('rRf') or not operands:
+            return None
+
+        exit_code = 0
+        for operand in operands:
+            target = path.join(cwd, operand)
+
+            try:
+                if path.isdir(target) and not path.islink(target):
+                    if not set('rR') & set(flags):
+                        output('rm: cannot remove \'%s\': Is a directory'%(operand))
+                        exit_code = 1
+                        continue
+
+                    shutil.rmtree(target)
+                else:
+                    os.remove(target)
+            except OSError as error:
+                if 'f' not in flags or path.lexists(target):
+                    output('rm: cannot remove \'%s\': %s'%(operand, error.strerror))
+                    exit_code = 1
+
+        return exit_code
+
+    # like cp -R: symlinks are copied as symlinks, and a directory is merged in to one that is already there.
+    @staticmethod
+    def CopyTree(source, destination):
+        if path.islink(source):
+            if path.lexists(destination):
+                os.remove(destination)
+            os.symlink(os.readlink(source), destination)
+        elif path.isdir(source):
+            if not path.isdir(destination):
+                os.mkdir(destination)
+
+            for name in os.listdir(source):
+                RoverBuiltins.CopyTree(path.join(source, name), path.join(destination, name))
+        else:
+            shutil.copy(source, destination)
+
+    @staticmethod
+    def Copy(arguments, cwd, output):
+        flags, operands = RoverBuiltins.SplitFlags(arguments)
+        if flags.strip('rR') or len(operands) < 2:
+            return None
+
+        sources = [path.join(cwd, operand) for operand in operands[:-1]]
+        destination = path.join(cwd, operands[-1])
+
+        if len(sources) > 1 and not path.isdir(destination):
+            output('cp: target \'%s\' is not a directory'%(operands[-1]))
+            return 1
+
+        exit_code = 0
+        for source in sources:
+            target = path.join(destination, path.basename(source.rstrip('/'))) if path.isdir(destination) else destination
+
+            try:
+                if path.isdir(source) and not flags:
+                    output('cp: omitting directory \'%s\''%(source))
+                    exit_code = 1
+                elif flags:
+                    RoverBuiltins.CopyTree(source, target)
+                else:
+                    shutil.copy(source, target)
+            except (IOError, OSError) as error:
+                output('cp: cannot copy \'%s\': %s'%(source, error.strerror))
+                exit_code = 1
+
+        return exit_code
+
+    @staticmethod
+    def List(arguments, cwd, output):
+        flags, operands = RoverBuiltins.SplitFlags(arguments)
+        if flags.strip('1') or len(operands) > 1:
+            return None
+
+        try:
+            for name in sorted(os.listdir(path.join(cwd, operands[0] if operands else '.'))):
+                if not name.startswith('.'):
+                    output(name)
+        except OSError as error:
+            output('ls: cannot access \'%s\': %s'%(operands[0], error.strerror))
+            return 2
+
+        return 0
+
+    @staticmethod
+    def Echo(arguments, cwd, output):
+        if arguments and arguments[0].startswith('-'):
+            return None
+
+        output(' '.join(arguments))
+        return 0
+
+    Commands = {
+        'mkdir' : Mkdir.__func__,
+        'touch' : Touch.__func__,
+        'rm'    : Remove.__func__,
+        'cp'    : Copy.__func__,
+        'ls'    : List.__func__,
+        'echo'  : Echo.__func__
+    }
+
+# runs a command (a string, or an argv list), the output of which goes to our stdout with every line tagged with prefix, when there
+# is one (one write per line keeps the lines of concurrent calls from being torn apart). Returns the exit code.
+def RoverRunCommand(cmd, cwd = None, prefix = None, env = None):
+    cwd = cwd or os.getcwd()
+
+    def output(line):
+        sys.stdout.write('%s %s\n'%(prefix, line) if prefix else line + '\n')
+        sys.stdout.flush()
+
+    argv, needs_shell, has_glob = RoverParseCommand(cmd)
+
+    builtin = RoverBuiltins.Commands.get(argv[0]) if argv and not needs_shell else None
+    if builtin:
+        if has_glob: # just like the shell, a pattern that matches nothing is left alone.
+            argv = [argv[0]] + [match for argument in argv[1:] for match in (sorted(glob.glob(path.join(cwd, argument))) or [argument])]
+
+        exit_code = builtin(argv[1:], cwd, output)
+        if exit_code is not None:
+            return exit_code
+
+    if needs_shell or has_glob:
+        argv = ['/bin/sh', '-c', cmd]
+
+    try:
+        process = Popen(argv, cwd=cwd, env=env, stdout=PIPE if prefix else None, stderr=STDOUT if prefix else None)
+    except OSError as error:
+        output('%s: %s'%(argv[0], error.strerror))
+        return 127
+
+    if prefix:
+        for line in iter(process.stdout.readline, ''):
+            output(line.rstrip('\n'))
+
+    return process.wait()
+
+# places a script that re-runs a failed command in the directory that it ran in; returns its path.
+def RoverWriteRepro(cmd, cwd, repro_filename):
+    repro_destination = path.join(cwd, repro_filename)
+
+    with open(repro_destination, 'w') as repro_file:
+        repro_file.writelines(['#!/usr/bin/env bash\n', 'cd %s\n'%(pipes.quote(cwd)), RoverQuoteCommand(cmd) + '\n'])
+
+    os.chmod(repro_destination, os.stat(repro_destination).st_mode | 0o111)
+    return repro_destination
+
+# A setting that is worked out the first time that it is read, and is an ordinary attribute after that (which can be set like any other)
+#   @RoverLazySetting
+#   def _Rid():
+#       return ...
+class RoverLazySetting(object):
+    def __get__(self, instance, owner):
+        value = self.Compute()
+        setattr(owner, self.Name, value)
+        return value
+
+    def __init__(self, compute):
+        self.Compute = compute
+        self.Name = compute.__name__
+
+# the payload that is patched when none is given; it moves on with every build of the CLI.
+RoverDefaultPayloadURL = 'https://dotnetcli.blob.core.windows.net/dotnet/Sdk/rel-1.0.0/dotnet-dev-debian-x64.latest.tar.gz'
+
 # END ROVER BASE #
 
 class RoverSettings:
@@ -166,6 +1017,8 @@ class RoverSettings:
     _DevMode=False
 
     # This function needs to be here, because otherwise we wouldnt be able to change DevMode. 
+    # os-release is a list of shell-style assignments, e.g. PRETTY_NAME="Ubuntu 16.04.1 LTS" (see man os-release)
+    @staticmethod
     def FetchOSVariables():
         try:
             os_release_path = '/etc/os-release'
@@ -179,11 +1032,15 @@ class RoverSettings:
                 for line in f.readlines():
                     line = line.strip()
 
-                    if not line: # skip blank lines
+                    if not line or line.startswith('#') or '=' not in line: # skip blank lines and comments
                         continue
 
-                    data = line.split('=')
-                    os_vars[str(data[0]).strip('\n\"')] = str(data[1]).strip('\n\"')
+                    # only the first '=' separates the name from the value, and the value may be quoted (and contain '=', quotes or spaces).
+                    name, value = line.split('=', 1)
+                    try:
+                        os_vars[name.strip()] = ' '.join(shlex.split(value))
+                    except ValueError: # unbalanced quotes; take it as it is.
+                        os_vars[name.strip()] = value.strip('\"\'')
                 
             return os_vars
         except IOError:
@@ -191,18 +1048,41 @@ class RoverSettings:
         except:
             RoverSettings._DevMode = True # to prevent cleanup (to support investigation)
             RoverPrint(RoverMods.Red('CAUGHT AN UNEXPECTED EXCEPTION: \"' + RoverMods.White("%s") + '\" of type: %s'%(str(sys.exc_info()[1]), str(sys.exc_info()[0]))))
-            RoverPrint(RoverMods.Red(RoverMods.White('%s')%(str(sys.exc_info()[3]))))
+            RoverPrint(RoverMods.Red(RoverMods.White('%s')%(''.join(traceback.format_tb(sys.exc_info()[2])))))
+
+        return {}
+
+    # nothing here is worked out until it is first read (see RoverLazySetting), so importing Rover costs next to nothing.
+    @RoverLazySetting
+    def _OsVars():
+        return RoverSettings.FetchOSVariables()
+
+    @RoverLazySetting
+    def _Rid():
+        return '%s.%s-x64'%(RoverSettings._OsVars['ID'], RoverSettings._OsVars['VERSION_ID'])
+
+    @RoverLazySetting
+    def _Moniker():
+        return '%s-dotnet'%(RoverSettings._Rid)
 
-    _OsVars                             = FetchOSVariables()
-    _Rid                                = '%s.%s-x64'%(_OsVars['ID'], _OsVars['VERSION_ID'])
-    _Moniker                            = '%s-dotnet'%(_Rid)
     _ScriptDirectory                    = str(path.dirname(path.abspath(__file__)))
     _LaunchedFromDirectory              = os.getcwd()
     
-    _WorkingDirectory                   = path.join(_LaunchedFromDirectory, _Moniker)
-    _srcDirectory                       = path.join(_WorkingDirectory, "src")
-    _objDirectory                       = path.join(_WorkingDirectory, "obj")
-    _binDirectory                       = path.join(_WorkingDirectory, "bin")
+    @RoverLazySetting
+    def _WorkingDirectory():
+        return path.join(RoverSettings._LaunchedFromDirectory, RoverSettings._Moniker)
+
+    @RoverLazySetting
+    def _srcDirectory():
+        return path.join(RoverSettings._WorkingDirectory, "src")
+
+    @RoverLazySetting
+    def _objDirectory():
+        return path.join(RoverSettings._WorkingDirectory, "obj")
+
+    @RoverLazySetting
+    def _binDirectory():
+        return path.join(RoverSettings._WorkingDirectory, "bin")
 
     @staticmethod
     def SetWorkingDirectory(working_dir):
@@ -213,10 +1093,18 @@ class RoverSettings:
 
 
     PayloadPath                         = str('')
-    PatchTargetPath                     = _binDirectory
     BuildSet                            = []
     Patch                               = True
 
+    @RoverLazySetting
+    def PatchTargetPath():
+        return RoverSettings._binDirectory
+
+    # the total CPU budget shared between all of the concurrently running component builds.
+    @RoverLazySetting
+    def Jobs():
+        return RoverCPUCount()
+
     CoreCLRBinDirectory                 = ''
     CoreFXBinDirectory                  = ''
     CoreSetupBinDirectory               = ''
@@ -228,149 +1116,1219 @@ class RoverSettings:
 
     DotNetCommitHash                    = ''
 
-    @staticmethod
-    def MaxPrecedence(versionStrA, versionStrB):
-        versionA = SemanticVersion(versionStrA)
-        versionB = SemanticVersion(versionStrB)
-        
-        if(versionA > versionB):
-            return versionA
+    # how PatchTarget places a file: 'reflink' (a copy-on-write clone where the filesystem can, a copy otherwise), 'copy' or 'hardlink'
+    PatchLinkMode                       = 'reflink'
+
+    # when this run started; the install manifests tell the files patched by this run from those of the ones before it.
+    RunStarted                          = time.time()
+
+    # more install trees to patch, every version in each (see -patch-trees): directories, or payloads to extract; and where they ended up.
+    PatchTrees                          = []
+    PatchTreePaths                      = []
+
+    # when set, the downloaded payload must have this sha256 checksum.
+    PayloadSHA256                       = ''
+
+    # the commit each component is built from, {component: hash}
+    CommitHashes                        = {}
+
+    # the components whose outputs came out of the build cache before they were fetched; they are neither fetched nor built (see RestoreCachedComponents)
+    RestoredComponents                  = set()
+
+    # when set, the compilers of the native builds run through ccache, with a cache per component in this directory (see CompilerCacheEnvironment)
+    CompilerCacheDirectory              = ''
+    # the directory of links to ccache that goes on the PATH of the builds (made in obj by MakeCompilerCacheLinks)
+    CompilerCacheLinks                  = ''
+
+    # the peak memory of the last few builds of each component, which the builds are admitted by (see RunBuildJobs)
+    @RoverLazySetting
+    def Costs():
+        return RoverCosts(path.join(RoverSettings.CacheDirectory, 'costs.json'))
 
-        return versionB
+    # the memory that the builds are admitted against: most of what is available when the first of them starts (see -memory)
+    @RoverLazySetting
+    def Admission():
+        available = RoverMemoryAvailable()
+        return RoverAdmission(available * 9 / 10 if available is not None else None)
 
+    # run the steps of the components as a graph of what depends on what (see RunPipeline), rather than phase by phase.
+    Pipeline                            = False
+
+    # fetch only the pinned commit of each repository instead of cloning its whole history.
+    ShallowFetch                        = True
+    # when set, the repositories are fetched from <GitRemoteBase>/<component> instead of GitHub (e.g. a directory of bare repos)
+    GitRemoteBase                       = ''
+    # when set, we keep a bare mirror of every repository here and make our checkouts from it (sharing its objects)
+    MirrorDirectory                     = ''
+
+    UseCache                            = True
+    CacheDirectory                      = path.join(os.environ.get('XDG_CACHE_HOME', path.join(path.expanduser('~'), '.cache')), 'rover')
+    VersionStampCache                   = path.join(CacheDirectory, 'version-stamps.json')
+    CacheSize                           = 20 * 1024 * 1024 * 1024 # bytes
 
+    @staticmethod
+    def MaxPrecedence(versionStrA, versionStrB):
+        return max(SemanticVersion(versionStrA), SemanticVersion(versionStrB))
+
+    # the greatest version in a directory (the directories that aren't versions don't count); a made up '0.0.0-alpha-00000' if there is none.
     @staticmethod
     def SelectGreatestPrecendenceDirectory(containerDirectory):
-        maxVersion = '0.0.0-alpha-00000'
+        versions = RoverVersionIndex.Scan(containerDirectory)
 
-        for root, dirs, files in os.walk(containerDirectory):
-            for dirName in dirs:
-                maxVersion = RoverSettings.MaxPrecedence(dirName, maxVersion)
-                
-            break # just 'walk' the top level.
-        
-        return str(maxVersion)
+        return versions[-1][1] if versions else '0.0.0-alpha-00000'
     
     @staticmethod
     def SetPatchTargetPath(pathToFolder):
         if path.exists(pathToFolder):
             RoverSettings.PatchTargetPath = pathToFolder
-            # require there to be a Microsoft.NETCore.App in the shared
-            # we will locate the highest version;
-            shared_containerFolder = path.join(pathToFolder, path.join('shared', 'Microsoft.NETCore.App'))
-            RoverSettings.PatchTarget_Shared   = path.join(shared_containerFolder, RoverSettings.SelectGreatestPrecendenceDirectory(shared_containerFolder)) 
-
-            # will locate the highest version and patch that
-            sdk_containerFolder = path.join(pathToFolder, path.join('sdk'))
-            RoverSettings.PatchTarget_SDK      = path.join(sdk_containerFolder, RoverSettings.SelectGreatestPrecendenceDirectory(sdk_containerFolder))
-            
-            # require the host to be 'fxr', then we take the highest version.
-            host_containerFolder = path.join(pathToFolder, path.join('host', 'fxr'))
-            RoverSettings.PatchTarget_Host     = path.join(host_containerFolder, RoverSettings.SelectGreatestPrecendenceDirectory(host_containerFolder))
-
+            index = RoverVersionIndex(pathToFolder)
 
-if path.exists(RoverSettings._WorkingDirectory):
-    RoverPrint(RoverMods.Header(RoverMods.Red('FORCED SETTINGS CHANGE: DEV MODE \'ON\' ')))
-    RoverPrint(RoverMods.Yellow(('will skip all git commands.')))
-    RoverPrint(RoverMods.Yellow(('requires the deletion of the directory \'%s\' to reset the dev-mode trigger.'%(RoverSettings._WorkingDirectory))))
+            # we patch the highest version of the shared framework (Microsoft.NETCore.App), the sdk and the host ('fxr')
+            RoverSettings.PatchTarget_Shared   = index.Folder('shared', index.Latest('shared') or '0.0.0-alpha-00000')
+            RoverSettings.PatchTarget_SDK      = index.Folder('sdk',    index.Latest('sdk') or '0.0.0-alpha-00000')
+            RoverSettings.PatchTarget_Host     = index.Folder('host',   index.Latest('host') or '0.0.0-alpha-00000')
 
-    RoverSettings._DevMode=True
+    # DevMode is triggered by a pre-existing working directory - one that an earlier run staged in (a -to directory may well exist
+    # beforehand, holding nothing but the bootstrap); this runs once the working directory is set (rather than on import)
+    @staticmethod
+    def DetectDevMode():
+        if any(path.exists(directory) for directory in [RoverSettings._srcDirectory, RoverSettings._objDirectory, RoverSettings._binDirectory]):
+            RoverPrint(RoverMods.Header(RoverMods.Red('FORCED SETTINGS CHANGE: DEV MODE \'ON\' ')))
+            RoverPrint(RoverMods.Yellow(('will skip all git commands.')))
+            RoverPrint(RoverMods.Yellow(('requires the deletion of the directory \'%s\' to reset the dev-mode trigger.'%(RoverSettings._WorkingDirectory))))
 
-# A 'Rover Shell Call' is a shell call that we want to be reproduceable in the event of a failure. 
-# namely, something that a developer can go in and 'drill in' on without running the entirety of the 
-# build again.
-def RoverShellCall(cmd, cwd = None):
-    if not cwd:
-        cwd = os.getcwd()
+            RoverSettings._DevMode=True
 
-    try:
-        check_call(cmd, shell=True, cwd=cwd)
+# when a call fails, we place a repro script next to it and bail out, so that the developer can 'drill in' on it.
+def RoverFailWithRepro(cmd, cwd):
+    RoverSettings._DevMode = True
 
-    except CalledProcessError as repro_data:
-        RoverSettings._DevMode = True
+    repro_filename = 'rover_failure-repro.sh'
 
-        repro_filename = 'rover_failure-repro.sh'
-        repro_destination = path.join(cwd, repro_filename)
+    # when the call fails, print a repro to the working directory.
+    repro_destination = RoverWriteRepro(cmd, cwd, repro_filename)
 
-        # when the call fails, print a repro to the working directory.
-        with open(repro_destination, 'w') as repro_file:
-            repro_file.writelines(['#!/usr/bin/env bash\n', repro_data.cmd + '\n'])
-            
-        if os.getuid() == 0:
-            call('chmod +x %s'%(repro_filename), shell=True, cwd=cwd)
+    RoverPrint(RoverMods.Red('has detected a failure. A repro shell script has been placed at ') + RoverMods.Yellow(repro_destination))
+    RoverPrint(RoverMods.White('To reproduce the failure:\n\tcd %s\n\t./%s'%(cwd, repro_filename)))
+    RoverPrint(RoverMods.Red('is forcefully closing. Note that re-running Rover will execute it with DevMode enabled (no git commands will be run)'))
 
-        RoverPrint(RoverMods.Red('has detected a failure. A repro shell script has been placed at ') + RoverMods.Yellow(repro_destination))
-        RoverPrint(RoverMods.White('To reproduce the failure:\n\tcd %s\n\t./%s'%(cwd, repro_filename)))
-        RoverPrint(RoverMods.Red('is forcefully closing. Note that re-running Rover will execute it with DevMode enabled (no git commands will be run)'))
+    RoverTrace.Save()
+    os._exit(1) # if we fail a check_call then we want to bail out asap so the dev can investigate.
 
-        os._exit(1) # if we fail a check_call then we want to bail out asap so the dev can investigate.
+# A 'Rover Prefixed Shell Call' is a shell call whose output lines are tagged with a prefix, so that
+# several of them can share the console at the same time. It returns the exit code rather than bailing out,
+# because it is expected to run in a worker process (see RunBuildJobs).
+def RoverPrefixedShellCall(cmd, cwd, prefix, env = None):
+    with RoverSpan(RoverQuoteCommand(cmd), 'shell', cwd=cwd) as span:
+        span.Args['exit_code'] = RoverRunCommand(cmd, cwd, prefix, env)
 
+    return span.Args['exit_code']
 
 ##
 ## ROVER FUNCTION DEFINITIONS
 ##
 
+# A file-like wrapper around a download: everything that is read through it is also appended to the partial
+# download on disk and hashed, so that a reader (tarfile) can consume the payload while it is being downloaded.
+class RoverDownloadStream:
+    ChunkSize = 1024 * 1024
+
+    def read(self, size = -1):
+        if size is None or size < 0:
+            chunks = []
+            chunk = self.read(self.ChunkSize)
+            while chunk:
+                chunks.append(chunk)
+                chunk = self.read(self.ChunkSize)
+
+            return ''.join(chunks)
+
+        data = self.Response.read(size)
+
+        if data:
+            self.PartialFile.write(data)
+            self.Digest.update(data)
+            self.BytesRead += len(data)
+
+        return data
+
+    # reads whatever is left (tarfile stops at the end-of-archive marker, which may leave padding behind)
+    def Drain(self):
+        while self.read(self.ChunkSize):
+            pass
+
+    def __init__(self, response, partial_file, digest):
+        self.Response = response
+        self.PartialFile = partial_file
+        self.Digest = digest
+        self.BytesRead = 0
+
+# extracts the members of an open (streaming) tarfile in to destination_folder. A member that is already on disk with 
+# the same size and mtime is left alone, which makes re-staging a payload in to an existing bin/ directory incremental. Returns (bytes extracted, members extracted, members skipped).
+def ExtractMembers(payload_tar, destination_folder):
+    extracted_bytes, extracted_count, skipped_count = 0, 0, 0
+    directories = []
+
+    for member in payload_tar:
+        # same as tar: nothing gets to land outside of the destination.
+        if path.isabs(member.name) or '..' in member.name.split('/'):
+            raise tarfile.ExtractError('refusing to extract %s outside of %s'%(member.name, destination_folder))
+
+        member_path = path.join(destination_folder, member.name)
+
+        if member.isdir():
+            # like TarFile.extractall, the directory attributes are set once their contents are in place.
+            directories.append(member)
+            directory_member = copy.copy(member)
+            directory_member.mode = 0700
+            payload_tar.extract(directory_member, destination_folder)
+            continue
+
+        if member.isfile():
+            try:
+                member_stat = os.lstat(member_path)
+                if member_stat.st_size == member.size and int(member_stat.st_mtime) == member.mtime:
+                    skipped_count += 1
+                    continue
+            except OSError:
+                pass
+
+        if member.issym() and path.islink(member_path) and os.readlink(member_path) == member.linkname:
+            skipped_count += 1
+            continue
+
+        # extract() won't overwrite a symlink that points at a file we are replacing, so clear the way first.
+        if path.islink(member_path) or (path.lexists(member_path) and not member.isfile()):
+            os.remove(member_path)
+
+        payload_tar.extract(member, destination_folder)
+        extracted_bytes += member.size
+        extracted_count += 1
+
+    directories.sort(key=lambda member: member.name, reverse=True)
+    for member in directories:
+        directory_path = path.join(destination_folder, member.name)
+        payload_tar.chown(member, directory_path)
+        payload_tar.utime(member, directory_path)
+        payload_tar.chmod(member, directory_path)
+
+    return (extracted_bytes, extracted_count, skipped_count)
+
+def ReportExtraction(extraction_stats, elapsed):
+    extracted_bytes, extracted_count, skipped_count = extraction_stats
+    elapsed = max(elapsed, 0.001)
+
+    RoverPrint(RoverMods.Blue('extracted %d files (%.1f MB) in %.1fs (%.1f MB/s), skipped %d unchanged files'%(extracted_count, extracted_bytes / 1048576.0, elapsed, extracted_bytes / 1048576.0 / elapsed, skipped_count)))
+
+# untars payload_path in to destination_folder in-process. A gzipped payload is decompressed by pigz when it is 
+# around (it decompresses on separate threads from our untarring), and by python's own gzip otherwise.
+def ExtractPayload(payload_path, destination_folder):
+    RoverPrint(RoverMods.Blue('is extracting %s in to %s'%(RoverMods.Yellow(payload_path), RoverMods.Yellow(destination_folder))))
+
+    start = time.time()
+    pigz = find_executable('pigz')
+
+    if pigz and (payload_path.endswith('.gz') or payload_path.endswith('.tgz')):
+        decompressor = Popen([pigz, '-dc', payload_path], stdout=PIPE)
+
+        try:
+            with tarfile.open(fileobj=decompressor.stdout, mode='r|') as payload_tar:
+                extraction_stats = ExtractMembers(payload_tar, destination_folder)
+        finally:
+            decompressor.stdout.close()
+
+            if decompressor.wait() not in [0, -signal.SIGPIPE]:
+                raise IOError('pigz failed to decompress %s'%(payload_path))
+    else:
+        with tarfile.open(payload_path, mode='r|*') as payload_tar:
+            extraction_stats = ExtractMembers(payload_tar, destination_folder)
+
+    ReportExtraction(extraction_stats, time.time() - start)
+
+def LoadDownloadMetadata(metadata_path):
+    try:
+        with open(metadata_path) as metadata_file:
+            return json.load(metadata_file)
+    except (IOError, ValueError):
+        return {}
+
+def SaveDownloadMetadata(metadata_path, metadata):
+    with open(metadata_path, 'w') as metadata_file:
+        json.dump(metadata, metadata_file, indent=4)
+
+def HashFile(file_path, digest):
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(RoverDownloadStream.ChunkSize), ''):
+            digest.update(chunk)
+
+    return digest
+
+# Downloads 'url' to 'destination', streaming it in chunks.
+#   - the ETag/Last-Modified/size of the download are remembered next to it (<destination>.rover.json), and
+#     an unchanged payload is never fetched again (we ask the server with If-None-Match/If-Modified-Since).
+#   - an interrupted download is left in <destination>.partial, and is resumed with a Range request.
+#   - the sha256 of the download is checked against expected_sha256 (if there is one).
+#   - if extract_to is given, a fresh (not resumed) download is untarred in to it while it downloads. With an expected_sha256,
+#     it is untarred in to <extract_to>.rover-staging instead, and only moved in to extract_to once the sha256 checks out.
+# returns True if the payload was extracted in to extract_to.
+def DownloadPayload(url, destination, expected_sha256 = '', extract_to = None):
+    import urllib2 # it pulls in ssl and httplib, which is most of what importing Rover would cost otherwise.
+
+    metadata_path   = destination + '.rover.json'
+    partial_path    = destination + '.partial'
+    metadata        = LoadDownloadMetadata(metadata_path)
+
+    if metadata.get('url') != url:
+        metadata = {}
+
+    have_destination = path.exists(destination) and metadata.get('complete') and (not expected_sha256 or metadata.get('sha256') == expected_sha256)
+
+    request = urllib2.Request(url)
+    offset = 0
+
+    if have_destination:
+        if metadata.get('etag'):
+            request.add_header('If-None-Match', metadata['etag'])
+        if metadata.get('last_modified'):
+            request.add_header('If-Modified-Since', metadata['last_modified'])
+
+    elif path.exists(partial_path) and (metadata.get('etag') or metadata.get('last_modified')):
+        offset = path.getsize(partial_path)
+        request.add_header('Range', 'bytes=%d-'%(offset))
+        request.add_header('If-Range', metadata.get('etag') or metadata.get('last_modified'))
+
+    try:
+        response = urllib2.urlopen(request)
+    except urllib2.HTTPError as http_error:
+        if http_error.code == 304:
+            RoverPrint(RoverMods.Blue('is using the unchanged payload in %s'%(RoverMods.Yellow(destination))))
+            return False
+
+        if http_error.code == 416: # the partial download is no good, start over.
+            os.remove(partial_path)
+            return DownloadPayload(url, destination, expected_sha256, extract_to)
+
+        raise
+    except urllib2.URLError:
+        if have_destination:
+            RoverPrint(RoverMods.Yellow('could not reach %s, so is using the payload already in %s'%(url, destination)))
+            return False
+
+        raise
+
+    etag            = response.info().getheader('ETag')
+    last_modified   = response.info().getheader('Last-Modified')
+    content_length  = response.info().getheader('Content-Length')
+
+    # a server that ignores conditional requests still gets to skip the download, if it describes the same file.
+    if have_destination and etag == metadata.get('etag') and last_modified == metadata.get('last_modified') and content_length and int(content_length) == metadata.get('size'):
+        response.close()
+        RoverPrint(RoverMods.Blue('is using the unchanged payload in %s'%(RoverMods.Yellow(destination))))
+        return False
+
+    if response.getcode() != 206: # the server gave us the whole thing.
+        offset = 0
+
+    total_size = offset + int(content_length) if content_length else None
+
+    metadata = { 'url' : url, 'etag' : etag, 'last_modified' : last_modified, 'size' : total_size, 'complete' : False }
+    SaveDownloadMetadata(metadata_path, metadata)
+
+    digest = hashlib.sha256()
+    if offset:
+        RoverPrint(RoverMods.Blue('is resuming the download of %s at %d bytes'%(url, offset)))
+        HashFile(partial_path, digest)
+    else:
+        RoverPrint(RoverMods.Blue('is downloading %s'%(url)))
+
+    extracted = False
+    start = time.time()
+
+    # nothing that we can't vouch for lands in extract_to.
+    staging_directory = extract_to.rstrip('/') + '.rover-staging' if extract_to and expected_sha256 else extract_to
+    if staging_directory != extract_to:
+        shutil.rmtree(staging_directory, ignore_errors=True)
+
+    with open(partial_path, 'ab' if offset else 'wb') as partial_file:
+        stream = RoverDownloadStream(response, partial_file, digest)
+
+        if extract_to and not offset:
+            try:
+                with tarfile.open(fileobj=stream, mode='r|*') as payload_tar:
+                    extraction_stats = ExtractMembers(payload_tar, staging_directory)
+                extracted = True
+            except (tarfile.TarError, EOFError, IOError, zlib.error):
+                # a download that was cut short is reported below (and extracted from disk once it has been resumed)
+                # an archive that really is broken will fail again when we extract it from disk.
+                extracted = False
+
+        stream.Drain()
+        response.close()
+
+    elapsed = max(time.time() - start, 0.001)
+    RoverPrint(RoverMods.Blue('downloaded %.1f MB in %.1fs (%.1f MB/s)'%(stream.BytesRead / 1048576.0, elapsed, stream.BytesRead / 1048576.0 / elapsed)))
+
+    sha256 = digest.hexdigest()
+    complete = total_size is None or path.getsize(partial_path) == total_size
+
+    if staging_directory != extract_to:
+        if extracted and complete and sha256 == expected_sha256:
+            MoveTreeInto(staging_directory, extract_to)
+        else:
+            shutil.rmtree(staging_directory, ignore_errors=True)
+
+    if extracted and complete and (not expected_sha256 or sha256 == expected_sha256):
+        ReportExtraction(extraction_stats, elapsed)
+
+    if not complete:
+        raise IOError('the download of %s was cut short (%d of %d bytes) - run again to resume it.'%(url, path.getsize(partial_path), total_size))
+
+    if expected_sha256 and sha256 != expected_sha256:
+        os.remove(partial_path)
+        raise IOError('the download of %s has the sha256 %s, expected %s'%(url, sha256, expected_sha256))
+
+    os.rename(partial_path, destination)
+
+    metadata['sha256'] = sha256
+    metadata['complete'] = True
+    SaveDownloadMetadata(metadata_path, metadata)
+
+    return extracted
+
+# moves the contents of source_folder over those of destination_folder (what else is in there is left alone), then removes it.
+def MoveTreeInto(source_folder, destination_folder):
+    if not path.exists(destination_folder):
+        os.rename(source_folder, destination_folder)
+        return
+
+    for root, dirs, files in os.walk(source_folder):
+        target_root = path.join(destination_folder, path.relpath(root, source_folder))
+
+        # os.walk lists the symlinks to directories with the directories, but they get moved like files.
+        for name in [name for name in dirs if path.islink(path.join(root, name))]:
+            dirs.remove(name)
+            files.append(name)
+
+        # a directory that the destination doesn't have is moved whole (with the attributes the payload gave it).
+        for name in list(dirs):
+            target = path.join(target_root, name)
+
+            if path.islink(target) or (path.lexists(target) and not path.isdir(target)):
+                os.remove(target)
+            if not path.exists(target):
+                os.rename(path.join(root, name), target)
+                dirs.remove(name)
+
+        for name in files:
+            target = path.join(target_root, name)
+
+            if path.isdir(target) and not path.islink(target):
+                shutil.rmtree(target)
+            os.rename(path.join(root, name), target)
+
+    shutil.rmtree(source_folder)
+
+def IsURL(payload_path):
+    return payload_path.startswith('http://') or payload_path.startswith('https://')
+
 # detination_folder is expected to be relative to the _ScriptDirectory. 
-# payload path is expected to be a dotnet-cli tarball.
+# payload path is expected to be a dotnet-cli tarball (or the URL of one).
 def SpawnPatchTarget(destination_folder, payload_path):
     try:
-        if payload_path and not path.isabs(payload_path):
+        payload_url = None
+
+        if payload_path and IsURL(payload_path):
+            payload_url = payload_path
+            payload_path = path.join(RoverSettings._objDirectory, path.basename(urlparse.urlparse(payload_url).path))
+
+        elif payload_path and not path.isabs(payload_path):
             payload_path = path.join(RoverSettings._LaunchedFromDirectory, payload_path)
 
         if not path.isabs(destination_folder):
             destination_folder = path.join(RoverSettings._LaunchedFromDirectory, destination_folder)
 
-        if not path.exists(str(payload_path)):
-            fallback_url = 'https://dotnetcli.blob.core.windows.net/dotnet/Sdk/rel-1.0.0/dotnet-dev-debian-x64.latest.tar.gz'               
-
+        if not payload_url and not path.exists(str(payload_path)):
+            payload_url         = RoverDefaultPayloadURL
             payload_filename    = 'dotnet.latest.tar.gz'
             payload_path        = path.join(RoverSettings._objDirectory, payload_filename)
-            
+
+        extracted = False
+        if payload_url:
             if not path.exists(payload_path):
-                RoverPrint(RoverMods.Blue('is downloading latest .NET CLI for bootstrapping (%s)'%(payload_filename)))
+                RoverPrint(RoverMods.Blue('is downloading latest .NET CLI for bootstrapping (%s)'%(path.basename(payload_path))))
 
-            urlretrieve(fallback_url, payload_path)
+            extracted = DownloadPayload(payload_url, payload_path, RoverSettings.PayloadSHA256, destination_folder)
         
         # lets force the path to be made absolute - assuming that the payload path is relative to the directory we launched the script from.
         # otherwise if we have an abs path already - fantastic.
 
-        RoverShellCall('tar xf %s -C %s'%(payload_path, destination_folder))    
+        if not extracted:
+            ExtractPayload(payload_path, destination_folder)
     except:
         RoverSettings._DevMode = True
         UnexpectedRoverException(sys.exc_info())
     
     RoverSettings.SetPatchTargetPath(path.join(RoverSettings._ScriptDirectory, destination_folder))
 
+# the install trees of -patch-trees: a directory is patched where it is, a payload (a tarball, or the URL of one) is extracted in to
+# <working directory>/trees/<its name> first. They are spawned side by side, and their directories go in to RoverSettings.PatchTreePaths.
+def SpawnPatchTrees(tree_sources):
+    try:
+        trees_directory = path.join(RoverSettings._WorkingDirectory, 'trees')
+        spawn_jobs = []
+
+        for tree_source in tree_sources:
+            if not IsURL(tree_source) and path.isdir(tree_source):
+                spawn_jobs.append((tree_source, None))
+                continue
+
+            name = path.basename(urlparse.urlparse(tree_source).path if IsURL(tree_source) else tree_source)
+            for extension in ['.tar.gz', '.tgz', '.tar']:
+                if name.endswith(extension):
+                    name = name[:-len(extension)]
+                    break
+
+            # two payloads of the same name each get a tree of their own.
+            tree = path.join(trees_directory, name)
+            if tree in [spawned_tree for source, spawned_tree in spawn_jobs]:
+                tree = path.join(trees_directory, '%s-%d'%(name, len(spawn_jobs)))
+
+            spawn_jobs.append((tree_source, tree))
+
+        def spawn(spawn_job):
+            tree_source, tree = spawn_job
+
+            if not tree:
+                return tree_source
+
+            if IsURL(tree_source):
+                payload_path = path.join(RoverSettings._objDirectory, path.basename(urlparse.urlparse(tree_source).path))
+
+                if DownloadPayload(tree_source, payload_path, '', tree):
+                    return tree
+            else:
+                payload_path = tree_source
+
+            ExtractPayload(payload_path, tree)
+            return tree
+
+        pool = multiprocessing.pool.ThreadPool(max(1, min(8, len(spawn_jobs))))
+        try:
+            # a timeout on get() keeps us responsive to Ctrl+C (a bare get() swallows it in python 2)
+            trees = pool.map_async(spawn, spawn_jobs).get(60 * 60 * 24 * 7)
+            pool.close()
+        finally:
+            pool.join()
+
+        for tree in trees:
+            RoverPrint(RoverMods.Blue('will also patch every version in %s'%(RoverMods.Yellow(tree))))
+
+        RoverSettings.PatchTreePaths = trees
+    except:
+        RoverSettings._DevMode = True
+        UnexpectedRoverException(sys.exc_info())
+
+# we are fixed to using libuv 1.9.0 - this is the commit hash for that (https://github.com/libuv/libuv/commit/229b3a4cc150aebd6561e6bd43076eafa7a03756)
+LibUVCommitHash = '229b3a4cc150aebd6561e6bd43076eafa7a03756'
+
+RoverRepositories = {
+    'coreclr'       : 'http://www.github.com/dotnet/coreclr',
+    'corefx'        : 'http://www.github.com/dotnet/corefx',
+    'core-setup'    : 'http://www.github.com/dotnet/core-setup',
+    'libuv'         : 'http://www.github.com/libuv/libuv'
+}
+
+def RepositoryURL(component):
+    if RoverSettings.GitRemoteBase:
+        remote_base = RoverSettings.GitRemoteBase
+
+        # git ignores --depth for plain local paths, file:// makes it honor it.
+        if path.isabs(remote_base):
+            remote_base = 'file://' + remote_base
+
+        return '%s/%s'%(remote_base.rstrip('/'), component)
+
+    return RoverRepositories[component]
+
+def MirrorPath(component):
+    return path.join(RoverSettings.MirrorDirectory, '%s.git'%(component))
+
+def RepositoryHasCommit(repository_directory, commit_hash):
+    with open(os.devnull, 'w') as devnull:
+        return call(['git', 'cat-file', '-e', '%s^{commit}'%(commit_hash)], cwd=repository_directory, stdout=devnull, stderr=devnull) == 0
+
+# what keeps a mirror whole (see RefreshMirror): no automatic gc, and a gc that is run by hand keeps the unreachable objects.
+MirrorConfigSteps = ['git config gc.auto 0', 'git config gc.pruneExpire never']
+
+# makes sure that the mirror of a component exists and has the commit we want - cloning it the first time, 
+# and fetching just what is new after that. The mirrors are shared between working directories (and lab containers)
+# so we hold a lock on the mirror while we touch it.
+# the checkouts borrow their objects from the mirror (see FetchRepository), so the mirror must never drop one: a gc after a branch
+# was force pushed or deleted upstream (--prune) would pull objects out from under them. So the mirrors are never collected and never
+# prune, at the price of keeping every object they ever fetched.
+# returns (component, failed command, failed working directory) - the failure pair is None on success.
+def RefreshMirror(component, commit_hash):
+    prefix = RoverComponentPrefix(component)
+    mirror_path = MirrorPath(component)
+
+    with open(mirror_path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        if not path.exists(mirror_path):
+            RoverPrint('%s %s'%(prefix, RoverMods.Blue('is creating a mirror in %s'%(mirror_path))))
+
+            # clone next to the mirror and rename it in to place, so that an interrupted clone never passes as a mirror.
+            partial_path = mirror_path + '.partial'
+            shutil.rmtree(partial_path, ignore_errors=True)
+
+            steps = [('git clone -q --mirror %s %s'%(RepositoryURL(component), partial_path), RoverSettings.MirrorDirectory)] + [(cmd, partial_path) for cmd in MirrorConfigSteps]
+            for cmd, cwd in steps:
+                if RoverPrefixedShellCall(cmd, cwd, prefix) != 0:
+                    return (component, cmd, cwd)
+
+            os.rename(partial_path, mirror_path)
+
+        elif not RepositoryHasCommit(mirror_path, commit_hash):
+            RoverPrint('%s %s'%(prefix, RoverMods.Blue('is updating its mirror (%s)'%(mirror_path))))
+
+            # (a mirror made before we kept them whole gets the settings before its first gc can run - fetching may start one)
+            for cmd in MirrorConfigSteps + ['git remote update --prune']:
+                if RoverPrefixedShellCall(cmd, mirror_path, prefix) != 0:
+                    return (component, cmd, mirror_path)
+
+    return (component, None, None)
+
+# fetches a single repository at its pinned commit; runs on a thread of the pool in CloneRepositories.
+# returns (component, failed command, failed working directory) - the failure pair is None on success.
+def FetchRepository(fetch_job):
+    component, cwd, commit_hash = fetch_job
+
+    prefix = RoverComponentPrefix(component)
+    repository_directory = path.join(cwd, component)
+    url = RepositoryURL(component)
+
+    if RoverSettings.MirrorDirectory:
+        mirror_result = RefreshMirror(component, commit_hash)
+        if mirror_result[1]:
+            return mirror_result
+
+        # --shared borrows the objects of the mirror (like --reference) rather than copying them.
+        # origin goes back to pointing at the real repository, so that the checkout behaves like any other clone.
+        steps = [('git clone -q --shared --no-checkout %s %s'%(MirrorPath(component), component), cwd),
+                 ('git remote set-url origin %s'%(url), repository_directory)]
+    elif RoverSettings.ShallowFetch:
+        # an init + a depth 1 fetch of the one commit we want, rather than the whole history.
+        steps = [('git init -q %s'%(component), cwd),
+                 ('git remote add origin %s'%(url), repository_directory)]
+    else:
+        steps = [('git clone %s %s'%(url, component), cwd)]
+
+    for cmd, step_cwd in steps:
+        if RoverPrefixedShellCall(cmd, step_cwd, prefix) != 0:
+            return (component, cmd, step_cwd)
+
+    if RoverSettings.ShallowFetch and not RoverSettings.MirrorDirectory:
+        if RoverPrefixedShellCall('git fetch -q --depth 1 origin %s'%(commit_hash), repository_directory, prefix) != 0:
+            # not every server lets us ask for a commit by its SHA (uploadpack.allowReachableSHA1InWant), so fall back to everything.
+            RoverPrint('%s %s'%(prefix, RoverMods.Yellow('the server refused a shallow fetch of %s, falling back to a full fetch.'%(commit_hash))))
+
+            cmd = 'git fetch -q origin'
+            if RoverPrefixedShellCall(cmd, repository_directory, prefix) != 0:
+                return (component, cmd, repository_directory)
+
+    cmd = 'git -c advice.detachedHead=false checkout -q %s'%(commit_hash)
+    if RoverPrefixedShellCall(cmd, repository_directory, prefix) != 0:
+        return (component, cmd, repository_directory)
+
+    return (component, None, None)
+
 def CloneRepositories(cwd,
                         coreclr_commit_hash, 
                         corefx_commit_hash,
                         dotnet_commit_hash):
+    CloneComponents(cwd, {
+        'coreclr'       : coreclr_commit_hash,
+        'corefx'        : corefx_commit_hash,
+        'core-setup'    : dotnet_commit_hash,
+        'libuv'         : LibUVCommitHash
+    })
+
+# the components of the build set whose outputs the build cache has (for their commit) are restored from it before anything is
+# fetched, so that a hit costs neither a clone nor a build. Not in DevMode, where the sources are the developer's to change; a
+# component that was restored without its sources is left alone in DevMode too, until its directory is deleted (see BuildComponents).
+# returns the components that were restored.
+def RestoreCachedComponents(cwd, commit_hashes):
+    if not RoverSettings.UseCache or RoverSettings._DevMode:
+        return []
+
+    cache = RoverArtifactCache(RoverSettings.CacheDirectory, RoverSettings.CacheSize)
+    restored = []
+
+    for component in [component for component in RoverComponents if component in commit_hashes and component in RoverSettings.BuildSet]:
+        if path.exists(path.join(cwd, component)):
+            continue
+
+        key = cache.Key(component, commit_hashes[component], ComponentBuildFlags(component))
+
+        if cache.Restore(component, key):
+            RoverPrint('%s %s'%(RoverComponentPrefix(component), RoverMods.Green('was restored from the build cache (%s), so it is not fetched'%(key[:12]))))
+            RoverSettings.RestoredComponents.add(component)
+            SaveFingerprints({component: 'cache:%s'%(key)})
+            restored.append(component)
+
+    return restored
+
+# fetches the repositories of the components in commit_hashes ({component: commit hash}) at the same time - but for those that
+# the build cache already has the outputs of.
+def CloneComponents(cwd, commit_hashes):
     try:
-        if not path.exists(path.join(cwd, 'coreclr')):
-            RoverShellCall('git clone http://www.github.com/dotnet/coreclr', cwd=cwd)
-            RoverShellCall('git checkout %s'%(coreclr_commit_hash), cwd=path.join(cwd, 'coreclr'))
+        restored = RestoreCachedComponents(cwd, commit_hashes)
 
-        if not path.exists(path.join(cwd, 'corefx')):
-            RoverShellCall('git clone http://www.github.com/dotnet/corefx', cwd=cwd)
-            RoverShellCall('git checkout %s'%(corefx_commit_hash), cwd=path.join(cwd, 'corefx'))
+        fetch_jobs = []
+        for component in [component for component in RoverComponents if component in commit_hashes and component not in restored]:
+            if path.exists(path.join(cwd, component)):
+                if not path.exists(path.join(cwd, component, '.git')):
+                    RoverPrint(RoverMods.Yellow(('%s was restored from the build cache without its sources; delete %s to fetch them.'%(component, path.join(cwd, component)))))
+                    continue
 
-        if not path.exists(path.join(cwd, 'core-setup')):
-            RoverShellCall('git clone http://www.github.com/dotnet/core-setup', cwd=cwd)
-            RoverShellCall('git checkout %s'%(dotnet_commit_hash), cwd=path.join(cwd, 'core-setup'))   
+                RoverPrint(RoverMods.Yellow(('DEVMODE IS ON. Skipping all git calls for %s : I.e. you must manually control git your self.'%(component))))
+                continue
 
-        if not path.exists(path.join(cwd, 'libuv')):
-            RoverShellCall('git clone http://www.github.com/libuv/libuv', cwd=cwd)
-            # we are fixed to using libuv 1.9.0 - this is the commit hash for that (https://github.com/libuv/libuv/commit/229b3a4cc150aebd6561e6bd43076eafa7a03756)
-            RoverShellCall('git checkout %s'%('229b3a4cc150aebd6561e6bd43076eafa7a03756'), cwd=path.join(cwd, 'libuv'))   
+            fetch_jobs.append((component, cwd, commit_hashes[component].strip()))
 
-        else:
-            RoverPrint(RoverMods.Yellow(('DEVMODE IS ON. Skipping all git calls : I.e. you must manually control git your self.')))
+        if not fetch_jobs:
+            return
+
+        if RoverSettings.MirrorDirectory and not path.exists(RoverSettings.MirrorDirectory):
+            try:
+                makedirs(RoverSettings.MirrorDirectory)
+            except OSError: # another fetch got there first (see -pipeline)
+                if not path.isdir(RoverSettings.MirrorDirectory):
+                    raise
+
+        # the fetches are network bound, so a thread each will do.
+        pool = multiprocessing.pool.ThreadPool(len(fetch_jobs))
+        try:
+            results = pool.map_async(FetchRepository, fetch_jobs, chunksize=1).get(60 * 60 * 24)
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        for component, failed_cmd, failed_cwd in results:
+            if failed_cmd:
+                RoverFailWithRepro(failed_cmd, failed_cwd)
 
     except:
         RoverSettings._DevMode = True
         UnexpectedRoverException(sys.exc_info())
 
 
+# the order here is the order that we report in.
+RoverComponents = ['coreclr', 'corefx', 'core-setup', 'libuv']
+
+def RoverComponentPrefix(component):
+    colors = {
+        'coreclr'       : RoverMods.Red,
+        'corefx'        : RoverMods.Blue,
+        'core-setup'    : RoverMods.Green,
+        'libuv'         : RoverMods.Yellow
+    }
+
+    return colors.get(component, RoverMods.White)('[%s]'%(component))
+
+# the rough relative cost of each build, used to split the CPU budget when they run at the same time.
+RoverComponentWeights = {
+    'coreclr'       : 4,
+    'corefx'        : 2,
+    'core-setup'    : 1,
+    'libuv'         : 1
+}
+
+# the rough peak memory (KB) of each build per job, until we have seen it build (see RoverSettings.Costs)
+RoverComponentMemory = {
+    'coreclr'       : 1024 * 1024,
+    'corefx'        : 512 * 1024,
+    'core-setup'    : 256 * 1024,
+    'libuv'         : 128 * 1024
+}
+
+# splits 'jobs' CPUs between the components; returns {component: jobs}. 
+# every build gets at least one CPU, even if that means we are a little over budget.
+def SplitJobs(components, jobs, concurrency):
+    if concurrency < len(components):
+        # we can't know which builds will overlap, so everyone gets an even share.
+        return dict((component, max(1, jobs / concurrency)) for component in components)
+
+    total_weight = sum(RoverComponentWeights.get(component, 1) for component in components)
+
+    return dict((component, max(1, int(round(float(jobs) * RoverComponentWeights.get(component, 1) / total_weight)))) for component in components)
+
+# returns the (command, working directory) steps that build a single component with 'jobs' CPUs.
+def ComponentBuildSteps(component, git_directory, jobs):
+    # Build CoreCLR
+    # skipping non-essential for bootstrapping.
+    if component == 'coreclr':
+        return [('./build.sh x64 release skiptests skipnuget numproc %d'%(jobs), git_directory)]
+
+    # Build CoreFX Native Pieces
+    if component == 'corefx':
+        # at different points in the history of CoreFX there have been differing build behaviors, these conditionals
+        # cover that. However, if we find these differences, we will need to adapt.s
+        if git_directory and path.exists(path.join(git_directory, 'src', 'Native', 'build-native.sh')):
+            return [('./build-native.sh x64 release Linux --numProc %d'%(jobs), "%s/src/Native"%(git_directory))]
+
+        return [('./build.sh native x64 release', git_directory)]
+
+    # Build corehost from core-setup
+    # TODO: Pull versions from the runtimes.
+    # corehost's build.sh runs a plain 'make', which picks its parallelism up from MAKEFLAGS (see RoverBuildWorker)
+    if component == 'core-setup':
+        return [('./build.sh --arch x64 --rid %s --hostver 0.0.0 --fxrver 0.0.0 --policyver 0.0.0 --commithash %s'%(RoverSettings._Rid, RoverSettings.DotNetCommitHash), "%s/src/corehost"%(git_directory))]
+
+    # Build libUV
+    if component == 'libuv':
+        return [('./autogen.sh',     git_directory),
+                ('./configure',      git_directory),
+                ('make -j %d'%(jobs), git_directory)]
+
+    return []
+
+# the native outputs of each component that PatchTarget copies; (bin directory, [globs relative to that directory])
+def ComponentOutputs(component):
+    outputs = {
+        'coreclr'       : (RoverSettings.CoreCLRBinDirectory,      ['*so', 'corerun', 'crossgen']),
+        'corefx'        : (RoverSettings.CoreFXBinDirectory,       ['System.*']),
+        'core-setup'    : (RoverSettings.CoreSetupBinDirectory,    ['exe/dotnet', 'dll/libhostpolicy.so', 'fxr/libhostfxr.so']),
+        'libuv'         : (RoverSettings.LibUVBinDirectory,        ['libuv.so'])
+    }
+
+    return outputs[component]
+
+# returns the output files of a component, relative to its bin directory.
+def ComponentOutputFiles(component):
+    bin_directory, patterns = ComponentOutputs(component)
+
+    files = []
+    for pattern in patterns:
+        files.extend(sorted(path.relpath(match, bin_directory) for match in glob.glob(path.join(bin_directory, pattern)) if path.isfile(match)))
+
+    return files
+
+# A content addressed cache of the component outputs, so that we don't rebuild a commit we have already built.
+# Entries live in <cache>/<component>/<key>/ and are keyed by (component, commit hash, RID, build flags). The
+# modification time of an entry is its 'last used' time; the least recently used entries are evicted once the 
+# cache grows past its size limit.
+class RoverArtifactCache:
+    MetadataFilename = 'rover.cache.json'
+
+    def Key(self, component, commit_hash, build_flags):
+        key_data = json.dumps([component, commit_hash.strip(), RoverSettings._Rid, build_flags])
+
+        return hashlib.sha1(key_data).hexdigest()
+
+    def EntryPath(self, component, key):
+        return path.join(self.CacheDirectory, component, key)
+
+    # copies a cached entry in to the bin directory of the component; returns False on a cache miss.
+    def Restore(self, component, key):
+        entry_path = self.EntryPath(component, key)
+
+        try:
+            with open(path.join(entry_path, self.MetadataFilename)) as metadata_file:
+                metadata = json.load(metadata_file)
+        except (IOError, ValueError):
+            return False
+
+        bin_directory, patterns = ComponentOutputs(component)
+
+        for relative_path in metadata['files']:
+            destination = path.join(bin_directory, relative_path)
+
+            if not path.exists(path.dirname(destination)):
+                makedirs(path.dirname(destination))
+
+            shutil.copy2(path.join(entry_path, relative_path), destination)
+
+        os.utime(entry_path, None) # mark it as recently used.
+        return True
+
+    # copies the freshly built outputs of a component in to the cache.
+    def Store(self, component, key, commit_hash, build_flags):
+        bin_directory, patterns = ComponentOutputs(component)
+        files = ComponentOutputFiles(component)
+
+        if not files: # nothing worth remembering.
+            return False
+
+        component_directory = path.join(self.CacheDirectory, component)
+        if not path.exists(component_directory):
+            makedirs(component_directory)
+
+        # stage the entry next to its final location, then rename it in to place - so that a reader never sees half an entry.
+        staging_path = tempfile.mkdtemp(prefix='.staging-', dir=component_directory)
+        size = 0
+
+        for relative_path in files:
+            destination = path.join(staging_path, relative_path)
+
+            if not path.exists(path.dirname(destination)):
+                makedirs(path.dirname(destination))
+
+            shutil.copy2(path.join(bin_directory, relative_path), destination)
+            size += path.getsize(destination)
+
+        with open(path.join(staging_path, self.MetadataFilename), 'w') as metadata_file:
+            json.dump({ 'component' : component,
+                        'commit' : commit_hash.strip(),
+                        'rid' : RoverSettings._Rid,
+                        'flags' : build_flags,
+                        'files' : files,
+                        'size' : size }, metadata_file, indent=4)
+
+        try:
+            os.rename(staging_path, self.EntryPath(component, key))
+        except OSError: # somebody else stored the same entry first.
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+        self.Evict()
+        return True
+
+    # removes the least recently used entries until the cache fits in its size limit.
+    def Evict(self):
+        entries = []
+
+        for component in os.listdir(self.CacheDirectory):
+            component_directory = path.join(self.CacheDirectory, component)
+            if not path.isdir(component_directory):
+                continue
+
+            for key in os.listdir(component_directory):
+                entry_path = path.join(component_directory, key)
+
+                try:
+                    with open(path.join(entry_path, self.MetadataFilename)) as metadata_file:
+                        size = json.load(metadata_file)['size']
+
+                    entries.append((os.stat(entry_path).st_mtime, size, entry_path))
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+
+        entries.sort()
+        total_size = sum(size for last_used, size, entry_path in entries)
+
+        for last_used, size, entry_path in entries:
+            if total_size <= self.MaxSize:
+                break
+
+            RoverPrint(RoverMods.Yellow('is evicting %s from the build cache'%(path.relpath(entry_path, self.CacheDirectory))))
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
+
+    def __init__(self, cache_directory, max_size):
+        self.CacheDirectory = cache_directory
+        self.MaxSize = max_size
+
+        if not path.exists(self.CacheDirectory):
+            makedirs(self.CacheDirectory)
+
+# the build flags of a component are its build command lines - minus the parallelism, which doesn't change the outputs.
+# the cache asks for them (with no git_directory) before the component is fetched: where the command lines depend on the
+# checkout (corefx's build script moved), the commit, which is in the key too, decides them.
+def ComponentBuildFlags(component, git_directory = None):
+    return ' && '.join(cmd for cmd, cwd in ComponentBuildSteps(component, git_directory, 1))
+
+# the compilers that -ccache wraps. The builds look them up by name on the PATH (coreclr's gen-buildsys-clang.sh looks for clang-3.x,
+# libuv's configure for cc or gcc), so a directory of links to ccache named after them, ahead of the rest of the PATH, catches them all;
+# ccache (in 'masquerade' mode) then runs the compiler of the same name that comes after it on the PATH.
+CompilerNames = re.compile(r'^(cc|c\+\+|gcc|g\+\+|clang|clang\+\+)(-[0-9.]+)?$')
+
+# links every compiler on the PATH to ccache, in links_directory; returns the directory, or '' when there is no ccache to link to.
+def MakeCompilerCacheLinks(links_directory):
+    ccache = find_executable('ccache')
+
+    if not ccache:
+        RoverPrint(RoverMods.Yellow('could not find ccache, so the builds will not be cached (-ccache)'))
+        return ''
+
+    # the builds run in their own checkouts, so a relative directory on their PATH (or in CC) wouldn't resolve.
+    links_directory = path.abspath(links_directory)
+
+    if not path.exists(links_directory):
+        makedirs(links_directory)
+
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        if not path.isdir(directory) or path.realpath(directory) == path.realpath(links_directory):
+            continue
+
+        for name in os.listdir(directory):
+            link = path.join(links_directory, name)
+
+            if CompilerNames.match(name) and not path.lexists(link) and os.access(path.join(directory, name), os.X_OK):
+                os.symlink(ccache, link)
+
+    return links_directory
+
+# puts ccache in front of the compilers of a component build. Each component has a cache of its own (<-ccache>/<component>), which
+# keeps the hit rate of one build apart from the others that run beside it.
+def CompilerCacheEnvironment(component, env):
+    env['PATH'] = RoverSettings.CompilerCacheLinks + os.pathsep + env.get('PATH', '')
+    env['CCACHE_DIR'] = path.join(RoverSettings.CompilerCacheDirectory, component)
+    env['CCACHE_BASEDIR'] = path.abspath(RoverSettings._srcDirectory) # paths below src are hashed relative to it, so another -to still hits (it has to be absolute).
+    env['CCACHE_CPP2'] = 'yes' # clang warns about the preprocessed source otherwise, which fails the -Werror builds.
+
+    # an explicit CC=/usr/bin/clang-3.5 would go around the links.
+    for variable in ['CC', 'CXX']:
+        link = path.join(RoverSettings.CompilerCacheLinks, path.basename(env.get(variable, '')))
+
+        if env.get(variable) and path.lexists(link):
+            env[variable] = link
+
+    return env
+
+# returns the (hits, misses) of a ccache directory so far, or None if ccache can't tell us.
+def CompilerCacheStats(cache_directory):
+    env = dict(os.environ)
+    env['CCACHE_DIR'] = cache_directory
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            # ccache 4 has a machine readable form of its statistics,
+            try:
+                stats = dict(line.split('\t', 1) for line in check_output(['ccache', '--print-stats'], env=env, stderr=devnull).splitlines() if '\t' in line)
+                return (int(stats.get('direct_cache_hit', 0)) + int(stats.get('preprocessed_cache_hit', 0)), int(stats.get('cache_miss', 0)))
+            except CalledProcessError:
+                pass
+
+            # ccache 3 only has the one for humans.
+            output = check_output(['ccache', '-s'], env=env, stderr=devnull)
+    except (CalledProcessError, OSError, ValueError):
+        return None
+
+    hits = sum(int(count) for count in re.findall(r'^cache hit \((?:direct|preprocessed)\)\s+(\d+)', output, re.MULTILINE))
+    misses = sum(int(count) for count in re.findall(r'^cache miss\s+(\d+)', output, re.MULTILINE))
+
+    return (hits, misses)
+
+# the workers leave Ctrl+C to the parent, which tears the pool down.
+def RoverBuildWorkerInit():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # we may have been forked while another thread held it (see -pipeline)
+    RoverTrace._Lock = threading.Lock()
+
+# runs every step of a single component build inside of a pool worker.
+# returns (component, elapsed seconds, failed command, failed working directory, trace events, peak memory) - the failure pair is None on success.
+# the trace events are the spans of the build, which the parent merges in to its own trace. The peak memory (KB) is that of the worker and
+# everything that the build ran, at once.
+def RoverBuildWorker(build_job):
+    component, steps, jobs = build_job
+
+    # the worker starts out with a copy of the parent's trace, and may have run other builds since.
+    RoverTrace.Events = []
+
+    start = time.time()
+    failed_cmd, failed_cwd = None, None
+    peak_memory = 0
+    current_step = steps[0] if steps else ('true', os.getcwd())
+
+    # whatever goes wrong, the build has to come back with a result: python 2 has no error_callback, so it is the result
+    # that releases its admission ticket (see RunBuildJobs).
+    try:
+        # every sub-build gets its share of the CPU budget.
+        env = dict(os.environ)
+        env['MAKEFLAGS'] = '-j%d'%(jobs)
+
+        if RoverSettings.CompilerCacheLinks:
+            CompilerCacheEnvironment(component, env)
+            ccache_before = CompilerCacheStats(env['CCACHE_DIR'])
+
+        with RoverSpan(component, 'build', jobs=jobs) as span, RoverMemorySampler() as memory:
+            for cmd, cwd in steps:
+                current_step = (cmd, cwd)
+
+                if RoverPrefixedShellCall(cmd, cwd, RoverComponentPrefix(component), env) != 0:
+                    failed_cmd, failed_cwd = cmd, cwd
+                    span.Args['failed'] = cmd
+                    break
+
+            if RoverSettings.CompilerCacheLinks:
+                ccache_after = CompilerCacheStats(env['CCACHE_DIR'])
+
+                if ccache_before and ccache_after:
+                    hits, misses = ccache_after[0] - ccache_before[0], ccache_after[1] - ccache_before[1]
+                    span.Args.update({ 'ccache_hits' : hits, 'ccache_misses' : misses })
+
+                    RoverPrint('%s %s'%(RoverComponentPrefix(component), RoverMods.White('ccache: %d hits, %d misses (%d%% hit rate)'%(hits, misses, round(100.0 * hits / (hits + misses)) if hits + misses else 0))))
+
+            span.Args['peak_tree_rss_kb'] = memory.Peak
+
+        peak_memory = memory.Peak
+    except Exception as build_error:
+        RoverPrint('%s %s'%(RoverComponentPrefix(component), RoverMods.Red('%s: %s'%(type(build_error).__name__, build_error))))
+        failed_cmd, failed_cwd = current_step
+
+    return (component, time.time() - start, failed_cmd, failed_cwd, RoverTrace.Events, peak_memory)
+
+# the memory (KB) that a component build with 'jobs' CPUs is expected to take at its peak.
+def EstimateBuildMemory(component, jobs):
+    return RoverSettings.Costs.Estimate(component, RoverComponentMemory.get(component, 256 * 1024)) * jobs
+
+# schedules the component builds on a process pool, splitting RoverSettings.Jobs between them. A build only starts once its
+# memory fits in what the running builds leave of RoverSettings.Admission, so that a big host runs them all side by side and a small
+# one runs them one after the other rather than in to the OOM killer.
+# every build is sized when it is let in: it gets its share of the jobs, plus the CPUs that neither the running builds hold nor the
+# builds behind it that fit right away need - as much of them as the memory left over allows. So builds that the memory budget
+# serializes each get the whole machine, rather than the share they would have had side by side.
+# jobs is {component: its share of the jobs}, when the share was worked out in advance (see -pipeline); those builds start whenever
+# their sources are in, so we can't tell what is yet to come, and they keep their shares.
+def RunBuildJobs(components, git_directories, jobs = None):
+    concurrency = max(1, min(len(components), RoverSettings.Jobs))
+    fixed_jobs = bool(jobs)
+    shares = jobs or SplitJobs(components, RoverSettings.Jobs, concurrency)
+
+    admission = RoverSettings.Admission
+    tickets = []
+    jobs = {}
+
+    pool = multiprocessing.Pool(concurrency, RoverBuildWorkerInit)
+    try:
+        pending = []
+
+        # the callback only comes for a build that returned; one that raised anyway is ready all the same, so a build that is
+        # waiting to be let in also releases the tickets of the builds that are done.
+        def reap():
+            for result, ticket in zip(pending, tickets):
+                if result.ready():
+                    admission.Release(ticket)
+
+        for index, component in enumerate(components):
+            memory = EstimateBuildMemory(component, shares[component])
+
+            def waiting(component = component, memory = memory):
+                RoverPrint('%s %s'%(RoverComponentPrefix(component), RoverMods.Yellow('is waiting for memory (it needs %.1f GB, %.1f GB are free)'%(memory / 1024.0 ** 2, admission.Free() / 1024.0 ** 2))))
+
+            def claim(component = component, memory = memory, later = components[index + 1:]):
+                share = shares[component]
+                if fixed_jobs:
+                    jobs[component] = share
+                    return (memory, share)
+
+                free_memory = admission.Free()
+                spare_cpus = RoverSettings.Jobs - admission.CPUsInUse()
+
+                # the builds behind this one that would be let in along with it keep what they need.
+                for later_component in later:
+                    later_memory = EstimateBuildMemory(later_component, shares[later_component])
+                    if free_memory is not None and memory + later_memory > free_memory:
+                        break
+
+                    if free_memory is not None:
+                        free_memory -= later_memory
+                    spare_cpus -= shares[later_component]
+
+                if free_memory is not None:
+                    spare_cpus = min(spare_cpus, free_memory / max(1, EstimateBuildMemory(component, 1)))
+
+                jobs[component] = max(share, spare_cpus)
+                return (EstimateBuildMemory(component, jobs[component]), jobs[component])
+
+            ticket = admission.Admit(memory, on_wait=waiting, poll=reap, claim=claim)
+            tickets.append(ticket)
+
+            RoverPrint('    %s %s'%(RoverComponentPrefix(component), RoverMods.White('%d jobs'%(jobs[component]))))
+            build_job = (component, ComponentBuildSteps(component, git_directories[component], jobs[component]), jobs[component])
+
+            # the ticket is released as soon as the build is done, which lets the next one in.
+            pending.append(pool.apply_async(RoverBuildWorker, (build_job,), callback=lambda result, ticket = ticket: admission.Release(ticket)))
+
+        # a timeout on get() keeps the parent responsive to Ctrl+C (a bare get() swallows it in python 2)
+        results = [result.get(60 * 60 * 24 * 7) for result in pending]
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        for ticket in tickets:
+            admission.Release(ticket)
+
+        pool.join()
+
+    for result in results:
+        RoverTrace.Events.extend(result[4])
+
+    # what the builds took is what we expect of them next time.
+    for component, elapsed, failed_cmd, failed_cwd, events, peak_memory in results:
+        if not failed_cmd and peak_memory:
+            RoverSettings.Costs.Learn(component, peak_memory / jobs[component])
+
+    try:
+        RoverSettings.Costs.Save()
+    except (IOError, OSError):
+        pass
+
+    return results
+
+def ReportBuildTimes(results, wall_time):
+    RoverPrint(RoverMods.Blue('build times:'))
+
+    for component, elapsed, failed_cmd, failed_cwd, events, peak_memory in results:
+        status = RoverMods.Green('%-6s'%('ok')) if not failed_cmd else RoverMods.Red('failed')
+        RoverPrint('    %10.1fs  %s %s'%(elapsed, status, RoverComponentPrefix(component)))
+
+    RoverPrint('    %10.1fs  %s'%(wall_time, RoverMods.White('wall time')))
+
+# A fingerprint of a component's source tree: its git HEAD, plus the status of every dirty file (and its size and mtime, 
+# so that editing an already modified file changes the fingerprint too). None when we can't ask git.
+def SourceFingerprint(git_directory):
+    # not a checkout of its own (e.g. restored from the build cache); git would answer for the repository around it.
+    if not path.exists(path.join(git_directory, '.git')):
+        return None
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            head = check_output(['git', 'rev-parse', 'HEAD'], cwd=git_directory, stderr=devnull)
+            status = check_output(['git', 'status', '--porcelain', '--untracked-files=all'], cwd=git_directory, stderr=devnull)
+    except (CalledProcessError, OSError):
+        return None
+
+    fingerprint = hashlib.sha1(head + status)
+
+    for line in status.splitlines():
+        # 'XY path' or 'XY from -> to'
+        file_path = line[3:].split(' -> ')[-1].strip('"')
+
+        try:
+            file_stat = os.stat(path.join(git_directory, file_path))
+            fingerprint.update('%s %d %r\n'%(file_path, file_stat.st_size, file_stat.st_mtime))
+        except OSError: # deleted
+            pass
+
+    return fingerprint.hexdigest()
+
+# the fingerprints of the sources that the outputs in this working directory were last built from; {component: fingerprint}
+def FingerprintsPath():
+    return path.join(RoverSettings._objDirectory, 'rover.fingerprints.json')
+
+def LoadFingerprints():
+    try:
+        with open(FingerprintsPath()) as fingerprints_file:
+            return json.load(fingerprints_file)
+    except (IOError, ValueError):
+        return {}
+
+FingerprintsLock = threading.Lock()
+
+# merges fingerprints in to those on disk (the components may be built one by one, on threads of their own - see -pipeline)
+def SaveFingerprints(fingerprints):
+    with FingerprintsLock:
+        saved = LoadFingerprints()
+        saved.update(fingerprints)
+
+        with open(FingerprintsPath(), 'w') as fingerprints_file:
+            json.dump(saved, fingerprints_file, indent=4)
 
 def BuildNativeComponents(  coreclr_git_directory,
                             corefx_git_directory,
@@ -379,80 +2337,660 @@ def BuildNativeComponents(  coreclr_git_directory,
     try:
         RoverPrint(RoverMods.Blue('is building the .NET GitHub repositories.'))
 
-        # Build CoreCLR
-        # skipping non-essential for bootstrapping.
-        if 'coreclr' in RoverSettings.BuildSet:
-            RoverShellCall('./build.sh x64 release skiptests skipnuget', cwd=coreclr_git_directory)
-
-        # Build CoreFX Native Pieces
-        if 'corefx' in RoverSettings.BuildSet:
-            # at different points in the history of CoreFX there have been differing build behaviors, these conditionals
-            # cover that. However, if we find these differences, we will need to adapt.s
-            if path.exists(path.join(corefx_git_directory, 'src', 'Native', 'build-native.sh')):
-                RoverShellCall('./build-native.sh x64 release Linux --numProc 1', cwd="%s/src/Native"%(corefx_git_directory))
-            else:
-                RoverShellCall('./build.sh native x64 release', cwd=corefx_git_directory) 
+        git_directories = {
+            'coreclr'       : coreclr_git_directory,
+            'corefx'        : corefx_git_directory,
+            'core-setup'    : core_setup_git_directory,
+            'libuv'         : libuv_git_directory
+        }
+
+        # the components do not depend on each other until PatchTarget, so we build them all at once.
+        BuildComponents([component for component in RoverComponents if component in RoverSettings.BuildSet], git_directories)
+
+    except:
+        RoverSettings._DevMode = True
+        UnexpectedRoverException(sys.exc_info())
+
+# builds the components (unless they can be restored from the cache, or are unchanged in DevMode); git_directories is {component: directory}
+def BuildComponents(components, git_directories, jobs = None):
+    try:
+        components = [component for component in components if component not in RoverSettings.RestoredComponents]
+        fingerprints = LoadFingerprints()
+
+        # in DevMode, a component whose sources haven't changed since we last built it (and whose outputs are still around) 
+        # needs no building; PatchTarget skips the outputs that are already in place. Neither does one that an earlier run
+        # restored from the cache without its sources.
+        if RoverSettings._DevMode:
+            for component in list(components):
+                fingerprint = SourceFingerprint(git_directories[component])
+
+                if not path.exists(path.join(git_directories[component], '.git')) and str(fingerprints.get(component)).startswith('cache:') and ComponentOutputFiles(component):
+                    RoverPrint('%s %s'%(RoverComponentPrefix(component), RoverMods.Green('was restored from the build cache without its sources, skipping it.')))
+                    components.remove(component)
+
+                elif fingerprint and fingerprints.get(component) == fingerprint and ComponentOutputFiles(component):
+                    RoverPrint('%s %s'%(RoverComponentPrefix(component), RoverMods.Green('is unchanged since it was last built, skipping it.')))
+                    components.remove(component)
+
+        # in DevMode the sources are the developer's to change, so the commit hash no longer identifies the outputs.
+        cache = None
+        if RoverSettings.UseCache and not RoverSettings._DevMode:
+            cache = RoverArtifactCache(RoverSettings.CacheDirectory, RoverSettings.CacheSize)
+
+        cache_keys = {}
+        if cache:
+            for component in list(components):
+                cache_keys[component] = cache.Key(component, RoverSettings.CommitHashes.get(component, ''), ComponentBuildFlags(component))
+
+                if cache.Restore(component, cache_keys[component]):
+                    RoverPrint('%s %s'%(RoverComponentPrefix(component), RoverMods.Green('was restored from the build cache (%s)'%(cache_keys[component][:12]))))
+                    components.remove(component)
+                    SaveFingerprints({component: SourceFingerprint(git_directories[component])})
 
-        # Build corehost from core-setup
-        # TODO: Pull versions from the runtimes.
-        if 'core-setup' in RoverSettings.BuildSet:
-            RoverShellCall('./build.sh --arch x64 --rid %s --hostver 0.0.0 --fxrver 0.0.0 --policyver 0.0.0 --commithash %s'%(RoverSettings._Rid, RoverSettings.DotNetCommitHash), cwd="%s/src/corehost"%(core_setup_git_directory))
+        if not components:
+            return
 
-        # Build libUV
-        if 'libuv' in RoverSettings.BuildSet:
-            RoverShellCall('./autogen.sh',     cwd=libuv_git_directory)
-            RoverShellCall('./configure',      cwd=libuv_git_directory)
-            RoverShellCall('make',             cwd=libuv_git_directory)
+        RoverPrint(RoverMods.Blue('is running %d builds with a budget of %d jobs.'%(len(components), RoverSettings.Jobs)))
+
+        start = time.time()
+        results = RunBuildJobs(components, git_directories, jobs)
+        ReportBuildTimes(results, time.time() - start)
+
+        # the fingerprint is taken after the build, in case the build itself touches tracked files.
+        SaveFingerprints(dict((component, SourceFingerprint(git_directories[component])) for component, elapsed, failed_cmd, failed_cwd, events, peak_memory in results if not failed_cmd))
+
+        for component, elapsed, failed_cmd, failed_cwd, events, peak_memory in results:
+            if failed_cmd:
+                RoverFailWithRepro(failed_cmd, failed_cwd)
+
+        if cache:
+            for component in components:
+                cache.Store(component, cache_keys[component], RoverSettings.CommitHashes.get(component, ''), ComponentBuildFlags(component))
 
     except:
         RoverSettings._DevMode = True
         UnexpectedRoverException(sys.exc_info())
 
 
+# the ioctl that asks the filesystem (btrfs, xfs, ...) to clone a file's extents rather than copy them; linux/fs.h
+FICLONE = 0x40049409
+
+# the hash that tells patched files apart (IsSameFile, the install manifests): blake2b where hashlib has it, sha1 otherwise - both are
+# quicker than sha256, and we only need to notice a change, not to stand up to an attacker.
+FastHashName = 'blake2b' if 'blake2b' in getattr(hashlib, 'algorithms_available', []) else 'sha1'
+
+def HashFileContents(file_path, hash_name = None):
+    return HashFile(file_path, hashlib.new(hash_name or FastHashName)).hexdigest()
+
+# A file that PatchTarget places at one or more destinations (every version of every tree, with -patch-trees). However many destinations
+# it has, it is stat'ed, hashed and (when it has to be copied) read only once; its contents are let go of once the last of them is done.
+class RoverPatchSource:
+    def Hash(self):
+        with self._lock:
+            if self._hash is None:
+                self._hash = HashFileContents(self.Path)
+
+            return self._hash
+
+    def Contents(self):
+        with self._lock:
+            if self._contents is None:
+                with open(self.Path, 'rb') as source_file:
+                    self._contents = source_file.read()
+
+            return self._contents
+
+    def Done(self):
+        with self._lock:
+            self._remaining -= 1
+
+            if self._remaining <= 0:
+                self._contents = None
+
+    def __init__(self, source_path, destinations = 1):
+        self.Path = source_path
+        self.Stat = os.stat(source_path)
+        self._lock = threading.Lock()
+        self._hash = None
+        self._contents = None
+        self._remaining = destinations
+
+# a destination that is the source (a hardlink), or has the same size and contents, needs no copying.
+def IsSameFile(source, destination, patch_source = None):
+    try:
+        patch_source = patch_source or RoverPatchSource(source)
+        destination_stat = os.stat(destination)
+    except OSError:
+        return False
+
+    if (patch_source.Stat.st_dev, patch_source.Stat.st_ino) == (destination_stat.st_dev, destination_stat.st_ino):
+        return True
+
+    if patch_source.Stat.st_size != destination_stat.st_size:
+        return False
+
+    return patch_source.Hash() == HashFileContents(destination)
+
+# places 'source' at 'temporary' with the cheapest method that the filesystem (and PatchLinkMode) allows; returns the method used.
+def PlaceFile(source, temporary, patch_source = None):
+    if RoverSettings.PatchLinkMode == 'hardlink':
+        try:
+            os.link(source, temporary)
+            return 'hardlink'
+        except OSError: # e.g. a different filesystem
+            pass
+
+    if RoverSettings.PatchLinkMode in ['reflink', 'hardlink']:
+        try:
+            with open(source, 'rb') as source_file:
+                with open(temporary, 'wb') as temporary_file:
+                    fcntl.ioctl(temporary_file.fileno(), FICLONE, source_file.fileno())
+
+            shutil.copymode(source, temporary)
+            return 'reflink'
+        except (IOError, OSError): # the filesystem can't clone.
+            pass
+
+    # the contents are read once for all of the destinations of the source.
+    with open(temporary, 'wb') as temporary_file:
+        temporary_file.write((patch_source or RoverPatchSource(source)).Contents())
+
+    shutil.copymode(source, temporary)
+    return 'copy'
+
+# copies a single manifest entry; runs on a thread of the pool in PatchTarget.
+# returns (component, destination, method or None, error or None)
+def PatchFile(manifest_entry, patch_source = None):
+    component, source, destination = manifest_entry[:3]
+
+    try:
+        patch_source = patch_source or RoverPatchSource(source)
+
+        if IsSameFile(source, destination, patch_source):
+            return (component, destination, None, None)
+
+        # we write next to the destination and rename over it, so that we can replace a binary that is running ('Text file busy')
+        temporary = destination + '.rover-patch'
+        if path.lexists(temporary):
+            os.remove(temporary)
+
+        method = PlaceFile(source, temporary, patch_source)
+        os.rename(temporary, destination)
+
+        return (component, destination, method, None)
+    except (IOError, OSError) as copy_error:
+        return (component, destination, None, str(copy_error))
+
+# the folders of an install tree that the patch rules write to: {'root': [the tree], 'shared': [...], 'sdk': [...], 'host': [...]} - every
+# version of the shared framework, the sdk and the host, rather than only the greatest of them (as PatchTarget_Shared and co. are).
+def InstallTreeDestinations(tree):
+    index = RoverVersionIndex(tree)
+
+    destinations = dict((kind, index.Folders(kind)) for kind in RoverVersionIndex.Kinds)
+    destinations['root'] = [tree]
+
+    return destinations
+
+# the complete list of (component, source file, destination file, rule) that PatchTarget copies - or only those of some components.
+# rule is the index of the rule that the entry comes from; when two rules write the same file, the later one wins.
+# trees are more install trees to patch, every version in each of them (see -patch-trees)
+def PatchManifest(patchTarget_folder,
+                  coreclr_bin_directory,
+                  corefx_native_bin_directory,
+                  core_setup_cli_bin_directory,
+                  libuv_bin_directory,
+                  components = None,
+                  trees = []):
+    # the folders that the rules write to: the versions of the target that we bootstrap, and every version of the other trees.
+    destinations = {
+        'root'      : [patchTarget_folder],
+        'shared'    : [RoverSettings.PatchTarget_Shared],
+        'sdk'       : [RoverSettings.PatchTarget_SDK],
+        'host'      : [RoverSettings.PatchTarget_Host]
+    }
+
+    for tree in trees:
+        for kind, folders in InstallTreeDestinations(tree).items():
+            destinations[kind].extend(folders)
+
+    # (component, source directory, source glob, destinations)
+    patch_rules = [
+        # replace native dotnet in the base directory
+        # from core_setup
+        ('core-setup',  path.join(core_setup_cli_bin_directory, 'exe'), 'dotnet',               'root'),
+
+        # replace native files in 'shared' folder.
+        # from coreclr
+        ('coreclr',     coreclr_bin_directory,                          '*so',                  'shared'),
+        ('coreclr',     coreclr_bin_directory,                          'corerun',              'shared'),
+        ('coreclr',     coreclr_bin_directory,                          'crossgen',             'shared'),
+
+        # from core_setup
+        ('core-setup',  path.join(core_setup_cli_bin_directory, 'exe'), 'dotnet',               'shared'),
+        ('core-setup',  path.join(core_setup_cli_bin_directory, 'dll'), 'libhostpolicy.so',     'shared'),
+        ('core-setup',  path.join(core_setup_cli_bin_directory, 'fxr'), 'libhostfxr.so',        'shared'),
+
+        # from corefx
+        ('corefx',      corefx_native_bin_directory,                    'System.*',             'shared'),
+
+        # from libuv
+        ('libuv',       libuv_bin_directory,                            'libuv.so',             'shared'),
+
+        # replace native files in 'sdk' folder.
+        # from core_setup
+        ('core-setup',  path.join(core_setup_cli_bin_directory, 'dll'), 'libhostpolicy.so',     'sdk'),
+        ('core-setup',  path.join(core_setup_cli_bin_directory, 'fxr'), 'libhostfxr.so',        'sdk'),
+
+        # replace native files in 'host' folder.
+        # from core_setup
+        ('core-setup',  path.join(core_setup_cli_bin_directory, 'fxr'), 'libhostfxr.so',        'host')
+    ]
+
+    manifest = []
+    for rule, (component, source_directory, pattern, kind) in enumerate(patch_rules):
+        if components is not None and component not in components:
+            continue
+
+        sources = sorted(match for match in glob.glob(path.join(source_directory, pattern)) if path.isfile(match))
+
+        if not sources: # just like the 'cp' that this replaces, a missing output is an error.
+            raise IOError('%s has nothing matching \'%s\' to patch in to %s'%(component, path.join(source_directory, pattern), destinations[kind][0]))
+
+        manifest.extend((component, source, path.join(destination_folder, path.basename(source)), rule) for destination_folder in destinations[kind] for source in sources)
+
+    # when two rules write the same file the later one wins, as it did when the copies ran one after the other.
+    # (and the copies must not race each other for it)
+    last_writers = dict((destination, index) for index, (component, source, destination, rule) in enumerate(manifest))
+
+    return [entry for index, entry in enumerate(manifest) if last_writers[entry[2]] == index]
+
+# when the components are patched one by one, as their builds finish (see -pipeline), they can be patched in any order. The claims
+# keep the result the same as patching them in the order of the rules: a file is only patched by a rule that comes after the last 
+# one that patched it.
+class RoverPatchClaims:
+    def PatchFile(self, manifest_entry, patch_source = None):
+        component, source, destination, rule = manifest_entry
+
+        with self._lock:
+            destination_lock = self._destinationLocks.setdefault(destination, threading.Lock())
+
+        with destination_lock:
+            if self._claims.get(destination, -1) > rule:
+                return (component, destination, 'superseded', None)
+
+            self._claims[destination] = rule
+            return PatchFile(manifest_entry, patch_source)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._destinationLocks = {}
+        self._claims = {} # {destination: the rule that patched it}
+
+# patches the outputs of the components (all of them, unless components says otherwise) in to the target, and in to every version of
+# the trees of -patch-trees (RoverSettings.PatchTreePaths)
 def PatchTarget(patchTarget_folder,
                 coreclr_bin_directory,
                 corefx_native_bin_directory,
                 core_setup_cli_bin_directory,
-                libuv_bin_directory):
+                libuv_bin_directory,
+                components = None,
+                claims = None):
     try:
         if RoverSettings.Patch:
-            RoverPrint(RoverMods.Blue('is patching %s'%(RoverMods.Yellow(patchTarget_folder))))
-                                
-            # replace native dotnet in the base directory
-            # from core_setup
-            RoverShellCall('cp dotnet %s'%(path.join(patchTarget_folder)), cwd='%s/exe/'%(core_setup_cli_bin_directory))
-
-            # replace native files in 'shared' folder.
-            # from coreclr
-            RoverShellCall('cp *so %s'%(RoverSettings.PatchTarget_Shared),                               cwd=coreclr_bin_directory) 
-            RoverShellCall('cp corerun %s'%(RoverSettings.PatchTarget_Shared),                           cwd=coreclr_bin_directory)
-            RoverShellCall('cp crossgen %s'%(RoverSettings.PatchTarget_Shared),                          cwd=coreclr_bin_directory)
-
-            # from core_setup
-            RoverShellCall('cp dotnet %s'%(RoverSettings.PatchTarget_Shared),                            cwd='%s/exe/'%(core_setup_cli_bin_directory))
-            RoverShellCall('cp libhostpolicy.so %s'%(RoverSettings.PatchTarget_Shared),                  cwd='%s/dll/'%(core_setup_cli_bin_directory))
-            RoverShellCall('cp libhostfxr.so %s'%(RoverSettings.PatchTarget_Shared),                     cwd='%s/fxr/'%(core_setup_cli_bin_directory))
-
-            # from corefxcd 
-            RoverShellCall('cp System.* %s'%(RoverSettings.PatchTarget_Shared),                          cwd=corefx_native_bin_directory)
-
-            # from libuv
-            RoverShellCall('cp libuv.so %s'%(RoverSettings.PatchTarget_Shared),                          cwd=libuv_bin_directory)
-
-            # replace native files in 'sdk' folder.
-            # from core_setup
-            RoverShellCall('cp libhostpolicy.so %s'%(RoverSettings.PatchTarget_SDK),                     cwd='%s/dll/'%(core_setup_cli_bin_directory))
-            RoverShellCall('cp libhostfxr.so %s'%(RoverSettings.PatchTarget_SDK),                        cwd='%s/fxr/'%(core_setup_cli_bin_directory))
-
-            # replace native files in 'host' folder.
-            # from core_setup
-            RoverShellCall('cp libhostfxr.so %s'%(RoverSettings.PatchTarget_Host),                       cwd='%s/fxr/'%(core_setup_cli_bin_directory))
-
+            trees = RoverSettings.PatchTreePaths
+            RoverPrint(RoverMods.Blue('is patching %s'%(RoverMods.Yellow(patchTarget_folder))) + (' and %d more trees'%(len(trees)) if trees else '') + (' (%s)'%(', '.join(components)) if components else ''))
+
+            start = time.time()
+            manifest = PatchManifest(patchTarget_folder,
+                                     coreclr_bin_directory,
+                                     corefx_native_bin_directory,
+                                     core_setup_cli_bin_directory,
+                                     libuv_bin_directory,
+                                     components,
+                                     trees)
+
+            # a source has as many destinations as there are versions to patch; it is read once for all of them.
+            destination_counts = {}
+            for entry in manifest:
+                destination_counts[entry[1]] = destination_counts.get(entry[1], 0) + 1
+
+            sources = dict((source, RoverPatchSource(source, count)) for source, count in destination_counts.items())
+            patch_file = claims.PatchFile if claims else PatchFile
+
+            # returns the result of PatchFile, and the hash of what is now at the destination (for the install manifest)
+            def patch(manifest_entry):
+                patch_source = sources[manifest_entry[1]]
+
+                try:
+                    component, destination, method, error = patch_file(manifest_entry, patch_source)
+
+                    # the destination is a copy of its source, so they have the same hash; which is computed once for all of its copies.
+                    digest = patch_source.Hash() if method != 'superseded' and not error else None
+                    return (component, destination, method, error, digest)
+                finally:
+                    patch_source.Done()
+
+            pool = multiprocessing.pool.ThreadPool(min(16, len(manifest)))
+            try:
+                results = pool.map(patch, manifest)
+                pool.close()
+            finally:
+                pool.join()
+
+            methods = {}
+            for component, destination, method, error, digest in results:
+                if error:
+                    raise IOError('could not patch %s from %s: %s'%(destination, component, error))
+
+                methods[method or 'unchanged'] = methods.get(method or 'unchanged', 0) + 1
+
+            SaveInstallManifests([patchTarget_folder] + trees, [(entry[0], entry[2], entry[3], result[4]) for entry, result in zip(manifest, results) if result[4]])
+
+            RoverPrint(RoverMods.Blue('patched %d files in %.1fs (%s)'%(len(manifest), time.time() - start, ', '.join('%d %s'%(count, method) for method, count in sorted(methods.items())))))
             RoverPrint(RoverMods.Blue('has finished patching %s'%(RoverMods.Yellow(patchTarget_folder))))
     except:
         RoverSettings._DevMode = True
         UnexpectedRoverException(sys.exc_info())
 
+# Every tree that PatchTarget patches gets a manifest (<tree>/rover.manifest.json) of the files that it placed there: for each file (by
+# its path in the tree), the component and commit it was built from, its size, mtime and hash. -verify checks a tree against it, and
+# -diff uses it to tell two trees apart without reading them.
+InstallManifestFilename = 'rover.manifest.json'
+InstallManifestLock = threading.Lock()
+
+def LoadInstallManifest(tree):
+    try:
+        with open(path.join(tree, InstallManifestFilename)) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return None
+
+# adds what PatchTarget placed to the manifests of the trees; patched is [(component, destination, rule, hash)]
+# with -pipeline the components are patched (and recorded) in any order, so within a run the entry of the later rule wins, just as its file did.
+def SaveInstallManifests(trees, patched):
+    # a destination belongs to the innermost tree that it is in.
+    trees = sorted(set(path.abspath(tree) for tree in trees), key=len, reverse=True)
+    entries = dict((tree, []) for tree in trees)
+
+    for component, destination, rule, digest in patched:
+        for tree in trees:
+            if path.abspath(destination).startswith(tree + os.sep):
+                entries[tree].append((path.relpath(destination, tree), component, rule, digest, os.stat(destination)))
+                break
+
+    with InstallManifestLock:
+        for tree in trees:
+            if not entries[tree]:
+                continue
+
+            manifest = LoadInstallManifest(tree) or {}
+            files = manifest.get('files', {}) if manifest.get('hash') == FastHashName else {}
+
+            for relative_path, component, rule, digest, stat in entries[tree]:
+                previous = files.get(relative_path)
+                if previous and previous.get('patched') == RoverSettings.RunStarted and previous.get('rule', -1) > rule:
+                    continue
+
+                files[relative_path] = {
+                    'component' : component,
+                    'commit'    : RoverSettings.CommitHashes.get(component, ''),
+                    'size'      : stat.st_size,
+                    'mtime'     : stat.st_mtime,
+                    'hash'      : digest,
+                    'rule'      : rule,
+                    'patched'   : RoverSettings.RunStarted
+                }
+
+            manifest.update({ 'rid' : RoverSettings._Rid, 'hash' : FastHashName, 'files' : files })
+
+            # written aside and renamed over, so that a reader never finds half of it.
+            temporary_path = path.join(tree, InstallManifestFilename + '.tmp')
+            with open(temporary_path, 'w') as manifest_file:
+                json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+
+            os.rename(temporary_path, path.join(tree, InstallManifestFilename))
+
+# the hashes of files, worked out side by side; {file: hash, or None if it can't be read}
+def HashFiles(file_paths, hash_name):
+    def hash_file(file_path):
+        try:
+            return (file_path, HashFileContents(file_path, hash_name))
+        except (IOError, OSError, ValueError): # ValueError: a hash that this python doesn't have
+            return (file_path, None)
+
+    if not file_paths:
+        return {}
+
+    pool = multiprocessing.pool.ThreadPool(min(16, len(file_paths)))
+    try:
+        # a timeout on get() keeps us responsive to Ctrl+C (a bare get() swallows it in python 2)
+        hashes = dict(pool.map_async(hash_file, file_paths).get(60 * 60 * 24 * 7))
+        pool.close()
+    finally:
+        pool.join()
+
+    return hashes
+
+# checks that the files of a tree's manifest are still what was patched in. A file whose size and mtime are as recorded is taken to be
+# unchanged; only the others are hashed. Returns the number of files that are missing or changed (or 1 if there is no manifest).
+def VerifyInstallTree(tree):
+    start = time.time()
+    manifest = LoadInstallManifest(tree)
+
+    if not manifest:
+        RoverPrint(RoverMods.Red('has no manifest of %s (%s) - was it patched?'%(tree, InstallManifestFilename)))
+        return 1
+
+    missing, changed, suspects = [], [], []
+    for relative_path, entry in sorted(manifest['files'].items()):
+        try:
+            stat = os.stat(path.join(tree, relative_path))
+        except OSError:
+            missing.append(relative_path)
+            continue
+
+        if stat.st_size != entry['size']:
+            changed.append(relative_path)
+        elif stat.st_mtime != entry['mtime']:
+            suspects.append(relative_path)
+
+    # the same size, but touched since: only its hash can tell.
+    hashes = HashFiles([path.join(tree, relative_path) for relative_path in suspects], manifest['hash'])
+    changed = sorted(changed + [relative_path for relative_path in suspects if hashes[path.join(tree, relative_path)] != manifest['files'][relative_path]['hash']])
+
+    for relative_path in missing:
+        RoverPrint('%s %s'%(RoverMods.Red('missing'), relative_path))
+
+    for relative_path in changed:
+        entry = manifest['files'][relative_path]
+        RoverPrint('%s %s (patched from %s %s)'%(RoverMods.Red('changed'), relative_path, entry['component'], entry['commit'][:12]))
+
+    RoverPrint(RoverMods.Blue('verified %d files of %s in %.1fs (%d hashed): %d changed, %d missing'%(len(manifest['files']), RoverMods.Yellow(tree), time.time() - start, 
+                                                                                                       len(hashes), len(changed), len(missing))))
+    return len(changed) + len(missing)
+
+# every file in a tree (but its manifest): {path in the tree: stat}
+def InstallTreeFiles(tree):
+    files = {}
+
+    for root, directories, names in os.walk(tree):
+        for name in names:
+            file_path = path.join(root, name)
+
+            if not path.islink(file_path) and path.isfile(file_path):
+                files[path.relpath(file_path, tree)] = os.stat(file_path)
+
+    files.pop(InstallManifestFilename, None)
+    return files
+
+# prints how two trees differ: the files that only one of them has, and those that both have but are not the same. Files of the same size
+# are the same if they are one file (a hardlink), and are told apart by their recorded hashes if both have manifest entries that still
+# hold (size and mtime as recorded); the rest are hashed. An equal mtime on its own proves nothing: a tarball gives every file that it
+# extracts the mtime it was packed with, whatever was built in to it. Returns the number of differences.
+def DiffInstallTrees(tree_a, tree_b):
+    start = time.time()
+    files_a, files_b = InstallTreeFiles(tree_a), InstallTreeFiles(tree_b)
+    manifest_a, manifest_b = LoadInstallManifest(tree_a) or {}, LoadInstallManifest(tree_b) or {}
+
+    # the hash of a file as its manifest has it, if the file is still what the manifest says
+    def recorded_hash(manifest, relative_path, stat):
+        entry = manifest.get('files', {}).get(relative_path)
+
+        if entry and manifest.get('hash') == FastHashName and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime):
+            return entry['hash']
+
+        return None
+
+    only_a = sorted(set(files_a) - set(files_b))
+    only_b = sorted(set(files_b) - set(files_a))
+
+    changed, unsure = [], []
+    for relative_path in sorted(set(files_a) & set(files_b)):
+        stat_a, stat_b = files_a[relative_path], files_b[relative_path]
+
+        if stat_a.st_size != stat_b.st_size:
+            changed.append(relative_path)
+        elif (stat_a.st_dev, stat_a.st_ino) == (stat_b.st_dev, stat_b.st_ino):
+            continue
+        else:
+            hash_a, hash_b = recorded_hash(manifest_a, relative_path, stat_a), recorded_hash(manifest_b, relative_path, stat_b)
+
+            if hash_a and hash_b:
+                if hash_a != hash_b:
+                    changed.append(relative_path)
+            else:
+                unsure.append(relative_path)
+
+    hashes = HashFiles([path.join(tree, relative_path) for relative_path in unsure for tree in [tree_a, tree_b]], FastHashName)
+    changed = sorted(changed + [relative_path for relative_path in unsure if hashes[path.join(tree_a, relative_path)] != hashes[path.join(tree_b, relative_path)]])
+
+    # what the manifests know of where a file came from.
+    def origin(manifest, relative_path):
+        entry = manifest.get('files', {}).get(relative_path)
+        return '%s %s'%(entry['component'], entry['commit'][:12]) if entry else 'unpatched'
+
+    for relative_path in only_a:
+        RoverPrint('%s %s'%(RoverMods.Red('-'), relative_path))
+
+    for relative_path in only_b:
+        RoverPrint('%s %s'%(RoverMods.Green('+'), relative_path))
+
+    for relative_path in changed:
+        RoverPrint('%s %s (%s -> %s)'%(RoverMods.Yellow('M'), relative_path, origin(manifest_a, relative_path), origin(manifest_b, relative_path)))
+
+    RoverPrint(RoverMods.Blue('compared %d files in %.1fs (%d hashed): %d only in %s, %d only in %s, %d differ'%(len(set(files_a) | set(files_b)), time.time() - start, len(hashes),
+                                                                                                              len(only_a), tree_a, len(only_b), tree_b, len(changed))))
+    return len(only_a) + len(only_b) + len(changed)
+
+# reads the commit hashes of coreclr, corefx and core-setup from the version stamps of the payload in to RoverSettings.CommitHashes.
+def ReadPayloadCommitHashes():
+    VersionStamp.LoadCache(RoverSettings.VersionStampCache)
+
+    coreclr_stamp, corefx_stamp, dotnet_stamp = ReadVersionStamps([path.join(RoverSettings.PatchTarget_Shared, 'libcoreclr.so'),
+                                                                   path.join(RoverSettings.PatchTarget_Shared, 'System.Native.so'),
+                                                                   path.join(RoverSettings.PatchTarget_Shared, 'dotnet')])
+    VersionStamp.SaveCache(RoverSettings.VersionStampCache)
+
+    for stamp in [coreclr_stamp, corefx_stamp, dotnet_stamp]:
+        if not stamp.CommitHash:
+            raise ValueError('could not find a commit hash in %s'%(stamp.Path))
+
+        RoverPrint(RoverMods.Blue('%s is at %s'%(path.basename(stamp.Path), RoverMods.White(stamp.CommitHash))))
+
+    RoverSettings.DotNetCommitHash = dotnet_stamp.CommitHash
+    RoverSettings.CommitHashes.update({
+        'coreclr'       : coreclr_stamp.CommitHash,
+        'corefx'        : corefx_stamp.CommitHash,
+        'core-setup'    : dotnet_stamp.CommitHash
+    })
+
+# A graph of steps, each of which starts as soon as the steps it depends on are done. A thread each will do: they spend their
+# time waiting on the network, the disk, or the processes that they spawned.
+class RoverPipeline:
+    def Add(self, name, step, dependencies = []):
+        self.Steps.append((name, step, dependencies))
+        self._done[name] = threading.Event()
+
+    def _run(self, name, step, dependencies):
+        for dependency in dependencies:
+            self._done[dependency].wait()
+
+        start = time.time()
+        try:
+            with RoverSpan(name, 'pipeline'):
+                step()
+        except:
+            RoverSettings._DevMode = True
+            UnexpectedRoverException(sys.exc_info())
+
+        self.Times[name] = (start, time.time())
+        self._done[name].set()
+
+    def Run(self):
+        start = time.time()
+        threads = [threading.Thread(target=self._run, args=step, name=step[0]) for step in self.Steps]
+
+        for thread in threads:
+            thread.daemon = True # a Ctrl+C shouldn't have to wait on them.
+            thread.start()
+
+        # a timeout on join() keeps us responsive to Ctrl+C (a bare join() swallows it in python 2)
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+
+        RoverPrint(RoverMods.Blue('pipeline:'))
+        for name, step, dependencies in sorted(self.Steps, key=lambda step: self.Times[step[0]]):
+            step_start, step_end = self.Times[name]
+            RoverPrint('    %8.1fs %8.1fs  %s'%(step_start - start, step_end - step_start, RoverMods.White(name)))
+
+        RoverPrint('    %8.1fs %8s   %s'%(time.time() - start, '', RoverMods.White('wall time')))
+
+    def __init__(self):
+        self.Steps = []
+        self.Times = {} # {name: (start, end)}
+        self._done = {}
+
+# -pipeline: rather than one phase after the other, every component goes through its own steps as soon as it can. libuv is fetched
+# and built while the payload is still on its way, the other repositories are fetched once the payload tells us their commits, 
+# and each component is patched as soon as it is built.
+def RunPipeline(git_directories):
+    build_components = [component for component in RoverComponents if component in RoverSettings.BuildSet]
+
+    # the builds overlap, so they split the jobs between them just as they do when they start together.
+    jobs = SplitJobs(build_components, RoverSettings.Jobs, max(1, min(len(build_components), RoverSettings.Jobs))) if build_components else {}
+    claims = RoverPatchClaims()
+
+    # the builds start from threads of their own, which must share one budget and one set of costs; so they are worked out before the threads start.
+    RoverSettings.Admission, RoverSettings.Costs
+
+    pipeline = RoverPipeline()
+    pipeline.Add('payload', lambda: SpawnPatchTarget(RoverSettings._binDirectory, RoverSettings.PayloadPath))
+    pipeline.Add('stamps', ReadPayloadCommitHashes, ['payload'])
+
+    if RoverSettings.Patch and RoverSettings.PatchTrees:
+        pipeline.Add('trees', lambda: SpawnPatchTrees(RoverSettings.PatchTrees))
+
+    for component in RoverComponents:
+        # only libuv's commit is known up front.
+        pipeline.Add('fetch %s'%(component), lambda component=component: CloneComponents(RoverSettings._srcDirectory, {component: RoverSettings.CommitHashes[component]}),
+                     [] if component == 'libuv' else ['stamps'])
+
+        if component in build_components:
+            # core-setup's build needs the commit of the payload too, which fetching it already waited on.
+            pipeline.Add('build %s'%(component), lambda component=component: BuildComponents([component], git_directories, jobs), ['fetch %s'%(component)])
+
+        if RoverSettings.Patch:
+            pipeline.Add('patch %s'%(component), lambda component=component: PatchTarget(RoverSettings.PatchTargetPath,
+                                                                                          RoverSettings.CoreCLRBinDirectory,
+                                                                                          RoverSettings.CoreFXBinDirectory,
+                                                                                          RoverSettings.CoreSetupBinDirectory,
+                                                                                          RoverSettings.LibUVBinDirectory,
+                                                                                          [component], claims),
+                         ['payload', ('build %s' if component in build_components else 'fetch %s')%(component)] + (['trees'] if RoverSettings.PatchTrees else []))
+
+    pipeline.Run()
+
 ##
 ## END ROVER FUNCTION DEFINITIONS
 ##
@@ -467,28 +3005,82 @@ if __name__ == "__main__":
     parser.add_argument('-build', metavar='b', nargs='*', default = ['coreclr', 'corefx', 'core-setup', 'libuv'],help='\'Builds\' all native components if no arguments are specified. Otherwise, specify one or more (space separated) arguments from the following : {' 
         + '%s, %s, %s, %s'%(RoverMods.Red('coreclr'), RoverMods.Blue('corefx'), RoverMods.Green('core-setup'), RoverMods.Yellow('libuv') +'}'))
     parser.add_argument('-nopatch', action='store_true', default=False, help='prevents the copying of specific native binaries from the pre-built repositories in to the destination directory.')
-    parser.add_argument('-payload', nargs=1, help='Specify a path to a tarball (something that we can tar xf) that contains a version of the dotnet CLI.')
-    parser.add_argument('-to', type=str, default='%s'%(RoverSettings._Moniker), help='allows you to overwrite the default staging directory (default is %s)'%(RoverSettings._Moniker))
+    parser.add_argument('-patch-link', choices=['reflink', 'copy', 'hardlink'], default=RoverSettings.PatchLinkMode, help='how patched files are placed: reflink clones them where the filesystem can (and copies otherwise), hardlink shares them with the build outputs (default is %s)'%(RoverSettings.PatchLinkMode))
+    parser.add_argument('-payload', nargs=1, help='Specify a path (or an http(s) URL) to a tarball (something that we can tar xf) that contains a version of the dotnet CLI.')
+    parser.add_argument('-patch-trees', nargs='+', default=[], metavar='tree', help='also patch every version of the shared framework, the sdk and the host in these install trees: directories, or payloads (tarballs or their URLs) that are extracted in to <staging directory>/trees first. The outputs are read once and written to all of them.')
+    parser.add_argument('-payload-sha256', type=str, default='', help='the sha256 checksum that the downloaded payload must have.')
+    parser.add_argument('-jobs', type=int, default=None, help='the total number of CPUs shared between the concurrently running builds (default is the number of CPUs available to this process, container limits included)')
+    parser.add_argument('-full-clone', action='store_true', default=False, help='clone the complete history of each repository, rather than fetching just the commit that we build.')
+    parser.add_argument('-git-remote-base', type=str, default='', help='fetch the repositories from <base>/coreclr, <base>/corefx, etc. rather than from GitHub (a URL or a directory of bare repositories)')
+    parser.add_argument('-libuv-commit', type=str, default=LibUVCommitHash, help='the libuv commit to build (default is %s, libuv 1.9.0)'%(LibUVCommitHash))
+    parser.add_argument('-mirror-dir', type=str, default='', help='keep a bare mirror of every repository in this directory, and make the checkouts from it (they share its objects, so do not delete it while they are in use)')
+    parser.add_argument('-cache-dir', type=str, default=RoverSettings.CacheDirectory, help='where built components are cached, keyed by commit hash, RID and build flags (default is %s)'%(RoverSettings.CacheDirectory))
+    parser.add_argument('-cache-size', type=float, default=RoverSettings.CacheSize / (1024 ** 3), help='the size (in GB) past which the least recently used cache entries are evicted (default is %d)'%(RoverSettings.CacheSize / (1024 ** 3)))
+    parser.add_argument('-no-cache', action='store_true', default=False, help='always build, and leave the build cache alone.')
+    parser.add_argument('-stamps', nargs='+', metavar='path', help='prints the version and commit hash of the given binaries (directories are searched for them), then exits.')
+    parser.add_argument('-pipeline', action='store_true', default=False, help='run the steps of each component as soon as what they depend on is done, rather than one phase after the other (libuv is fetched and built while the payload downloads, each component is patched as soon as it is built)')
+    parser.add_argument('-ccache', type=str, default='', metavar='DIR', help='compile the native components through ccache, keeping the caches in this directory (a cache per component), so that rebuilds of the same sources are quick')
+    parser.add_argument('-memory', type=float, default=None, metavar='GB', help='the memory that the builds may take between them; a build waits until its expected peak (learned from the builds before it) fits (default is 90%% of the memory available when the builds start)')
+    parser.add_argument('-verify', nargs='+', metavar='tree', help='checks that the files patched in to these install trees are still what was patched in (see rover.manifest.json in each), then exits. Only the files whose size or mtime changed are hashed.')
+    parser.add_argument('-diff', nargs=2, metavar=('A', 'B'), help='prints how two install trees differ (the files only one of them has, and those that are not the same), then exits. Files are only hashed when their size and their manifests cannot tell.')
+    parser.add_argument('-trace', type=str, default='', metavar='out.json', help='write the timings of every step (wall time, CPU time, peak RSS, bytes written) to this file as a Chrome trace, or as JSON lines if its name ends in .jsonl')
+    parser.add_argument('-to', type=str, default=None, help='allows you to overwrite the default staging directory (default is <RID>-dotnet, e.g. ubuntu.16.04-x64-dotnet, in the current directory)')
 
     args = parser.parse_args()
 
+    if args.stamps:
+        stamp_cache = path.join(path.abspath(path.expanduser(args.cache_dir)), 'version-stamps.json')
+        VersionStamp.LoadCache(stamp_cache)
+
+        for stamp in ReadVersionStamps(args.stamps):
+            RoverPrint('%-40s %-24s %s'%(RoverMods.Yellow(stamp.Path), stamp.Version or '-', RoverMods.White(stamp.CommitHash or '-')))
+
+        VersionStamp.SaveCache(stamp_cache)
+        sys.exit(0)
+
+    if args.verify:
+        sys.exit(1 if sum(VerifyInstallTree(path.abspath(tree)) for tree in args.verify) else 0)
+
+    if args.diff:
+        sys.exit(1 if DiffInstallTrees(path.abspath(args.diff[0]), path.abspath(args.diff[1])) else 0)
+
     if args.payload:
         RoverPrint('is using payload from \'' + RoverMods.White(str(args.payload)) + '\'')
     
     RoverPrint('Building: ' + RoverMods.White(str(args.build)))
     RoverPrint('Patching? ' + RoverMods.White(str(not args.nopatch)))
 
-    RoverSettings.SetWorkingDirectory(normpath(str(args.to)))
+    RoverSettings.SetWorkingDirectory(normpath(str(args.to or RoverSettings._Moniker)))
 
     RoverPrint('Staging in %s'%(RoverSettings._WorkingDirectory))
+    RoverSettings.DetectDevMode()
     RoverSettings.BuildSet = args.build
+    RoverSettings.Jobs = max(1, args.jobs or RoverSettings.Jobs)
+    RoverSettings.ShallowFetch = not args.full_clone
+    RoverSettings.GitRemoteBase = path.abspath(args.git_remote_base) if path.isdir(args.git_remote_base) else args.git_remote_base
+    LibUVCommitHash = args.libuv_commit
+    RoverSettings.MirrorDirectory = path.abspath(path.expanduser(args.mirror_dir)) if args.mirror_dir else ''
+    RoverSettings.UseCache = not args.no_cache
+    RoverSettings.CacheDirectory = path.abspath(path.expanduser(args.cache_dir))
+    RoverSettings.VersionStampCache = path.join(RoverSettings.CacheDirectory, 'version-stamps.json')
+    RoverSettings.CacheSize = int(args.cache_size * (1024 ** 3))
+    RoverTrace.Path = path.abspath(args.trace) if args.trace else ''
+    if args.memory:
+        RoverSettings.Admission = RoverAdmission(int(args.memory * 1024 ** 2))
+
+    RoverSettings.CompilerCacheDirectory = path.abspath(path.expanduser(args.ccache)) if args.ccache else ''
 
     # I am guessing that users are more inclined to want patching to happen whenever it can, and so I ask
     # for specificity in the instances that they do not want patching.
     RoverSettings.Patch = not args.nopatch 
+    RoverSettings.PatchLinkMode = args.patch_link
 
     if args.payload:
         RoverSettings.PayloadPath = args.payload[0]
+
+    RoverSettings.PayloadSHA256 = args.payload_sha256.lower()
+    RoverSettings.PatchTrees = [tree if IsURL(tree) else path.abspath(tree) for tree in args.patch_trees]
+    RoverSettings.Pipeline = args.pipeline
     ## 
     ## END COMMAND-LINE BEHAVIOR
     ##
@@ -512,8 +3104,6 @@ if __name__ == "__main__":
     RoverSettings.CoreSetupBinDirectory = default_core_setup_cli_bin_directory
     RoverSettings.LibUVBinDirectory     = default_libuv_bin_directory
     
-    platform_info                       = platform.uname()    
-    this_distro_name                    = str(platform.linux_distribution()[0]).lower()
 
     ##
     ## END DECLARATIONS
@@ -542,33 +3132,61 @@ if __name__ == "__main__":
         if not path.exists(RoverSettings._binDirectory):
             makedirs(RoverSettings._binDirectory)
 
-        SpawnPatchTarget(RoverSettings._binDirectory, RoverSettings.PayloadPath)
-        
-        # Fetch the commit hashes from the native files.
-        coreclr_output      = check_output('strings libcoreclr.so | grep @\(#\)',     shell = True, cwd=RoverSettings.PatchTarget_Shared)
-        corefx_output       = check_output('strings System.Native.so  | grep @\(#\)', shell = True, cwd=RoverSettings.PatchTarget_Shared)
+        if RoverSettings.CompilerCacheDirectory:
+            RoverSettings.CompilerCacheLinks = MakeCompilerCacheLinks(path.join(RoverSettings._objDirectory, 'ccache'))
 
-        dotnet_commit_hash  = check_output('strings dotnet  | grep "[a-f0-9]\{40\}"',  shell = True, cwd=RoverSettings.PatchTarget_Shared)
-        coreclr_commit_hash = coreclr_output[find(coreclr_output, 'Commit Hash: ') + len('Commit Hash: '):len(coreclr_output)]
-        corefx_commit_hash  = corefx_output[find(corefx_output, 'Commit Hash: ') + len('Commit Hash: '):len(corefx_output)]
-        
-        RoverSettings.DotNetCommitHash = dotnet_commit_hash
-
-        CloneRepositories(RoverSettings._srcDirectory,  
-                            coreclr_commit_hash,
-                            corefx_commit_hash,
-                            dotnet_commit_hash)
-
-        BuildNativeComponents(coreclr_working_git_directory, 
-                            corefx_working_git_directory,  
-                            core_setup_working_git_directory,  
-                            libuv_working_git_directory)
-
-        PatchTarget(RoverSettings.PatchTargetPath,
-                    RoverSettings.CoreCLRBinDirectory,      
-                    RoverSettings.CoreFXBinDirectory,
-                    RoverSettings.CoreSetupBinDirectory,
-                    RoverSettings.LibUVBinDirectory)
+        # the span of the whole run, which the phases nest under.
+        run_span = RoverSpan('rover', 'run', pipeline=RoverSettings.Pipeline).__enter__()
+        run_memory = RoverMemorySampler().__enter__()
+
+        # the rest of the commit hashes come from the payload (see ReadPayloadCommitHashes)
+        RoverSettings.CommitHashes = { 'libuv' : LibUVCommitHash }
+
+        if RoverSettings.Pipeline:
+            RunPipeline({
+                'coreclr'       : coreclr_working_git_directory,
+                'corefx'        : corefx_working_git_directory,
+                'core-setup'    : core_setup_working_git_directory,
+                'libuv'         : libuv_working_git_directory
+            })
+        else:
+            with RoverSpan('SpawnPatchTarget', payload=RoverSettings.PayloadPath):
+                SpawnPatchTarget(RoverSettings._binDirectory, RoverSettings.PayloadPath)
+
+            if RoverSettings.Patch and RoverSettings.PatchTrees:
+                with RoverSpan('SpawnPatchTrees', trees=len(RoverSettings.PatchTrees)):
+                    SpawnPatchTrees(RoverSettings.PatchTrees)
+            
+            # Fetch the commit hashes from the native files.
+            with RoverSpan('ReadVersionStamps'):
+                ReadPayloadCommitHashes()
+
+            with RoverSpan('CloneRepositories'):
+                CloneRepositories(RoverSettings._srcDirectory,  
+                                    RoverSettings.CommitHashes['coreclr'],
+                                    RoverSettings.CommitHashes['corefx'],
+                                    RoverSettings.CommitHashes['core-setup'])
+
+            with RoverSpan('BuildNativeComponents', jobs=RoverSettings.Jobs):
+                BuildNativeComponents(coreclr_working_git_directory, 
+                                    corefx_working_git_directory,  
+                                    core_setup_working_git_directory,  
+                                    libuv_working_git_directory)
+
+            with RoverSpan('PatchTarget', link=RoverSettings.PatchLinkMode):
+                PatchTarget(RoverSettings.PatchTargetPath,
+                            RoverSettings.CoreCLRBinDirectory,      
+                            RoverSettings.CoreFXBinDirectory,
+                            RoverSettings.CoreSetupBinDirectory,
+                            RoverSettings.LibUVBinDirectory)
+
+        run_memory.__exit__(None, None, None)
+        run_span.Args.update({'rid': RoverSettings._Rid, 'commits': RoverSettings.CommitHashes, 'peak_tree_rss_kb': run_memory.Peak})
+        run_span.__exit__(None, None, None)
+
+        if RoverTrace.Path:
+            RoverTrace.Save()
+            RoverPrint(RoverMods.Blue('wrote a trace of %d steps to %s'%(len(RoverTrace.Events), RoverMods.Yellow(RoverTrace.Path))))
 
         RoverPrint(RoverMods.Green('spawned a \'dotnet\' in %s'%(RoverMods.Yellow('./' + path.relpath(RoverSettings.PatchTargetPath) + '/'))) + RoverMods.Green('(enjoy!)'))
     except: